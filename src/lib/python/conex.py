@@ -9,6 +9,9 @@ import subprocess
 
 delay=0.5
 
+# controller states (TS command) of a stage in motion: HOMING, MOVING
+moving_states = ('1E', '28')
+
 class conex(object):
     def __init__(self):
         self.s=None
@@ -22,19 +25,56 @@ class conex(object):
             self.s=serial.Serial(byid,921600,timeout=0.5)
         #self.s.open()
 
+    def ask(self, cmd, timeout=0.5):
+        # sends cmd and returns the reply as a list of lines, like
+        # readlines(), as soon as its end has arrived ([] after timeout s)
+        self.s.write(cmd)
+        self.s.timeout = timeout
+        line = self.s.readline()
+        if line == "":
+            return []
+        return [line]
+
+    def state(self):
+        # controller state (2 hex digits), None if it does not answer
+        reply = self.ask("1TS\r\n")
+        if reply == [] or not reply[0].startswith("1TS"):
+            return None
+        return reply[0][7:9].upper()
+
+    def moving(self):
+        # True if the stage is moving, None if unknown
+        state = self.state()
+        if state is None:
+            return None
+        return state in moving_states
+
+    def wait(self, timeout=0, poll=0.05):
+        # waits until the stage has stopped (gives up with an IOError after
+        # timeout seconds, if not 0)
+        t0 = time.time()
+        while self.moving():
+            if timeout and time.time()-t0 > timeout:
+                raise IOError("conex still moving after %.1f s" % (timeout,))
+            time.sleep(poll)
+
     def home(self):
         self.s.write("1RS\r\n")
-        time.sleep(delay)
+        # the controller answers again once it has reset (NOT REFERENCED)
+        t0 = time.time()
+        state = None
+        while (state is None or not state.startswith("0")) and time.time()-t0 < 20*delay:
+            state = self.state()
         self.s.write("1OR\r\n")
+        self.s.flush()
     
     def move(self,POS):
+        # returns as soon as the command is sent; see wait()
         self.s.write("1PA"+str(POS)+"\r\n")
-        time.sleep(delay)
+        self.s.flush()
 
     def pos(self):
-        self.s.write("1TP\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         print pos
         pos=pos[0]
         pos=pos[3:]
@@ -43,9 +83,7 @@ class conex(object):
         return(pos)#print pos
 
     def status(self,wheel=""):
-        self.s.write("1TP\r\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         print pos
         pos=pos[0]
         pos=pos[3:]
@@ -87,9 +125,7 @@ class conex(object):
             print "Wheel is not on a slot. Try homing."
 
     def Lyot_status(self):
-        self.s.write("1TP\r\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         pos=pos[0]
         pos=pos[3:]
         pos=pos[:-2]
@@ -113,9 +149,7 @@ class conex(object):
             print "Wheel is not on a slot. Try homing."
 
     def chariswhl_status(self):
-        self.s.write("1TP\r\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         pos=pos[0]
         pos=pos[3:]
         pos=pos[:-2]
@@ -148,9 +182,7 @@ class conex(object):
             print "Wheel is not on a slot. Try homing."
 
     def mkidswhl_status(self):
-        self.s.write("1TP\r\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         pos=pos[0]
         pos=pos[3:]
         pos=pos[:-2]
@@ -183,9 +215,7 @@ class conex(object):
             print "Wheel is not on a slot. Try homing."
 
     def fwheel_status(self):
-        self.s.write("1TP\r\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         pos=pos[0]
         pos=pos[3:]
         pos=pos[:-2]
@@ -218,9 +248,7 @@ class conex(object):
             print "Wheel is not on a slot. Try homing."
 
     def pywfs_pickoff_status(self):
-        self.s.write("1TP\r\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         pos=pos[0]
         pos=pos[3:]
         pos=pos[:-2]
@@ -265,9 +293,7 @@ class conex(object):
             print "Wheel is not on a slot. Try homing."
 
     def vampfirst_status(self):
-        self.s.write("1TP\r\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         pos=pos[0]
         pos=pos[3:]
         pos=pos[:-2]
@@ -306,9 +332,7 @@ class conex(object):
             print "Wheel is not on a slot. Try homing."
 
     def status_calsrc(self):
-        self.s.write("1TP\r\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         pos=pos[0][3:-2]
         pos=round(float(pos),1)
         print pos
@@ -320,9 +344,7 @@ class conex(object):
             
 
     def src_status(self):
-        self.s.write("1TP\r\n")
-        time.sleep(delay)
-        pos=self.s.readlines()
+        pos=self.ask("1TP\r\n")
         pos=pos[0]
         pos=pos[3:]
         pos=pos[:-2]
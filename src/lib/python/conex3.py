@@ -10,6 +10,9 @@ import logit #Custom logging library
 
 delay = 0.5
 
+# controller states (TS command) of a stage in motion: HOMING, MOVING
+moving_states = ('1E', '28')
+
 class conex(object):
     def __init__(self):
         self.s = None
@@ -24,38 +27,90 @@ class conex(object):
             opened = False
         return opened
 
+    def query(self, cmd, timeout=delay):
+        # sends cmd and returns its reply line as soon as it has arrived
+        # (empty after timeout seconds)
+        self.s.write(cmd.encode())
+        self.s.timeout = timeout
+        return self.s.readline().decode()
+
+    def state(self):
+        # controller state (2 hex digits), None if it does not answer
+        reply = self.query("1TS\r\n")
+        if not reply.startswith("1TS"):
+            return None
+        return reply[7:9].upper()
+
+    def moving(self):
+        # True if the stage is moving, None if unknown
+        state = self.state()
+        if state is None:
+            return None
+        return state in moving_states
+
     def home(self, devname):
         self.s.write("1RS\r\n".encode())
-        time.sleep(delay)
+        # the controller answers again once it has reset (NOT REFERENCED)
+        t0 = time.time()
+        state = None
+        while (state is None or not state.startswith("0")) and time.time()-t0 < 20*delay:
+            state = self.state()
         self.s.write("1OR\r\n".encode())
+        self.s.flush()
         logit.logit(devname,'Homed')
 
     def move(self, pos, devname, log=True):
+        # returns as soon as the command is sent; see wait()
         self.s.write(str.encode("1PA"+str(pos)+"\r\n"))
-        time.sleep(delay)
+        self.s.flush()
         if log:
             logit.logit(devname,'moved_to_'+str(pos))
 
     def push(self, step, devname, log=True):
         self.s.write(str.encode("1PR"+str(step)+"\r\n"))
-        time.sleep(delay)
+        self.s.flush()
         if log:
             logit.logit(devname,'pushed_by_'+str(step))
 
-    def status(self, devname):
-        self.s.write("1TP\r\n".encode())
-        time.sleep(delay)
-        pos = self.s.readlines()
+    def position(self):
+        # current position, without updating the status
+        pos = self.query("1TP\r\n")
         try:
-            pos = pos[0]
             pos = pos[3:]
             pos = pos[:-2]
             pos = round(float(pos), 3)
-            subprocess.call(["/home/scexao/bin/scexaostatus", "set", devname, str(pos)])
         except:
+            # the raw reply
+            raise ValueError(pos)
+        return pos
+
+    def status(self, devname):
+        try:
+            pos = self.position()
+            subprocess.call(["/home/scexao/bin/scexaostatus", "set", devname, str(pos)])
+        except ValueError as e:
+            pos = e.args[0]
             print(pos)
             print("NO STATUS SENT")
         return pos
+
+    def wait(self, devname, delay=0.2, timeout=0):
+        # waits until the controller reports that the stage has stopped,
+        # checking every delay seconds, and returns its position (gives up
+        # with an IOError after timeout seconds, if not 0).  If the state
+        # cannot be read, waits until two positions agree instead.
+        t0 = time.time()
+        pos0 = None
+        while True:
+            moving = self.moving()
+            if not moving:
+                pos = self.status(devname)
+                if moving is not None or pos == pos0:
+                    return pos
+                pos0 = pos
+            if timeout and time.time()-t0 > timeout:
+                raise IOError("%s still moving after %.1f s" % (devname, timeout))
+            time.sleep(delay)
         
     def close(self):
         self.s.close()
@@ -23,6 +23,7 @@ import time
 home = os.getenv('HOME')
 sys.path.append(home+'/src/lib/python/')
 import logit #Custom logging library
+import devserver #Device server, or the drivers if it is not running
 
 # =====================================================================
 # =====================================================================
@@ -41,7 +42,7 @@ class devices:
         self.devname = devname
         self.description = description
 
-        if args != [] and "--help1" in args[0].lower():
+        if args and "--help1" in args[0].lower():
             self.quickhelp()
             sys.exit()
 
@@ -56,27 +57,25 @@ class devices:
         self.nbdev = len(conexnames)+len(zabernames)
 
         if conexnames != []:
-            import conex3 as conex
-            self.con = conex.conex()
+            self.con = devserver.conex()
             if self.nbdev == 1:
                 self.devnamec = devname
                 conu = 0
                 zabu = 1
             else:
-                if args != []:
+                if args:
                     self.devnamec = devname+'_'+args[0]
                 conu = 1
                 zabu = 1
 
         if zabernames != []:
-            import zaber_chain3 as zaber
-            self.zab = zaber.zaber()
+            self.zab = devserver.zaber()
             if self.nbdev == 1:
                 self.devnamez = devname
                 zabu = 0
                 conu = 1
             else:
-                if args != []:
+                if args:
                     self.devnamez = devname+'_'+args[0]
                 zabu = 1
                 conu = 1
@@ -84,7 +83,7 @@ class devices:
         filename = home+"/bin/devices/conf/conf_"+devname+".txt"
         filename2 = home+"/bin/devices/conf/archive/conf_"+devname+".txt"
 
-        slots = [line.rstrip('\n') for line in open(filename)]
+        slots = list(devserver.conf(devname))
         self.nslots = len(slots)
         nparam = len(slots[0].split(';'))
         self.nend = nparam-1
@@ -99,12 +98,17 @@ class devices:
         if self.nbdev == 1:
             self.col = 2
         else:
-            if args != []:
+            if args:
                 try:
                     self.col = (conexnames+zabernames).index(args[0])+2
                 except:
                     self.col = 2
 
+        if args is None:
+            # used as a driver (e.g. by moveplan), no command to run
+            self.slots = slots
+            return
+
         na = args.__len__()  # number of arguments
 
         if args == []:
@@ -328,33 +332,53 @@ CONTENT:""")
         print("%20s       %s" % (self.devname,self.description))
 
     # -----------------------------------------------------------------
-    def conex_home(self, conu):
+    def set_slot_st(self, pos, paramf):
+        # status of a single stage device, from the slot at position pos
+        if self.nbdev == 1:
+            if pos in paramf:
+                for i in range(self.nslots):
+                    if pos == paramf[i]:
+                        if self.color_st:
+                            exec("subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', self.param1[i][:16], self.param%d[i]])" % (self.nend,), globals(), locals())
+                        else:
+                            subprocess.call([home+"/bin/scexaostatus", "set", self.devname+"_st", self.param1[i][:16]])
+            else:
+                subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+
+    # -----------------------------------------------------------------
+    def conex_wait(self, delay):
+        # waits for the conex to stop, then updates the device status
+        d = locals()
+        exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
+        paramf = d['paramf']
+        subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+        pos = self.con.wait(self.devnamec, delay)
+        self.set_slot_st(pos, paramf)
+        return pos
+
+    # -----------------------------------------------------------------
+    def zaber_wait(self, delay):
+        # waits for the zaber to stop, then updates the device status
+        d = locals()
+        exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
+        paramf = d['paramf']
+        subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+        pos = self.zab.wait(self.zaberid, self.devnamez, delay)
+        self.set_slot_st(pos, paramf)
+        return pos
+
+    # -----------------------------------------------------------------
+    def conex_open(self):
         opened = self.con.open(self.conexid)
         if not opened:
             subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'NOT CONNECTED', '0'])
             sys.exit()
+
+    # -----------------------------------------------------------------
+    def conex_home(self, conu):
+        self.conex_open()
         self.con.home(self.devnamec)
-        pos0 = -1000.
-        d = locals()
-        exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
-        paramf = d['paramf']
-        pos = self.con.status(self.devnamec)
-        subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
-        while pos0 != pos:
-            pos0 = pos
-            pos = self.con.status(self.devnamec)
-            time.sleep(0.2)
-            subprocess.call([home+"/bin/scexaostatus", "set", self.devnamec, str(pos)])
-            if self.nbdev == 1:
-                if pos in paramf:
-                    for i in range(self.nslots):
-                        if pos == paramf[i]:
-                            if self.color_st:
-                                exec("subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', self.param1[i][:16], self.param%d[i]])" % (self.nend,), globals(), locals())
-                            else:
-                                subprocess.call([home+"/bin/scexaostatus", "set", self.devname+"_st", self.param1[i][:16]])
-                else:
-                    subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+        self.conex_wait(0.2)
         self.con.close()
 
     # -----------------------------------------------------------------
@@ -386,96 +410,27 @@ CONTENT:""")
 
     # -----------------------------------------------------------------
     def conex_goto(self, pos, conu):
-        opened = self.con.open(self.conexid)
-        if not opened:
-            subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'NOT CONNECTED', '0'])
-            sys.exit()
+        self.conex_open()
         self.con.move(pos, self.devnamec)
-        pos0 = -1000.
-        d = locals()
-        exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
-        paramf = d['paramf']
-        pos = self.con.status(self.devnamec)
-        subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
-        while pos0 != pos:
-            pos0 = pos
-            pos = self.con.status(self.devnamec)
-            time.sleep(0.1)
-            subprocess.call([home+"/bin/scexaostatus", "set", self.devnamec, str(pos)])
-            if self.nbdev == 1:
-                if pos in paramf:
-                    for i in range(self.nslots):
-                        if pos == paramf[i]:
-                            if self.color_st:
-                                exec("subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', self.param1[i][:16], self.param%d[i]])" % (self.nend,), globals(), locals())
-                            else:
-                                subprocess.call([home+"/bin/scexaostatus", "set", self.devname+"_st", self.param1[i][:16]])
-                else:
-                    subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+        self.conex_wait(0.1)
         self.con.close()
 
     # -----------------------------------------------------------------
     def conex_push(self, step, conu):
-        opened = self.con.open(self.conexid)
-        if not opened:
-            subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'NOT CONNECTED', '0'])
-            sys.exit()
+        self.conex_open()
         self.con.push(step, self.devnamec)
-        pos0 = -1000.
-        d = locals()
-        exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
-        paramf = d['paramf']
-        pos = self.con.status(self.devnamec)
-        subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
-        while pos0 != pos:
-            pos0 = pos
-            pos = self.con.status(self.devnamec)
-            time.sleep(0.1)
-            subprocess.call([home+"/bin/scexaostatus", "set", self.devnamec, str(pos)])
-            if self.nbdev == 1:
-                if pos in paramf:
-                    for i in range(self.nslots):
-                        if pos == paramf[i]:
-                            if self.color_st:
-                                exec("subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', self.param1[i][:16], self.param%d[i]])" % (self.nend,), globals(), locals())
-                            else:
-                                subprocess.call([home+"/bin/scexaostatus", "set", self.devname+"_st", self.param1[i][:16]])
-                else:
-                    subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+        self.conex_wait(0.1)
         self.con.close()
 
     # -----------------------------------------------------------------
     def conex_goto_slot(self, slot, conu):
         if (1 <= slot <= self.nslots):
-            opened = self.con.open(self.conexid)
-            if not opened:
-                subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'NOT CONNECTED', '0'])
-                sys.exit()
+            self.conex_open()
             d = locals()
             exec("pos = self.param%d[slot-1]" %(self.col,), globals(), d)
             pos = d['pos']
             self.con.move(float(pos), self.devnamec, log=False)
-            pos0 = -1000.
-            d = locals()
-            exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
-            paramf = d['paramf']
-            pos = self.con.status(self.devnamec)
-            subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
-            while pos0 != pos:
-                pos0 = pos
-                pos = self.con.status(self.devnamec)
-                time.sleep(0.2)
-                subprocess.call([home+"/bin/scexaostatus", "set", self.devnamec, str(pos)])
-                if self.nbdev == 1:
-                    if pos in paramf:
-                        for i in range(self.nslots):
-                            if pos == paramf[i]:
-                                if self.color_st:
-                                    exec("subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', self.param1[i][:16], self.param%d[i]])" % (self.nend,), globals(), locals())
-                                else:
-                                    subprocess.call([home+"/bin/scexaostatus", "set", self.devname+"_st", self.param1[i][:16]])
-                    else:
-                        subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+            self.conex_wait(0.2)
             self.con.close()
             logit.logit(self.devnamec,'moved_to_slot_'+str(slot))
         else:
@@ -485,27 +440,7 @@ CONTENT:""")
     def zaber_home(self, zabu):
         self.zab.open(self.zaberchain)
         self.zab.home(self.zaberid, self.devnamez)
-        pos0 = -1.5
-        d = locals()
-        exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
-        paramf = d['paramf']
-        pos = self.zab.status(self.zaberid, self.devnamez)
-        subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
-        while pos0 != pos:
-            pos0 = pos
-            pos = self.zab.status(self.zaberid, self.devnamez)
-            time.sleep(0.2)
-            subprocess.call([home+"/bin/scexaostatus", "set", self.devnamez, str(pos)])
-            if self.nbdev == 1:
-                if pos in paramf:
-                    for i in range(self.nslots):
-                        if pos == paramf[i]:
-                            if self.color_st:
-                                exec("subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', self.param1[i][:16], self.param%d[i]])" % (self.nend,), globals(), locals())
-                            else:
-                                subprocess.call([home+"/bin/scexaostatus", "set", self.devname+"_st", self.param1[i][:16]])
-                else:
-                    subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+        self.zaber_wait(0.2)
         self.zab.close()
 
     # -----------------------------------------------------------------
@@ -536,54 +471,14 @@ CONTENT:""")
     def zaber_goto(self, pos, zabu):
         self.zab.open(self.zaberchain)
         self.zab.move(self.zaberid, pos, self.devnamez)
-        pos0 = -1.5
-        d = locals()
-        exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
-        paramf = d['paramf']
-        pos = self.zab.status(self.zaberid, self.devnamez)
-        subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
-        while pos0 != pos:
-            pos0 = pos
-            pos = self.zab.status(self.zaberid, self.devnamez)
-            time.sleep(0.2)
-            subprocess.call([home+"/bin/scexaostatus", "set", self.devnamez, str(pos)])
-            if self.nbdev == 1:
-                if pos in paramf:
-                    for i in range(self.nslots):
-                        if pos == paramf[i]:
-                            if self.color_st:
-                                exec("subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', self.param1[i][:16], self.param%d[i]])" % (self.nend,), globals(), locals())
-                            else:
-                                subprocess.call([home+"/bin/scexaostatus", "set", self.devname+"_st", self.param1[i][:16]])
-                else:
-                    subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+        self.zaber_wait(0.2)
         self.zab.close()
 
     # -----------------------------------------------------------------
     def zaber_push(self, step, zabu):
         self.zab.open(self.zaberchain)
         self.zab.push(self.zaberid, step, self.devnamez)
-        pos0 = -1.5
-        d = locals()
-        exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
-        paramf = d['paramf']
-        pos = self.zab.status(self.zaberid, self.devnamez)
-        subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
-        while pos0 != pos:
-            pos0 = pos
-            pos = self.zab.status(self.zaberid, self.devnamez)
-            time.sleep(0.2)
-            subprocess.call([home+"/bin/scexaostatus", "set", self.devnamez, str(pos)])
-            if self.nbdev == 1:
-                if pos in paramf:
-                    for i in range(self.nslots):
-                        if pos == paramf[i]:
-                            if self.color_st:
-                                exec("subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', self.param1[i][:16], self.param%d[i]])" % (self.nend,), globals(), locals())
-                            else:
-                                subprocess.call([home+"/bin/scexaostatus", "set", self.devname+"_st", self.param1[i][:16]])
-                else:
-                    subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+        self.zaber_wait(0.2)
         self.zab.close()
 
     # -----------------------------------------------------------------
@@ -595,27 +490,7 @@ CONTENT:""")
             pos = d['pos']
             if int(pos) > 0:
                 self.zab.move(self.zaberid, int(pos), self.devnamez, log=False)
-                pos0 = -1.5
-                d = locals()
-                exec("paramf = list(map(float, self.param%d))" %(self.col,), globals(), d)
-                paramf = d['paramf']
-                pos = self.zab.status(self.zaberid, self.devnamez)
-                subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
-                while pos0 != pos:
-                    pos0 = pos
-                    pos = self.zab.status(self.zaberid, self.devnamez)
-                    time.sleep(0.2)
-                    subprocess.call([home+"/bin/scexaostatus", "set", self.devnamez, str(pos)])
-                    if self.nbdev == 1:
-                        if pos in paramf:
-                            for i in range(self.nslots):
-                                if pos == paramf[i]:
-                                    if self.color_st:
-                                        exec("subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', self.param1[i][:16], self.param%d[i]])" % (self.nend,), globals(), locals())
-                                    else:
-                                        subprocess.call([home+"/bin/scexaostatus", "set", self.devname+"_st", self.param1[i][:16]])
-                        else:
-                            subprocess.call([home+'/bin/scexaostatus', 'set', self.devname+'_st', 'UNKNOWN', '3'])
+                self.zaber_wait(0.2)
                 self.zab.close()
                 logit.logit(self.devnamez,'moved_to_slot_'+str(slot))
         else:
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+# =====================================================================
+#  Device server: a long-running process that owns the serial ports of
+#  the conex stages and zaber chains, so that the device scripts do not
+#  have to open, flush and close them for every command.
+#
+#  - commands to the same port are serialized, commands to different
+#    ports run in parallel
+#  - the last known position of every stage is kept, and the status is
+#    only updated when it changes
+#  - the conf_*.txt slot tables are read once, and again when they change
+#
+#  The server is reached with XML-RPC on a local port.  conex() and zaber()
+#  return clients with the same methods as conex3.conex and
+#  zaber_chain3.zaber when the server is running, and the drivers
+#  themselves otherwise, so the device scripts work either way; conf()
+#  likewise returns the slot table kept by the server, or reads the file.
+#
+#  Start it with bin/device_server.
+# =====================================================================
+
+import os
+import sys
+import time
+import socket
+import threading
+import subprocess
+
+try:
+    from SimpleXMLRPCServer import SimpleXMLRPCServer
+    from SocketServer import ThreadingMixIn
+    from xmlrpclib import ServerProxy
+except ImportError:
+    from xmlrpc.server import SimpleXMLRPCServer
+    from socketserver import ThreadingMixIn
+    from xmlrpc.client import ServerProxy
+
+home = os.getenv('HOME')
+sys.path.append(home+'/src/lib/python/')
+import logit #Custom logging library
+
+host = "127.0.0.1"
+port = 7860
+
+confdir = home+"/bin/devices/conf/"
+
+# slot tables read by read_conf(), by device name: (mtime, lines)
+confs = {}
+
+# =====================================================================
+#                           slot tables
+# =====================================================================
+
+def read_conf(devname):
+    # lines of the conf_<devname>.txt slot table, read again only when the
+    # file has changed
+    filename = confdir+"conf_"+devname+".txt"
+    mtime = os.stat(filename).st_mtime
+    cached = confs.get(devname)
+    if cached is None or cached[0] != mtime:
+        slots = [line.rstrip('\n') for line in open(filename)]
+        cached = (mtime, slots)
+        confs[devname] = cached
+    return cached[1]
+
+def publish(devname, pos):
+    subprocess.call([home+"/bin/scexaostatus", "set", devname, str(pos)])
+
+# =====================================================================
+#                          server side
+# =====================================================================
+
+class conex_port(object):
+    # a conex stage, its open connection and the lock serializing its
+    # commands
+    def __init__(self, devid):
+        import conex3
+        self.devid = devid
+        self.con = conex3.conex()
+        self.lock = threading.Lock()
+        self.opened = False
+
+    def open(self):
+        # (re)opens the connection if needed
+        if not self.opened:
+            self.opened = self.con.open(self.devid)
+        return self.opened
+
+    def call(self, name, *args):
+        with self.lock:
+            if not self.open():
+                raise IOError("Conex %s is not connected" % (self.devid,))
+            try:
+                return getattr(self.con, name)(*args)
+            except (IOError, OSError):
+                # reopen on the next command
+                self.close()
+                raise
+
+    def close(self):
+        if self.opened:
+            self.opened = False
+            try:
+                self.con.close()
+            except Exception:
+                pass
+
+class zaber_port(object):
+    # a chain of zaber stages on one serial port
+    def __init__(self, zaberchain):
+        import zaber_chain3
+        self.zaberchain = zaberchain
+        self.zab = zaber_chain3.zaber()
+        self.lock = threading.Lock()
+        self.opened = False
+
+    def open(self):
+        if not self.opened:
+            try:
+                self.zab.open(self.zaberchain)
+                self.opened = True
+            except SystemExit:
+                # the driver exits when the chain is not connected
+                self.opened = False
+        return self.opened
+
+    def call(self, name, *args):
+        with self.lock:
+            if not self.open():
+                raise IOError("Zaber chain %s not connected" % (self.zaberchain,))
+            try:
+                return getattr(self.zab, name)(*args)
+            except (IOError, OSError):
+                self.close()
+                raise
+
+    def close(self):
+        if self.opened:
+            self.opened = False
+            try:
+                self.zab.close()
+            except Exception:
+                pass
+
+class server(object):
+    # the functions served to the clients
+
+    def __init__(self):
+        self.conexes = {}
+        self.zabers = {}
+        self.lock = threading.Lock()
+        # last known position, by device name
+        self.positions = {}
+
+    def _conex(self, devid):
+        with self.lock:
+            if devid not in self.conexes:
+                self.conexes[devid] = conex_port(devid)
+            return self.conexes[devid]
+
+    def _zaber(self, zaberchain):
+        with self.lock:
+            if zaberchain not in self.zabers:
+                self.zabers[zaberchain] = zaber_port(zaberchain)
+            return self.zabers[zaberchain]
+
+    def _update(self, devname, pos):
+        # keeps the position, and updates the status if it changed
+        if self.positions.get(devname) != pos:
+            self.positions[devname] = pos
+            publish(devname, pos)
+        return pos
+
+    def _read(self, read, devname):
+        try:
+            return self._update(devname, read())
+        except ValueError:
+            # unreadable reply, try again
+            return None
+
+    def _wait(self, busy, read, devname, delay, timeout):
+        # polls busy() until the stage has stopped, then returns its
+        # position read().  The port is only locked for each poll, so that
+        # the other stages of a zaber chain can be used in the meantime.
+        # If busy() cannot tell (None), waits until two positions agree.
+        t0 = time.time()
+        pos0 = None
+        while True:
+            moving = busy()
+            if not moving:
+                pos = self._read(read, devname)
+                if pos is not None and (moving is not None or pos == pos0):
+                    return pos
+                pos0 = pos
+            if timeout and time.time() - t0 > timeout:
+                raise IOError("%s still moving after %.1f s" % (devname, timeout))
+            time.sleep(delay)
+
+    # -------------------------- general ------------------------------
+    def ping(self):
+        return True
+
+    def conf(self, devname):
+        return read_conf(devname)
+
+    def get_positions(self):
+        return self.positions
+
+    def close(self):
+        # closes all the ports (they are reopened on the next command)
+        for p in list(self.conexes.values()) + list(self.zabers.values()):
+            with p.lock:
+                p.close()
+        return True
+
+    # --------------------------- conex -------------------------------
+    def conex_open(self, devid):
+        c = self._conex(devid)
+        with c.lock:
+            return c.open()
+
+    def conex_home(self, devid, devname):
+        self._conex(devid).call('home', devname)
+        return True
+
+    def conex_move(self, devid, pos, devname, log=True):
+        self._conex(devid).call('move', pos, devname, log)
+        return True
+
+    def conex_push(self, devid, step, devname, log=True):
+        self._conex(devid).call('push', step, devname, log)
+        return True
+
+    def conex_status(self, devid, devname):
+        try:
+            pos = self._conex(devid).call('position')
+        except ValueError as e:
+            # the raw reply, as conex3.conex.status
+            return str(e.args[0])
+        return self._update(devname, pos)
+
+    def conex_wait(self, devid, devname, delay=0.2, timeout=0):
+        c = self._conex(devid)
+        return self._wait(lambda: c.call('moving'), lambda: c.call('position'), devname, delay, timeout)
+
+    # --------------------------- zaber -------------------------------
+    def zaber_open(self, zaberchain):
+        z = self._zaber(zaberchain)
+        with z.lock:
+            return z.open()
+
+    def zaber_home(self, zaberchain, idn, devname, log=True):
+        self._zaber(zaberchain).call('home', idn, devname, log)
+        return True
+
+    def zaber_move(self, zaberchain, idn, pos, devname, log=True, delay=0.1):
+        self._zaber(zaberchain).call('move', idn, pos, devname, log, delay)
+        return True
+
+    def zaber_push(self, zaberchain, idn, step, devname, log=True, delay=0.1):
+        self._zaber(zaberchain).call('push', idn, step, devname, log, delay)
+        return True
+
+    def zaber_status(self, zaberchain, idn, devname):
+        pos = self._zaber(zaberchain).call('position', idn)
+        return self._update(devname, pos)
+
+    def zaber_wait(self, zaberchain, idn, devname, delay=0.2, timeout=0):
+        z = self._zaber(zaberchain)
+        return self._wait(lambda: z.call('busy', idn), lambda: z.call('position', idn), devname, delay, timeout)
+
+class rpc_server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve(port=port):
+    srv = rpc_server((host, port), logRequests=False, allow_none=True)
+    srv.register_instance(server())
+    print("device server listening on %s:%d" % (host, port))
+    logit.logit('devserver', 'started')
+    try:
+        srv.serve_forever()
+    finally:
+        logit.logit('devserver', 'stopped')
+
+# =====================================================================
+#                          client side
+# =====================================================================
+
+def running(port=port):
+    # True if a device server answers on port
+    try:
+        s = socket.create_connection((host, port), 0.2)
+        s.close()
+        return True
+    except socket.error:
+        return False
+
+def proxy(port=port):
+    return ServerProxy("http://%s:%d/" % (host, port), allow_none=True)
+
+class conex_client(object):
+    # same methods as conex3.conex, through the device server
+    def __init__(self, port=port):
+        self.srv = proxy(port)
+        self.devid = None
+
+    def open(self, devid):
+        self.devid = devid
+        opened = self.srv.conex_open(devid)
+        if not opened:
+            print("Conex %s is not connected" %devid)
+        return opened
+
+    def home(self, devname):
+        self.srv.conex_home(self.devid, devname)
+
+    def move(self, pos, devname, log=True):
+        self.srv.conex_move(self.devid, pos, devname, log)
+
+    def push(self, step, devname, log=True):
+        self.srv.conex_push(self.devid, step, devname, log)
+
+    def status(self, devname):
+        return self.srv.conex_status(self.devid, devname)
+
+    def wait(self, devname, delay=0.2, timeout=0):
+        return self.srv.conex_wait(self.devid, devname, delay, timeout)
+
+    def close(self):
+        # the server keeps the port open
+        pass
+
+class zaber_client(object):
+    # same methods as zaber_chain3.zaber, through the device server
+    def __init__(self, port=port):
+        self.srv = proxy(port)
+        self.zaberchain = None
+
+    def open(self, zaberchain):
+        self.zaberchain = zaberchain
+        if not self.srv.zaber_open(zaberchain):
+            print("Zaber chain %s not connected" %zaberchain)
+            sys.exit()
+
+    def home(self, idn, devname, log=True):
+        self.srv.zaber_home(self.zaberchain, idn, devname, log)
+
+    def move(self, idn, pos, devname, log=True, delay=0.1):
+        self.srv.zaber_move(self.zaberchain, idn, pos, devname, log, delay)
+
+    def push(self, idn, step, devname, log=True, delay=0.1):
+        self.srv.zaber_push(self.zaberchain, idn, step, devname, log, delay)
+
+    def status(self, idn, devname):
+        return self.srv.zaber_status(self.zaberchain, idn, devname)
+
+    def wait(self, idn, devname, delay=0.2, timeout=0):
+        return self.srv.zaber_wait(self.zaberchain, idn, devname, delay, timeout)
+
+    def close(self):
+        pass
+
+def conex():
+    # a conex through the device server if it is running, the driver otherwise
+    if running():
+        return conex_client()
+    import conex3
+    return conex3.conex()
+
+def zaber():
+    # a zaber chain through the device server if it is running, the driver
+    # otherwise
+    if running():
+        return zaber_client()
+    import zaber_chain3
+    return zaber_chain3.zaber()
+
+def conf(devname):
+    # lines of the conf_<devname>.txt slot table, from the device server if
+    # it is running (it keeps the tables read), from the file otherwise
+    if running():
+        return proxy().conf(devname)
+    return read_conf(devname)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# =====================================================================
+#  Sine wave patterns on the DM (speckle probes, astrometric grids).
+#
+#  A sine_bank computes, once per spatial frequency (kx, ky), the maps
+#
+#      S = sin(2pi(kx*x + ky*y))    C = cos(2pi(kx*x + ky*y))
+#
+#  on the DM actuator coordinates, and forms any sine wave of that
+#  frequency as a linear combination of the two:
+#
+#      amp*sin(2pi(kx*x + ky*y) + phi) = amp*cos(phi)*S + amp*sin(phi)*C
+#
+#  so probing N speckles at M phases costs two matrix products, and gives
+#  the (M, dms, dms) stack of DM maps in one array:
+#
+#      bank = dm_patterns.bank()
+#      disp = bank.sine(amp, kx, ky, phi)
+#      prbs = bank.probes(kxs, kys, amps, 2*np.pi*np.arange(4)/4.)
+# =====================================================================
+
+import numpy as np
+
+# banks made by bank(), by DM size
+banks = {}
+
+class sine_bank(object):
+
+    def __init__(self, dms=50, maxsize=256):
+        self.dms = dms
+        self.maxsize = maxsize  # number of frequencies kept
+        # DM coordinates, as in the DM_sine functions of the scripts
+        self.xc, self.yc = np.meshgrid(np.arange(dms)-dms//2,
+                                       np.arange(dms)-dms//2)
+        # (S, C) maps, by (kx, ky)
+        self.maps = {}
+
+    def basis(self, kx, ky):
+        # (S, C) maps of the spatial frequency (kx, ky)
+        key = (float(kx), float(ky))
+        maps = self.maps.get(key)
+        if maps is None:
+            if len(self.maps) >= self.maxsize:
+                self.maps.clear()
+            phase = 2*np.pi*(key[0] * self.xc + key[1] * self.yc)
+            maps = (np.sin(phase), np.cos(phase))
+            for m in maps:
+                m.flags.writeable = False
+            self.maps[key] = maps
+        return maps
+
+    def stack(self, kxs, kys):
+        # (S, C) stacks of maps, (nfreq, dms, dms) each
+        maps = [self.basis(kx, ky) for (kx, ky) in zip(kxs, kys)]
+        return (np.array([m[0] for m in maps]), np.array([m[1] for m in maps]))
+
+    def sine(self, amp, kx, ky, phi=0.0):
+        # amp * sin(2pi(kx*x + ky*y) + phi)
+        (s, c) = self.basis(kx, ky)
+        return (amp*np.cos(phi)) * s + (amp*np.sin(phi)) * c
+
+    def probes(self, kxs, kys, amps, phis, phi0=0.0):
+        # (nphi, dms, dms) stack: for every phase phis[j], the sum over
+        # the speckles i of amps[i] * sin(2pi(kxs[i]*x + kys[i]*y) +
+        # phis[j] + phi0[i])
+        kxs = np.atleast_1d(np.asarray(kxs, dtype=float))
+        kys = np.atleast_1d(np.asarray(kys, dtype=float))
+        amps = np.asarray(amps, dtype=float) * np.ones(kxs.size)
+        phi0 = np.asarray(phi0, dtype=float) * np.ones(kxs.size)
+        phis = np.atleast_1d(np.asarray(phis, dtype=float))
+        (s, c) = self.stack(kxs, kys)
+        phase = phis[:,None] + phi0[None,:]
+        return np.tensordot(amps*np.cos(phase), s, axes=1) + \
+            np.tensordot(amps*np.sin(phase), c, axes=1)
+
+    def combine(self, kxs, kys, amps, phis=0.0):
+        # sum over the speckles i of amps[i] * sin(2pi(kxs[i]*x +
+        # kys[i]*y) + phis[i])
+        return self.probes(kxs, kys, amps, 0.0, phis)[0]
+
+    def astrogrid(self, cpa, dpix=45.0):
+        # astrometric grid cos(2pi*cpa/dpix*i) + cos(2pi*cpa/dpix*j), on the
+        # actuator indices (i, j), for cpa cycles per aperture of dpix
+        # actuators
+        k = cpa / float(dpix)
+        # the indices start at dms//2 on the DM coordinates, and cos = sin
+        # shifted by pi/2
+        phi = np.pi/2 + 2*np.pi*k*(self.dms//2)
+        return self.combine([k, 0.0], [0.0, k], [1.0, 1.0], [phi, phi])
+
+def bank(dms=50):
+    # the sine_bank of a DM size, made the first time
+    if dms not in banks:
+        banks[dms] = sine_bank(dms)
+    return banks[dms]
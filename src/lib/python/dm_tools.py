@@ -8,6 +8,7 @@ from scipy.signal import medfilt2d as medfilt
 from lockfile import FileLock
 import array
 import binascii
+import dm_patterns # cached sine wave maps
 
 dms = 50 # 2k-DM diameter (in actuators)
 
@@ -33,12 +34,12 @@ def mk_probe(spks):
     ''' --------------------------------------------------
     create a 2d disp map from a list of speckle probes
     -------------------------------------------------- '''
-    x,y = np.meshgrid(np.arange(dms)-dms/2, np.arange(dms)-dms/2)
-
     res = get_DM_disp(3)
-    for i in range(np.size(spks)):
-        phase = 2.0*np.pi*(x*spks[i].kx + y*spks[i].ky)+spks[i].phi
-        res += spks[i].amp*np.sin(phase)
+    if np.size(spks) > 0:
+        res += dm_patterns.bank(dms).combine([s.kx for s in spks],
+                                             [s.ky for s in spks],
+                                             [s.amp for s in spks],
+                                             [s.phi for s in spks])
     return res
 
 def DM_add_disp(disp, channel=3):
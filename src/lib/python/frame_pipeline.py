@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# =====================================================================
+#  Calibrated frames for the live loops (tip-tilt, speckles, alignment)
+#  without allocating new arrays for every frame.
+#
+#  A frame_pipeline keeps, for one frame shape:
+#  - an accumulator of the raw frames, either the sum of the frames since
+#    the last reset() or, with window > 1, a rolling sum of the last
+#    window frames
+#  - the calibration: dark, and flat, bad pixel map and mask combined in
+#    a single gain map, applied in place
+#  - a ring of nbuf output frames: average() writes the calibrated
+#    average in the next one, so the last nbuf results stay valid
+#
+#      pipe = frame_pipeline(shape, dark=dark, badpix=badpix, mask=mask)
+#      waiter = frame_waiter(shm_im, "palila")
+#      im = pipe.grab(waiter, 10)     # calibrated average of 10 frames
+# =====================================================================
+
+import numpy as np
+
+class frame_pipeline(object):
+
+    def __init__(self, shape, dark=None, flat=None, badpix=None, mask=None,
+                 window=1, nbuf=2, nan_to_zero=False, dtype=np.float64):
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.window = max(int(window), 1)
+        self.nan_to_zero = nan_to_zero
+        self.acc = np.zeros(self.shape, dtype=dtype)
+        self.nacc = 0
+        # last raw frames of the rolling sum, and where the next one goes
+        self.frames = None
+        self.iframe = 0
+        if self.window > 1:
+            self.frames = np.zeros((self.window,)+self.shape, dtype=dtype)
+        self.buf = np.zeros((max(int(nbuf), 1),)+self.shape, dtype=dtype)
+        self.ibuf = -1
+        self._nan = np.zeros(self.shape, dtype=bool)
+        self.dark = None
+        self.gain = None
+        self._flat = flat
+        self._badpix = badpix
+        self._mask = mask
+        self.set_dark(dark)
+        self._update_gain()
+
+    # -------------------------- calibration --------------------------
+    def _checked(self, im):
+        im = np.asarray(im)
+        if im.shape != self.shape:
+            im = im.reshape(self.shape)
+        return im
+
+    def _update_gain(self):
+        # flat, bad pixel map and mask multiply the frame: combine them once
+        gain = None
+        for (im, invert) in ((self._flat, True), (self._badpix, False), (self._mask, False)):
+            if im is None:
+                continue
+            im = np.array(self._checked(im), dtype=self.dtype)
+            if invert:
+                # dead pixels of the flat are zeroed, not divided by 0
+                ok = im != 0
+                im[ok] = 1.0 / im[ok]
+            if gain is None:
+                gain = im
+            else:
+                gain *= im
+        self.gain = gain
+
+    def set_dark(self, dark):
+        if dark is None:
+            self.dark = None
+        else:
+            self.dark = np.array(self._checked(dark), dtype=self.dtype)
+
+    def set_flat(self, flat):
+        self._flat = flat
+        self._update_gain()
+
+    def set_badpix(self, badpix):
+        # multiplicative map: 0 on the bad pixels, 1 elsewhere
+        self._badpix = badpix
+        self._update_gain()
+
+    def set_mask(self, mask):
+        self._mask = mask
+        self._update_gain()
+
+    def calibrate(self, im):
+        # calibrates the frame im (of the pipeline's dtype) in place
+        if self.dark is not None:
+            im -= self.dark
+        if self.gain is not None:
+            im *= self.gain
+        if self.nan_to_zero:
+            np.isnan(im, out=self._nan)
+            np.copyto(im, 0.0, where=self._nan)
+        return im
+
+    # -------------------------- accumulation -------------------------
+    def reset(self):
+        self.acc[...] = 0.0
+        self.nacc = 0
+        self.iframe = 0
+        if self.frames is not None:
+            self.frames[...] = 0.0
+
+    def add(self, frame):
+        # adds a raw frame to the accumulator
+        frame = self._checked(frame)
+        if self.frames is None:
+            self.acc += frame
+            self.nacc += 1
+            return
+        # rolling sum: the oldest frame leaves, the new one takes its place
+        old = self.frames[self.iframe]
+        self.acc -= old
+        old[...] = frame
+        self.acc += old
+        self.iframe = (self.iframe + 1) % self.window
+        self.nacc = min(self.nacc + 1, self.window)
+
+    def average(self):
+        # calibrated average of the accumulated frames, in the next output
+        # buffer (None if there are no frames)
+        if self.nacc == 0:
+            return None
+        self.ibuf = (self.ibuf + 1) % len(self.buf)
+        out = self.buf[self.ibuf]
+        np.multiply(self.acc, 1.0 / self.nacc, out=out)
+        return self.calibrate(out)
+
+    def latest(self):
+        # the last result of average(), None before the first one
+        if self.ibuf < 0:
+            return None
+        return self.buf[self.ibuf]
+
+    def process(self, frame):
+        # calibrated copy of a single frame, in the next output buffer
+        self.ibuf = (self.ibuf + 1) % len(self.buf)
+        out = self.buf[self.ibuf]
+        out[...] = self._checked(frame)
+        return self.calibrate(out)
+
+    def grab(self, waiter, n=1, timeout=None):
+        # adds the next n frames of the stream of waiter (a
+        # frame_wait.frame_waiter) and returns the calibrated average: of
+        # these n frames, or of the last window frames with a rolling
+        # window.  Frames that take more than timeout seconds are not
+        # waited for; None if no frame arrived at all.
+        if self.frames is None:
+            self.acc[...] = 0.0
+            self.nacc = 0
+        got = 0
+        for i in range(n):
+            if waiter.wait_new_frame(timeout) is None:
+                break
+            self.add(waiter.stream.get_data(False, True))
+            got += 1
+        if got == 0:
+            return None
+        return self.average()
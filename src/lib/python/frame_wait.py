@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+# =====================================================================
+#  Waiting for new frames of a shared memory stream (an image stream of
+#  scexao_shm, xaosim or pyMilk: anything with get_counter() and
+#  get_data()) without spinning on its counter.
+#
+#  The writer of a stream posts all of its semaphores for every frame;
+#  a frame_waiter sleeps on one of them (posix_ipc), so it uses no CPU
+#  while it waits.  Every waiter of a stream needs its own semaphore: a
+#  post taken by one is not seen by the others.  Unless a semid is given,
+#  a frame_waiter claims the first free one of free_semids, with a lock
+#  file held as long as it is open (and released by the system if the
+#  process dies), so that waiters of different processes do not share
+#  one.  Without posix_ipc, if all of them are taken or if the semaphore
+#  does not exist, the counter is polled every poll seconds instead.
+#
+#  The counter tells how many frames were written since the last one
+#  returned: the frames that were missed are counted in skipped.
+#
+#      waiter = frame_waiter(shm_im, "palila")
+#      im = waiter.average_frames(10)
+#      for im in waiter.iter_frames(100):
+#          ...
+# =====================================================================
+
+import os
+import time
+import fcntl
+import numpy as np
+
+try:
+    import posix_ipc
+except ImportError:
+    posix_ipc = None
+
+# semaphores claimed when no semid is given (a stream has 10 of them, 0
+# and 1 are used by the cacao loops)
+free_semids = range(2, 10)
+
+# where the lock files of the claimed semaphores are
+lockdir = "/tmp"
+
+# frame_waiter of each stream, for the functions of this module
+_waiters = {}
+
+def stream_name(stream):
+    # name of a stream ('palila' for /tmp/palila.im.shm), None if unknown
+    for attr in ('FNAME', 'fname'):
+        fname = getattr(stream, attr, None)
+        if fname:
+            name = os.path.basename(fname)
+            if name.endswith('.im.shm'):
+                name = name[:-len('.im.shm')]
+            return name
+    mtdata = getattr(stream, 'mtdata', None)
+    if isinstance(mtdata, dict) and mtdata.get('imname'):
+        name = mtdata['imname']
+        if not isinstance(name, str):
+            name = name.decode()
+        return name.strip('\x00').strip()
+    return None
+
+class frame_waiter(object):
+
+    def __init__(self, stream, name=None, semid=None, poll=0.001):
+        self.stream = stream
+        self.poll = poll
+        if name is None:
+            name = stream_name(stream)
+        self.lock = None
+        if semid is None and posix_ipc is not None and name is not None:
+            semid = self._claim(name)
+        self.semid = semid
+        self.sem = None
+        if posix_ipc is not None and name is not None and semid is not None:
+            try:
+                self.sem = posix_ipc.Semaphore("/%s_sem%02d" % (name, semid))
+            except posix_ipc.ExistentialError:
+                self.sem = None
+        self.drain()
+        self.cnt = stream.get_counter()
+        self.count = 0      # frames returned
+        self.skipped = 0    # frames missed between them
+
+    def _claim(self, name):
+        # first semid of free_semids not claimed by another waiter, None if
+        # all of them are
+        for semid in free_semids:
+            fname = os.path.join(lockdir, "%s_sem%02d.lock" % (name, semid))
+            try:
+                fd = os.open(fname, os.O_RDWR | os.O_CREAT, 0o666)
+            except OSError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                os.close(fd)
+                continue
+            self.lock = fd
+            return semid
+        return None
+
+    def close(self):
+        # gives the semaphore back
+        if self.sem is not None:
+            self.sem.close()
+            self.sem = None
+        if self.lock is not None:
+            os.close(self.lock)
+            self.lock = None
+
+    def drain(self):
+        # forgets the frames posted before now
+        if self.sem is not None:
+            try:
+                while True:
+                    self.sem.acquire(0)
+            except posix_ipc.BusyError:
+                pass
+
+    def wait_new_frame(self, timeout=None):
+        # waits for a frame newer than the last one returned, and returns
+        # its counter (None after timeout seconds)
+        t0 = time.time()
+        while True:
+            cnt = self.stream.get_counter()
+            if cnt != self.cnt:
+                if cnt > self.cnt + 1:
+                    self.skipped += cnt - self.cnt - 1
+                self.cnt = cnt
+                self.count += 1
+                return cnt
+            left = None
+            if timeout is not None:
+                left = timeout - (time.time() - t0)
+                if left <= 0:
+                    return None
+            if self.sem is not None:
+                try:
+                    self.sem.acquire(left)
+                except posix_ipc.BusyError:
+                    return None
+            elif left is None:
+                time.sleep(self.poll)
+            else:
+                time.sleep(min(self.poll, left))
+
+    def get_new_frame(self, timeout=None):
+        # the next frame (None after timeout seconds)
+        if self.wait_new_frame(timeout) is None:
+            return None
+        return self.stream.get_data(False, True)
+
+    def iter_frames(self, n=None, timeout=None):
+        # the next n frames (all of them if n is None), each one as it
+        # arrives; stops if a frame takes more than timeout seconds
+        i = 0
+        while n is None or i < n:
+            im = self.get_new_frame(timeout)
+            if im is None:
+                return
+            yield im
+            i += 1
+
+    def average_frames(self, n, timeout=None):
+        # average of the next n frames (of those that arrived, if one took
+        # more than timeout seconds; None if none did)
+        res = None
+        k = 0
+        for im in self.iter_frames(n, timeout):
+            if res is None:
+                res = np.array(im, dtype=np.float64)
+            else:
+                res += im
+            k += 1
+        if res is not None:
+            res /= k
+        return res
+
+def waiter(stream, name=None, semid=None):
+    # the frame_waiter of a stream, made the first time
+    key = id(stream)
+    if key not in _waiters or _waiters[key].stream is not stream:
+        if key in _waiters:
+            _waiters[key].close()
+        _waiters[key] = frame_waiter(stream, name, semid)
+    return _waiters[key]
+
+def wait_new_frame(stream, timeout=None):
+    return waiter(stream).wait_new_frame(timeout)
+
+def iter_frames(stream, n=None, timeout=None):
+    return waiter(stream).iter_frames(n, timeout)
+
+def average_frames(stream, n, timeout=None):
+    return waiter(stream).average_frames(n, timeout)
@@ -1049,8 +1049,9 @@ class Archiver(ArchiverBase, Datasink.DataSink):
                         fitsbuf = self.compress_buffer(fitsbuf)
                         
                        
-                    # Encode buffer for XMLRPC transport
-                    fitsbuf = ro.binary_encode(fitsbuf)
+                    # Wrap buffer for transport; it is sent as is over
+                    # a binary connection, else base64 encoded
+                    fitsbuf = ro.Binary(fitsbuf)
 
                     with client.limit:
                         self.logger.debug("Transmitting %d/%d to %s" % (
@@ -342,8 +342,10 @@ def main(options, args):
     mymon.start(wait=True)
     mymon.start_server(wait=True, port=options.monport)
 
-    # subscribe our monitor to the publication feed
-    mymon.subscribe_remote(options.monitor, sub_channels, {})
+    # subscribe our monitor to the publication feed, for only the
+    # aliases we are watching
+    mymon.subscribe_remote(options.monitor, sub_channels,
+                           { 'keys': statusFromGen2.keys() })
 
     ev_quit = threading.Event()
 
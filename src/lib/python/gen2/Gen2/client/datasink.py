@@ -322,8 +322,12 @@ class DataSink(object):
 
         self.logger.debug("Processing %d/%d %s..." % (num, count, filename))
         try:
-            # Decode binary data
-            data = binascii.a2b_base64(buffer)
+            # Decode binary data (a remoteObjects Binary buffer arrives
+            # already decoded)
+            if isinstance(buffer, basestring):
+                data = binascii.a2b_base64(buffer)
+            else:
+                data = buffer.data
 
             if compressed:
                 data = bz2.decompress(data)
@@ -11,6 +11,7 @@ import threading
 
 import remoteObjects as ro
 import remoteObjects.Monitor as Monitor
+import SOSS.status.Delta as Delta
 import ssdlog
 
 class StatusRelay(object):
@@ -21,6 +22,8 @@ class StatusRelay(object):
         self.lock = threading.RLock()
         # status feed will be stored in here
         self.statusDict = {}
+        # decoder for the 'statusdelta' channel
+        self.decoder = Delta.statusDeltaDecoder()
 
         # status system
         self.statsvc = statsvc
@@ -36,6 +39,9 @@ class StatusRelay(object):
     def status_cb(self, payload, name, channels):
         try:
             bnch = Monitor.unpack_payload(payload)
+            if bnch.path == 'mon.statusdelta':
+                self.statusdelta_cb(bnch.value)
+                return
             if bnch.path != 'mon.status':
                 return
 
@@ -48,6 +54,25 @@ class StatusRelay(object):
         except Monitor.MonitorError, e:
             print "monitor error: %s" % (str(e))
 
+    def statusdelta_cb(self, frame):
+        # Decode a frame of the delta encoded status feed (see
+        # SOSS/status/Delta.py)
+        with self.lock:
+            statusDict = self.decoder.decode(frame)
+            if not self.decoder.synced:
+                # missed a frame (or none seen yet): ask the status
+                # server for a keyframe rather than wait for the next one
+                self.logger.info("Status delta feed out of sync, fetching keyframe")
+                try:
+                    statusDict = self.decoder.decode(self.stobj.fetchKeyframe())
+
+                except Exception, e:
+                    self.logger.error("Error fetching status keyframe: %s" % (
+                        str(e)))
+                    return
+            self.statusDict.update(statusDict)
+        self.logger.debug("Status updated: %d items" % len(statusDict))
+
     def update_statusProxy(self):
         # reset our proxy object to the status system
         self.stobj = ro.remoteObjectProxy(self.statsvc)
@@ -78,6 +78,33 @@ def main(options, args):
         print "%d total threads, %d%% are idle (%d)." % (
             total_cnt, idle_pct, idle_cnt)
 
+        if options.latency:
+            show_latency(svc, svcname)
+
+
+def show_latency(svc, svcname):
+    try:
+        res = svc.ro_workerStatus(True)
+
+    except Exception, e:
+        print "Error getting latency information from '%s': %s" % (
+            svcname, str(e))
+        return
+
+    if res.has_key('queue'):
+        print "Request queue: %(depth)d/%(limit)d  rejected: %(rejected)d  idle connections: %(parked)d" % (
+            res['queue'])
+
+    fmt = "%-30.30s  %8s  %10s  %10s"
+    print fmt % ('method', 'calls', 'avg (ms)', 'max (ms)')
+    methods = res['latency'].keys()
+    methods.sort()
+    for methodName in methods:
+        hist = res['latency'][methodName]
+        print fmt % (methodName, hist['count'],
+                     "%.3f" % (hist['avg'] * 1000.0),
+                     "%.3f" % (hist['max'] * 1000.0))
+
 
 if __name__ == '__main__':
 
@@ -90,6 +117,9 @@ if __name__ == '__main__':
     optprs.add_option("--debug", dest="debug", default=False,
                       action="store_true",
                       help="Enter the pdb debugger on main()")
+    optprs.add_option("--latency", dest="latency", default=False,
+                      action="store_true",
+                      help="Show request latencies by method")
     optprs.add_option("--show-idle", dest="show_idle", default=False,
                       action="store_true",
                       help="Show idle threads in listing")
@@ -10,6 +10,10 @@
 import sys, os, time
 import re, binascii
 import struct
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from Bunch import Bunch
 import common
@@ -94,6 +98,18 @@ statusAlias_SupplementaryData = {
     }
 
 
+# Formats used to unpack integer fields of the various sizes found in the
+# status tables: (size, pad, (signed format, unsigned format)).  Shorter
+# fields are left-padded with 'pad' and then truncated to 'size' bytes.
+#
+fmtStrings = [(1, '',             ('!b', '!B')),
+              (2, '\x00',         ('!h', '!H')),
+              (4, '\x00',         ('!l', '!L')),
+              (8, '\x00\x00\x00', ('!q', '!Q')),
+              #(16, '\x00\x00\x00\x00\x00\x00\x00\x00', ('!q', '!Q')),
+              ]
+
+
 class statusInfo(object):
     """ Helper class to parse and hold content of StatusAlias.def,
     Table.def and StatusTSCV.def files.
@@ -146,6 +162,9 @@ class statusInfo(object):
 
         # read TSCVDef file
         self.__read_TSCVDef(TSCVDef)
+
+        # compile the per-table decoders
+        self.__buildDecoders()
         
 
     # Read and parse the SOSS Table.def file.  Stores results in a dictionary
@@ -289,6 +308,19 @@ class statusInfo(object):
             l = self.table2aliases[tablename]
             l.append(alias)
             
+
+    # Build a statusTableDecoder for each table that we know the layout of.
+    # Must be called after the reverse index has been built.
+    #
+    def __buildDecoders(self):
+        self.tableDecoder = {}
+
+        for tablename in self.tableDef.keys():
+            aliases = self.table2aliases.get(tablename, [])
+            aliasdefs = map(lambda alias: self.statusAliasDef[alias], aliases)
+            self.tableDecoder[tablename] = statusTableDecoder(tablename,
+                                                              aliasdefs)
+            
             
     # Read and parse the StatusTSCV.def file.  Stores results in a dictionary
     # indexed by table name.  The value of each dictionary element is a Bunch.
@@ -368,6 +400,16 @@ class statusInfo(object):
         return self.statusAliasDef.keys()
 
     
+    def get_tableDecoder(self, tablename):
+        try:
+            decoder = self.tableDecoder[tablename]
+
+        except KeyError, e:
+            raise statusInfoError("No decoder found for table: %s" % tablename)
+
+        return decoder
+
+        
     def get_TSCVDef(self, tablename):
         try:
             tscvdef = self.TSCVDef[tablename]
@@ -464,12 +506,6 @@ class statusConverter(object):
         It is not likely that the status uses two's compliment
         for the 3,5,6 or 7 bytes integer, though.
         """
-        fmtStrings = [(1, '',             ('!b', '!B')),
-                      (2, '\x00',         ('!h', '!H')),
-                      (4, '\x00',         ('!l', '!L')),
-                      (8, '\x00\x00\x00', ('!q', '!Q')),
-                      #(16, '\x00\x00\x00\x00\x00\x00\x00\x00', ('!q', '!Q')),
-                      ]
         length = len(data)
 
         # Linear search. any better way to handle this?
@@ -598,6 +634,337 @@ class statusConverter(object):
             raise statusConversionError(str(e))
 
         return newval
-        
+
+
+def _mk_unpacker(offset, length, signed):
+    """Returns a function that extracts the integer field of (length)
+    bytes at (offset) from a table buffer.  Gives the same results as
+    statusConverter.unpackData() on the sliced field.
+    """
+    end = offset + length
+    for (size, pad, fmts) in fmtStrings:
+        if length <= size:
+            if signed:
+                s = struct.Struct(fmts[0])
+            else:
+                s = struct.Struct(fmts[1])
+
+            if length == size:
+                # Field can be unpacked directly from the buffer
+                return lambda buf: s.unpack_from(buf, offset)[0]
+
+            return lambda buf: s.unpack((pad + buf[offset:end])[-size:])[0]
+
+    def unpacker(buf):
+        raise statusConversionError('length of the data exceeds that of all possible data types')
+    return unpacker
+
+
+def _mk_BCD(digits):
+    # TODO: This is true only for the BCD of length >=6 bytes
+    if digits.startswith('8'):
+        return -float(digits[1:4] + '.' + digits[4:])
+    return float(digits[1:4] + '.' + digits[4:])
+
+
+class statusBatchConverter(object):
+    """Converts the binary (B, D, L and S) aliases of a table all together.
+
+    Aliases are grouped by type and length, and each group is decoded
+    with NumPy from a byte view of the table buffer: the fields are
+    gathered into a (naliases, length) byte array, assembled into 64-bit
+    integers and then masked, sign extended, scaled or BCD decoded as
+    whole arrays.  Results are identical to statusConverter.convert().
+    Aliases that cannot be done this way (other types, conversion
+    overrides, fields longer than 8 bytes) are left out; see
+    isBatchable().
+    """
+
+    def __init__(self, aliasdefs):
+        groups = {}
+        for aliasdef in aliasdefs:
+            if not self.isBatchable(aliasdef):
+                continue
+
+            stype = aliasdef.supp_data.get('type', aliasdef.stype)
+            key = (stype, aliasdef.length)
+            groups.setdefault(key, []).append(aliasdef)
+
+        # Names of all the aliases handled by this converter
+        self.aliasnames = set([])
+        # Minimum size of a table buffer to hold all the fields
+        self.bufsize = 0
+
+        allbits = 0xffffffffffffffffL
+        self.groups = []
+        for ((stype, length), group) in groups.items():
+            names = [ aliasdef.aliasname for aliasdef in group ]
+            self.aliasnames.update(names)
+
+            offsets = numpy.array([ aliasdef.offset for aliasdef in group ],
+                                  dtype=numpy.intp)
+            self.bufsize = max(self.bufsize, int(offsets.max()) + length)
+
+            bnch = Bunch(stype=stype, length=length, names=names,
+                         index=offsets[:, numpy.newaxis] + numpy.arange(length),
+                         shifts=numpy.arange(length - 1, -1, -1,
+                                             dtype=numpy.uint64) * 8)
+
+            if stype in ('B', 'D'):
+                masks = []
+                for aliasdef in group:
+                    if aliasdef.mask is None:
+                        masks.append(allbits)
+                    else:
+                        masks.append(long(aliasdef.mask) & allbits)
+                bnch.masks = numpy.array(masks, dtype=numpy.uint64)
+
+            if stype == 'D':
+                # Nibble shifts, most significant digit first
+                ndigits = length * 2
+                bnch.nibshifts = numpy.arange(ndigits - 1, -1, -1,
+                                              dtype=numpy.uint64) * 4
+                # Decimal weights of all digits after the sign digit
+                bnch.weights = 10 ** numpy.arange(ndigits - 2, -1, -1,
+                                                  dtype=numpy.int64)
+                bnch.divisor = 10.0 ** max(0, ndigits - 4)
+
+            if stype in ('L', 'S'):
+                # A missing multiplier is the same as multiplying by 1
+                bnch.multipliers = numpy.array(
+                    [ aliasdef.multiplier or 1.0 for aliasdef in group ],
+                    dtype=numpy.float64)
+
+            self.groups.append(bnch)
+
+
+    def isBatchable(self, aliasdef):
+        """Returns True if (aliasdef) can be converted by this class.
+        """
+        if aliasdef.supp_data.has_key('conv'):
+            return False
+        stype = aliasdef.supp_data.get('type', aliasdef.stype)
+        if stype == 'S':
+            return aliasdef.length in (1, 2, 4, 8)
+        if stype in ('B', 'D', 'L'):
+            return 1 <= aliasdef.length <= 8
+        return False
+
+
+    def convert(self, buf):
+        """Convert all the aliases from the table buffer (buf), which must be
+        at least self.bufsize bytes long.  Returns a tuple of a dictionary
+        of the values and a list of the aliases that could not be converted
+        here (BCD fields holding non-decimal digits); the caller should fall
+        back on statusConverter for those.
+        """
+        data = numpy.frombuffer(buf, dtype=numpy.uint8)
+
+        res = {}
+        rejects = []
+        for bnch in self.groups:
+            # Assemble each field into a big-endian unsigned integer
+            fields = data[bnch.index].astype(numpy.uint64)
+            vals = numpy.bitwise_or.reduce(fields << bnch.shifts, axis=1)
+            
+            if bnch.stype == 'B':
+                res.update(zip(bnch.names, (vals & bnch.masks).tolist()))
+
+            elif bnch.stype == 'L':
+                vals = vals.astype(numpy.float64) * bnch.multipliers
+                res.update(zip(bnch.names, vals.tolist()))
+
+            elif bnch.stype == 'S':
+                nbits = bnch.length * 8
+                if nbits == 64:
+                    vals = vals.view(numpy.int64)
+                else:
+                    vals = vals.astype(numpy.int64)
+                    vals[vals >= (1 << (nbits - 1))] -= (1 << nbits)
+                vals = vals.astype(numpy.float64) * bnch.multipliers
+                res.update(zip(bnch.names, vals.tolist()))
+
+            elif bnch.stype == 'D':
+                vals = vals & bnch.masks
+                digits = (vals[:, numpy.newaxis] >> bnch.nibshifts) & 0xf
+                digits = digits.astype(numpy.int64)
+                # first digit only carries the sign
+                number = numpy.dot(digits[:, 1:], bnch.weights)
+                vals = number.astype(numpy.float64) / bnch.divisor
+                vals = numpy.where(digits[:, 0] == 8, -vals, vals)
+                res.update(zip(bnch.names, vals.tolist()))
+
+                bad = (digits[:, 1:] > 9).any(axis=1)
+                if bad.any():
+                    rejects.extend([ bnch.names[i]
+                                     for i in numpy.flatnonzero(bad) ])
+
+        return (res, rejects)
+
+    
+class statusTableDecoder(object):
+    """Decodes all the aliases of one status table from the raw table
+    buffer in a single pass.
+
+    The decoder is built once from the alias definitions of the table
+    (see statusInfo.reloadInfo), which fixes the offsets, struct formats,
+    masks and multipliers of every alias.  Results are identical to
+    calling statusConverter.convert() alias by alias.
+    """
+
+    def __init__(self, tablename, aliasdefs):
+        self.tablename = tablename
+
+        # list of (aliasname, decodefunc), in alias definition order
+        self.ops = []
+        # aliasname -> (aliasname, decodefunc)
+        self.opIndex = {}
+
+        for aliasdef in aliasdefs:
+            op = (aliasdef.aliasname, self.compile(aliasdef))
+            self.ops.append(op)
+            self.opIndex[aliasdef.aliasname] = op
+
+        # If NumPy is available, the binary fields are converted together
+        # when decoding the whole table and the rest are done one by one
+        self.batch = None
+        self.otherOps = self.ops
+        if numpy is not None:
+            self.batch = statusBatchConverter(aliasdefs)
+            self.otherOps = [ op for op in self.ops
+                              if not op[0] in self.batch.aliasnames ]
+
+
+    def compile(self, aliasdef):
+        """Returns a function that decodes the value of the alias described
+        by (aliasdef) from a table buffer.
+        """
+        offset = aliasdef.offset
+        length = aliasdef.length
+        end = offset + length
+
+        # Do we have an override of the conversion function from our
+        # StatusAlias supplementary data?
+        try:
+            convfunc = aliasdef.supp_data['conv']
+            return lambda buf: convfunc(buf[offset:end], aliasdef)
+
+        except KeyError:
+            pass
+
+        # Do we have an override of the type?
+        try:
+            stype = aliasdef.supp_data['type']
+
+        except KeyError:
+            stype = aliasdef.stype
+
+        if stype == 'C':
+            return lambda buf: buf[offset:end].strip()
+
+        elif stype == 'R':
+            return lambda buf: buf[offset:end]
+
+        elif stype == 'F':
+            def conv_F(buf):
+                val = buf[offset:end].strip()
+                if len(val) > 0:
+                    return float(val)
+                return None
+            return conv_F
+
+        elif stype == 'I':
+            def conv_I(buf):
+                val = buf[offset:end].strip()
+                if len(val) > 0:
+                    return int(val)
+                return None
+            return conv_I
+
+        elif stype == 'B':
+            if length > 8:
+                # too long for struct.unpack
+                unpack = lambda buf: long(binascii.hexlify(buf[offset:end]), 16)
+            else:
+                unpack = _mk_unpacker(offset, length, False)
+
+            if aliasdef.mask is not None:
+                mask = long(aliasdef.mask)
+                return lambda buf: long(unpack(buf)) & mask
+            return unpack
+
+        elif stype == 'D':
+            unpack = _mk_unpacker(offset, length, False)
+            nDigits = length * 2
+            Q = struct.Struct('!Q')
+
+            if aliasdef.mask is not None:
+                mask = long(aliasdef.mask)
+                def conv_D(buf):
+                    val = long(unpack(buf)) & mask
+                    return _mk_BCD(binascii.hexlify(Q.pack(val))[-nDigits:])
+                return conv_D
+
+            def conv_D(buf):
+                # raises for lengths that cannot be unpacked
+                unpack(buf)
+                return _mk_BCD(binascii.hexlify(buf[offset:end]))
+            return conv_D
+
+        elif stype in ('L', 'S'):
+            if (stype == 'S') and (length not in [1, 2, 4, 8]):
+                def conv_S(buf):
+                    raise statusConversionError('Length of data not amenable to signed conversion')
+                return conv_S
+
+            unpack = _mk_unpacker(offset, length, stype == 'S')
+            multiplier = aliasdef.multiplier
+            if multiplier:
+                return lambda buf: float(unpack(buf)) * multiplier
+            return lambda buf: float(unpack(buf))
+
+        raise statusInfoError("No conversion for type '%s' of alias: %s" % (
+            stype, aliasdef.aliasname))
+
+
+    ####################################
+    #    PUBLIC METHODS
+    ####################################
+
+    def decode(self, buf, aliasnames=None, allow_fail=True):
+        """Decode aliases from the raw table buffer (buf).  If (aliasnames)
+        is given only those aliases are decoded, otherwise all the aliases
+        of the table are.  Returns a dictionary of the values.  If a
+        value cannot be converted then statusConversionError is raised,
+        unless (allow_fail) is True, in which case STATERROR is returned
+        for that alias.
+        """
+        res = {}
+        if aliasnames is None:
+            ops = self.ops
+            if (self.batch is not None) and (len(buf) >= self.batch.bufsize):
+                (res, rejects) = self.batch.convert(buf)
+                ops = self.otherOps
+                if rejects:
+                    ops = ops + map(self.opIndex.__getitem__, rejects)
+        else:
+            try:
+                ops = map(self.opIndex.__getitem__, aliasnames)
+
+            except KeyError, e:
+                raise KeyError("No alias %s in table %s" % (
+                    str(e), self.tablename))
+
+        for (aliasname, func) in ops:
+            try:
+                res[aliasname] = func(buf)
+
+            except Exception, e:
+                if not allow_fail:
+                    raise statusConversionError(str(e))
+                res[aliasname] = common.STATERROR
+
+        return res
+
     
 # END Convert.py
@@ -0,0 +1,261 @@
+#
+# Delta.py -- compact delta encoding of status updates
+#
+"""
+Encoding of status updates for transmission to monitor subscribers.
+
+Instead of sending a dictionary of alias/value pairs, the status server
+sends "frames".  Aliases are interned to small integer IDs, and values
+are packed by type into binary buffers:
+
+    seq     sequence number of the frame
+    tbl     identifier of the alias table in use by the encoder
+    key     True if this is a keyframe (contains every alias)
+    base    ID of the first alias defined in 'defs'
+    defs    names of the aliases interned since the last frame (all of
+            them for a keyframe), in ID order
+    i, f, s, n
+            packed IDs and values of integer, float, string and None
+            values (see statusDeltaEncoder.pack)
+    ni, nf, ns, nn
+            number of values in each of the above
+    o       list of [id, value] pairs for any other values
+
+A subscriber can decode a delta only if it has seen every frame since the
+last keyframe, so keyframes are sent periodically (and can be requested)
+to allow late subscribers and those that miss a frame to resync.
+"""
+
+import time
+import struct
+
+import remoteObjects as ro
+import common
+
+
+# Range of integers that can be packed as 64-bit values
+min_int64 = -(2 ** 63)
+max_int64 = (2 ** 63) - 1
+
+
+def _pack_ids(ids, fmt, vals):
+    n = len(ids)
+    return ro.Binary(struct.pack('!%dI%d%s' % (n, n, fmt), *(ids + vals)))
+
+def _unpack_ids(buf, n, fmt):
+    res = struct.unpack('!%dI%d%s' % (n, n, fmt), buf)
+    return (res[:n], res[n:])
+
+
+class statusDeltaEncoder(object):
+    """Encodes dictionaries of status alias/values into frames.
+    """
+
+    def __init__(self, keyframe_interval=30.0):
+        # Interval between keyframes (sec)
+        self.keyframe_interval = keyframe_interval
+        self.time_keyframe = 0
+
+        # Identifies this alias table to decoders
+        self.tbl = int(time.time()) & 0x7fffffff
+        # alias -> id
+        self.aliasIds = {}
+        # ids in order
+        self.aliases = []
+        # index in self.aliases of the first alias not yet sent
+        self.num_sent = 0
+
+        self.seq = 0
+
+
+    def needKeyframe(self):
+        """Returns True if it is time to send a keyframe.
+        """
+        return (time.time() - self.time_keyframe) >= self.keyframe_interval
+
+
+    def intern(self, alias):
+        try:
+            return self.aliasIds[alias]
+
+        except KeyError:
+            aliasId = len(self.aliases)
+            self.aliasIds[alias] = aliasId
+            self.aliases.append(alias)
+            return aliasId
+
+
+    def pack(self, statusDict, frame):
+        """Pack the values of (statusDict) by type into (frame).
+        """
+        i_ids, i_vals = [], []
+        f_ids, f_vals = [], []
+        s_ids, s_vals = [], []
+        n_ids = []
+        others = []
+
+        for (alias, val) in statusDict.iteritems():
+            aliasId = self.intern(alias)
+
+            # NOTE: bool is a subclass of int, so check for it first
+            if isinstance(val, bool):
+                others.append([aliasId, val])
+            elif isinstance(val, (int, long)):
+                if min_int64 <= val <= max_int64:
+                    i_ids.append(aliasId)
+                    i_vals.append(val)
+                elif common.ro_long_fix:
+                    others.append([aliasId, hex(val)])
+                else:
+                    others.append([aliasId, val])
+            elif isinstance(val, float):
+                f_ids.append(aliasId)
+                f_vals.append(val)
+            elif isinstance(val, str):
+                s_ids.append(aliasId)
+                s_vals.append(val)
+            elif val is None:
+                n_ids.append(aliasId)
+            else:
+                others.append([aliasId, val])
+
+        frame['i'] = _pack_ids(i_ids, 'q', i_vals)
+        frame['ni'] = len(i_ids)
+        frame['f'] = _pack_ids(f_ids, 'd', f_vals)
+        frame['nf'] = len(f_ids)
+        # Strings are sent as their lengths followed by their contents
+        frame['s'] = ro.Binary(
+            struct.pack('!%dI%dI' % (len(s_ids), len(s_ids)),
+                        *(s_ids + map(len, s_vals))) + ''.join(s_vals))
+        frame['ns'] = len(s_ids)
+        frame['n'] = ro.Binary(struct.pack('!%dI' % len(n_ids), *n_ids))
+        frame['nn'] = len(n_ids)
+        frame['o'] = others
+
+
+    def encode(self, statusDict):
+        """Encode (statusDict), the changed alias/values since the last
+        frame, as the next delta frame.
+        """
+        self.seq += 1
+        frame = dict(seq=self.seq, tbl=self.tbl, key=False)
+
+        self.pack(statusDict, frame)
+
+        # Send any newly interned alias names
+        frame['base'] = self.num_sent
+        frame['defs'] = self.aliases[self.num_sent:]
+        self.num_sent = len(self.aliases)
+
+        return frame
+
+
+    def keyframe(self, statusDict, advance=True):
+        """Encode (statusDict), which should hold every alias, as a keyframe.
+        If (advance) is True the keyframe is the next frame of the stream,
+        otherwise it is a copy of the current state for a single subscriber
+        that needs to resync and does not advance the sequence number.
+        """
+        if advance:
+            self.seq += 1
+            self.time_keyframe = time.time()
+        frame = dict(seq=self.seq, tbl=self.tbl, key=True)
+
+        self.pack(statusDict, frame)
+
+        # Send the whole alias table
+        frame['base'] = 0
+        frame['defs'] = self.aliases[:]
+        if advance:
+            self.num_sent = len(self.aliases)
+
+        return frame
+
+
+class statusDeltaDecoder(object):
+    """Decodes frames made by a statusDeltaEncoder back into dictionaries
+    of alias/values.
+    """
+
+    def __init__(self):
+        self.tbl = None
+        self.seq = None
+        self.aliases = []
+        # True when we have a keyframe and every frame since
+        self.synced = False
+
+
+    def decode(self, frame):
+        """Returns the dictionary of alias/values in (frame).  If we are
+        not in sync with the encoder (no keyframe seen yet, or a frame was
+        missed) returns an empty dict until the next keyframe arrives.
+        """
+        seq = frame['seq']
+
+        if frame['key']:
+            # Ignore keyframes we have already moved past
+            if self.synced and (frame['tbl'] == self.tbl) and \
+                   (seq <= self.seq):
+                return {}
+
+            self.tbl = frame['tbl']
+            self.aliases = []
+            self.synced = True
+
+        elif (not self.synced) or (frame['tbl'] != self.tbl) or \
+                 (seq != self.seq + 1):
+            self.synced = False
+            return {}
+
+        self.seq = seq
+
+        # IDs never change, so definitions we already have may be resent
+        base = frame['base']
+        if base > len(self.aliases):
+            self.synced = False
+            return {}
+        defs = frame['defs']
+        self.aliases[base:base+len(defs)] = defs
+
+        return self.unpack(frame)
+
+
+    def unpack(self, frame):
+        aliases = self.aliases
+        res = {}
+
+        if frame['ni'] > 0:
+            ids, vals = _unpack_ids(ro.binary_decode(frame['i']),
+                                    frame['ni'], 'q')
+            for (aliasId, val) in zip(ids, vals):
+                res[aliases[aliasId]] = val
+
+        if frame['nf'] > 0:
+            ids, vals = _unpack_ids(ro.binary_decode(frame['f']),
+                                    frame['nf'], 'd')
+            for (aliasId, val) in zip(ids, vals):
+                res[aliases[aliasId]] = val
+
+        n = frame['ns']
+        if n > 0:
+            buf = ro.binary_decode(frame['s'])
+            hdrlen = 8 * n
+            ids, lens = _unpack_ids(buf[:hdrlen], n, 'I')
+            offset = hdrlen
+            for (aliasId, length) in zip(ids, lens):
+                res[aliases[aliasId]] = buf[offset:offset+length]
+                offset += length
+
+        n = frame['nn']
+        if n > 0:
+            ids = struct.unpack('!%dI' % n, ro.binary_decode(frame['n']))
+            for aliasId in ids:
+                res[aliases[aliasId]] = None
+
+        for (aliasId, val) in frame['o']:
+            res[aliases[aliasId]] = val
+
+        return res
+
+
+#END
@@ -140,7 +140,7 @@ class statusDeriver(object):
             'FITS.SBR.DOM-PRS' : _ident('TSCL.ATOM'),
             'FITS.SBR.OUT-PRS' : _ident('TSCL.ATOM'),
             'FITS.SBR.EQUINOX' : (['TSCS.EQUINOX'], _StatsFitsSbrEquinox),
-            'FITS.SBR.EPOCH'     : (['TSCS.ALPHA'], _FitsSbrEpoch),
+            'FITS.SBR.EPOCH'     : _volatile((['TSCS.ALPHA'], _FitsSbrEpoch)),
             'FITS.SBR.HST'     : (['FITS.SBR.EPOCH'], _FitsSbrHST),
             'FITS.SBR.UT'      : (['FITS.SBR.EPOCH'], _FitsSbrUT),
             'FITS.SBR.LST'     : (['TSCS.ALPHA', 'FITS.SBR.EPOCH',
@@ -192,11 +192,11 @@ class statusDeriver(object):
             'FITS.SBR.DEC2000' : (['TSCS.ALPHA', 'TSCS.DELTA', 'TSCS.EQUINOX'],
                                   _FitsSbrDec2000),
             # TODO: Need a dependence related to the date
-            'FITS.SBR.UT1-UTC' : (['TSCS.ALPHA'],
-                                  lambda valDict: self._FitsSbrUt1_Utc()),
+            'FITS.SBR.UT1-UTC' : _volatile((['TSCS.ALPHA'],
+                                  lambda valDict: self._FitsSbrUt1_Utc())),
             # TODO: Need a dependence related to the date
-            'FITS.SBR.UT1_UTC' : (['TSCS.DELTA'],
-                                  lambda valDict: self._FitsSbrUt1_Utc()),
+            'FITS.SBR.UT1_UTC' : _volatile((['TSCS.DELTA'],
+                                  lambda valDict: self._FitsSbrUt1_Utc())),
             'FITS.SBR.ZD'      : (['TSCS.EL'], _FitsSbrZd),
 
             'FITS.PFU.OFFSET-X': _fmt('TSCV.PF_OFF_X', "%.8f", float),
@@ -677,10 +677,36 @@ class statusDeriver(object):
         # The set of all aliases covered by this deriver
         self.allDerived = set(self.derivedKeys)
 
+        # Derived aliases that must be recomputed every time, because they
+        # depend on the clock or on tables internal to the deriver, rather
+        # than just on the values of their input aliases.  These are marked
+        # with _volatile() in the table; derivations found reading aliases
+        # they do not declare are added by __derive().
+        self.volatileKeys = set([])
+        for key in self.derivedKeys:
+            needed_keys, derive_fn = self.deriveMap[key]
+            if getattr(derive_fn, 'volatile', False):
+                self.volatileKeys.add(key)
+
+        # Derived aliases whose reads have been checked against their
+        # declared inputs
+        self.checkedKeys = set([])
+
         # This sets self.revDerviceMap
         self.__compute_reverse_dependence_map()
         #print self.revDeriveMap
 
+        # This sets self.deriveOrder, self.deriveRank and self.deriveDeps
+        self.__compute_derive_order()
+
+        # Last result of each derived alias, with the input values that
+        # were used to compute it:  <derived alias>: (<inputs>, <value>)
+        self.memo = {}
+
+        # Cache of derivation plans, indexed by the set of requested aliases
+        self.planCache = {}
+        self.planCacheSize = 1000
+
         # table of UT1-UTC offsets, indexed by truncated julian date
         self.ut1_utc = {}
 
@@ -712,6 +738,78 @@ class statusDeriver(object):
             process_keys(key, key)
             
 
+    def __compute_derive_order(self):
+        """Sort the derivation graph topologically, such that each derived
+        alias comes after all the derived aliases it depends on.  Sets
+        self.deriveOrder (the sorted list), self.deriveRank (the index
+        of each derived alias in that list) and self.deriveDeps, which
+        for each derived alias is a tuple of the set of derived aliases
+        needed to compute it (including itself) and the set of non-derived
+        aliases that those need.
+        """
+        self.deriveOrder = []
+        self.deriveRank = {}
+        self.deriveDeps = {}
+
+        def visit(key):
+            if self.deriveDeps.has_key(key):
+                return self.deriveDeps[key]
+
+            derived = set([key])
+            primary = set([])
+
+            needed_keys, derive_fn = self.deriveMap[key]
+            for nkey in needed_keys:
+                if nkey in self.allDerived:
+                    (n_derived, n_primary) = visit(nkey)
+                    derived.update(n_derived)
+                    primary.update(n_primary)
+                else:
+                    primary.add(nkey)
+
+            self.deriveRank[key] = len(self.deriveOrder)
+            self.deriveOrder.append(key)
+            self.deriveDeps[key] = (derived, primary)
+            return self.deriveDeps[key]
+
+        for key in self.derivedKeys:
+            visit(key)
+            
+
+    def __make_plan(self, aliases):
+        """Returns a tuple of the derived aliases needed to compute
+        (aliases), in evaluation order, and the list of the non-derived
+        aliases that need to be fetched from the status store to do so.
+        """
+        key = frozenset(aliases)
+        try:
+            return self.planCache[key]
+
+        except KeyError:
+            pass
+
+        to_derive = set([])
+        fetch_set = set([])
+        for alias in key:
+            try:
+                (derived, primary) = self.deriveDeps[alias]
+                to_derive.update(derived)
+                fetch_set.update(primary)
+
+            except KeyError:
+                # Just an ordinary piece of status
+                fetch_set.add(alias)
+
+        to_derive = list(to_derive)
+        to_derive.sort(key=self.deriveRank.__getitem__)
+        plan = (to_derive, list(fetch_set))
+
+        if len(self.planCache) >= self.planCacheSize:
+            self.planCache = {}
+        self.planCache[key] = plan
+        return plan
+
+
     def isDerived(self, alias):
         return (alias in self.allDerived)
 
@@ -742,36 +840,56 @@ class statusDeriver(object):
         return {}.fromkeys(to_derive, value)
 
 
-    def __derive(self, statusDict, valDict):
-        # Derive values into statusDict.  valDict contains all necessary
-        # values
-        for key in statusDict.keys():
-            if key in self.derivedKeys:
-                #? print '  self.derivedMap[%s ] = %s' % (key,self.derivedMap[key ])
-                try:
-                    needed_keys, derive_fn = self.deriveMap[key]
+    def __derive(self, key, valDict):
+        # Derive the value of (key).  valDict contains all necessary
+        # values.  If the inputs have not changed since the last time
+        # the value was computed, then the last value is returned.
+        needed_keys, derive_fn = self.deriveMap[key]
+        inputs = map(valDict.get, needed_keys)
 
-##                     self.logger.debug("Deriving '%s' using %s" % (key,
-##                                                                   valDict))
-                    val = derive_fn(valDict)
+        if not key in self.volatileKeys:
+            try:
+                (last_inputs, val) = self.memo[key]
+                if inputs == last_inputs:
+                    return val
 
-##                     self.logger.debug("%s <== %s" % (key, str(val)))
+            except KeyError:
+                pass
 
-                except Exception, e:
-                    val = STATERROR
-                    #? print 'Exception deriving %s' % key
-                    # Switch to level 15 logging here, which is between
-                    # DEBUG and INFO; that way we don't see this message
-                    # which is generated constantly
-                    self.logger.log(15, "Exception deriving '%s': %s" % (
-                        key, str(e)))
+        try:
+##             self.logger.debug("Deriving '%s' using %s" % (key,
+##                                                           valDict))
+            if key in self.checkedKeys:
+                val = derive_fn(valDict)
 
             else:
-                # Just an ordinary piece of status
-                # TODO: should this be an error?
-                val = self.statObj[key]
+                # First evaluation: check that the derivation only reads
+                # the aliases it declares, otherwise its result cannot be
+                # memoized on them
+                tracker = _readTracker(valDict)
+                try:
+                    val = derive_fn(tracker)
+                finally:
+                    self.checkedKeys.add(key)
+                    undeclared = tracker.read.difference(needed_keys)
+                    if undeclared:
+                        self.volatileKeys.add(key)
+                        self.logger.warn("'%s' reads undeclared aliases %s: not memoized" % (
+                            key, ', '.join(sorted(undeclared))))
+
+##             self.logger.debug("%s <== %s" % (key, str(val)))
 
-            statusDict[key] = val
+        except Exception, e:
+            val = STATERROR
+            #? print 'Exception deriving %s' % key
+            # Switch to level 15 logging here, which is between
+            # DEBUG and INFO; that way we don't see this message
+            # which is generated constantly
+            self.logger.log(15, "Exception deriving '%s': %s" % (
+                key, str(e)))
+
+        self.memo[key] = (inputs, val)
+        return val
 
 
     def derive(self, statusDict):
@@ -779,31 +897,25 @@ class statusDeriver(object):
         by TCS, instruments or OCS subsystems.
         """
 
-        # Compute the list of aliases we need to get from the status
-        # store to compute all derived values
-        fetch_set = set([])
-        
-        for alias in statusDict.keys():
-            try:
-                needed_keys, derive_fn = self.deriveMap[alias]
-
-                fetch_set = fetch_set.union(set(needed_keys))
-
-            except KeyError:
-                pass
+        # Work out the derived aliases needed to compute those in
+        # statusDict, in dependency order, and the list of aliases we
+        # need to get from the status store to compute them all
+        (to_derive, fetch_list) = self.__make_plan(statusDict.keys())
 
         # Now get those values
-        if fetch_set:
-            # NOTE: statObj needs to provide derived alias values as
-            # well as non-derived, because some derived values depend
-            # on others!
-            valDict = self.statObj.fetchList2Dict(fetch_set, derive=True)
+        if fetch_list:
+            valDict = self.statObj.fetchList2Dict(fetch_list, derive=False)
 
         else:
             valDict = {}
 
-        # Derive all keys in this statusDict
-        self.__derive(statusDict, valDict)
+        # Derive all needed keys, each exactly once.  Derived values that
+        # depend on other derived values are computed after them.
+        for key in to_derive:
+            valDict[key] = self.__derive(key, valDict)
+
+        for key in statusDict.keys():
+            statusDict[key] = valDict[key]
 
 
     def deriveOne(self, alias):
@@ -958,6 +1070,38 @@ def _Fmt02x(ival):
 def _ident(aliasName):
     return ([aliasName], lambda valDict: valDict[aliasName])
 
+def _volatile(entry):
+    """Marks a derivation table entry whose value depends on more than
+    the values of its input aliases (e.g. the clock), so that it is
+    recomputed every time.
+    """
+    needed_keys, derive_fn = entry
+    derive_fn.volatile = True
+    return entry
+
+class _readTracker(dict):
+    """Copy of a value dict that records which aliases are read from it.
+    """
+    def __init__(self, valDict):
+        dict.__init__(self, valDict)
+        self.read = set([])
+
+    def __getitem__(self, key):
+        self.read.add(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        self.read.add(key)
+        return dict.get(self, key, default)
+
+    def has_key(self, key):
+        self.read.add(key)
+        return dict.has_key(self, key)
+
+    def __contains__(self, key):
+        self.read.add(key)
+        return dict.__contains__(self, key)
+
 def _apply(aliasName, fn):
     return ([aliasName], lambda valDict: fn(valDict[aliasName]))
 
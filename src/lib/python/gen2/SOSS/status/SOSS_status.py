@@ -588,6 +588,30 @@ class cachedStatusObj(baseSOSSstatusObj):
         return val
 
 
+    # Extract the values of many aliases of a single table in one pass,
+    # using the precompiled decoder for the table.  If aliasnames is None
+    # then all the aliases of the table are returned.
+    #
+    def get_tableValuesDict(self, tablename, aliasnames=None,
+                            allow_fail=True):
+
+        decoder = self.info.get_tableDecoder(tablename)
+
+        self.updateTableConditionally(tablename)
+
+        cacheobj = self.get_tableCache(tablename)
+
+        cacheobj.lock.acquire()
+        try:
+            buf = cacheobj.table
+
+        finally:
+            cacheobj.lock.release()
+
+        return decoder.decode(buf, aliasnames=aliasnames,
+                              allow_fail=allow_fail)
+
+
     def get_statusValuesList(self, aliasnames, allow_fail=True):
             res = []
             for aliasname in aliasnames:
@@ -626,6 +650,10 @@ class cachedStatusObj(baseSOSSstatusObj):
                                                       allow_fail=allow_fail)
             return res
         
+    def fetchTable(self, tablename, aliasnames=None, allow_fail=True):
+        return self.get_tableValuesDict(tablename, aliasnames=aliasnames,
+                                        allow_fail=allow_fail)
+        
     def store(self, statusDict):
         raise common.statusError("This is a read-only status object.")
 
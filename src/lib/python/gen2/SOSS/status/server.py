@@ -366,9 +366,8 @@ class StatusServer(object):
                 if self.statusObj.isTableExpired(tblName):
                     self.statusObj.updateTable(tblName)
 
-                    # Get all status aliases defined by this table
-                    aliases = self.statusInfo.tableToAliases(tblName)
-                    statusDict = self.statusObj.fetchList(aliases)
+                    # Decode all status aliases defined by this table
+                    statusDict = self.statusObj.fetchTable(tblName)
                     self.logger.debug("fetched statusDict=%s" % str(statusDict))
 
                     # Store those locally
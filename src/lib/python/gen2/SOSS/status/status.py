@@ -18,6 +18,7 @@ import SOSS.SOSSrpc as SOSSrpc
 import SOSS.status as st
 import interface
 import Derive
+import Delta
 import common
 import remoteObjects as ro
 import remoteObjects.Monitor as Monitor
@@ -60,7 +61,7 @@ class StatusServer(object):
     
     def __init__(self, statusObj, logger, monitor, threadPool,
                  monchannels=['status'], checkptfile='status.cpt',
-                 ut1utcfile=None, ev_quit=None):
+                 ut1utcfile=None, ev_quit=None, monxmit_format='dict'):
 
         self.logger = logger
         self.monitor = monitor
@@ -73,9 +74,18 @@ class StatusServer(object):
         self.tag = 'status'
         self.shares = ['logger', 'threadPool']
 
-        # This holds the current decoded status values
+        # This holds the current decoded status values.  A published dict
+        # is never modified: writers make an updated copy and publish that
+        # (see __publish), so that readers can use a snapshot without
+        # taking the lock.  (generation, dict) of the current snapshot.
         #self.g2status = Bunch.threadSafeBunch()
         self.g2status = {}
+        self.generation = 0
+        self._snapshot = (self.generation, self.g2status)
+
+        # Unpublished dict being built by a writer, visible only to the
+        # writer's thread (the deriver reads through it): (thread, dict)
+        self._working = (None, None)
 
         self.mon_transmit = common.mon_transmit
 
@@ -86,6 +96,13 @@ class StatusServer(object):
         self.monxmit_interval = 1.0
         self.monxmit_lastDict = {}
         self.monxmit_nextDict = {}
+
+        # How status is sent through the monitor: 'dict' sends the
+        # changed alias/values on the 'status' channel, 'delta' sends
+        # delta-encoded frames (see Delta.py) on the 'statusdelta'
+        # channel, 'both' does both
+        self.monxmit_format = monxmit_format
+        self.monxmit_encoder = Delta.statusDeltaEncoder()
         self.ev_quit = ev_quit
         
         # For looking up information about tables, aliases, etc.
@@ -118,29 +135,61 @@ class StatusServer(object):
 
         Returns a dictionary of the result values.
         """
+        (generation, values) = self.__get_snapshot()
         
-        with self._lock:
+        # Recompute derived aliases if derive==True, all in one pass.
+        # The deriver keeps state, so this needs the lock.
+        derived = {}
+        if derive:
             for alias in statusDict.keys():
-                # Recompute derived aliases if derive==True
-                if derive and self.derive.isDerived(alias):
-                    val = self.derive.deriveOne(alias)
+                if self.derive.isDerived(alias):
+                    derived[alias] = None
+            if derived:
+                with self._lock:
+                    self.derive.derive(derived)
 
-                else:
-                    # Non-derived alias.
-                    try:
-                        val = self.g2status[alias]
+        # Non-derived aliases are read from the snapshot without locking
+        for alias in statusDict.keys():
+            if derived.has_key(alias):
+                val = derived[alias]
 
-                    except KeyError:
-                        #val = common.STATERROR
-                        val = common.STATNONE
+            else:
+                # Non-derived alias.
+                try:
+                    val = values[alias]
 
-                # Convert None --> ##NODATA## if allow_none==True
-                if (val == None) and (not allow_none):
+                except KeyError:
+                    #val = common.STATERROR
                     val = common.STATNONE
 
-                statusDict[alias] = val
+            # Convert None --> ##NODATA## if allow_none==True
+            if (val == None) and (not allow_none):
+                val = common.STATNONE
+
+            statusDict[alias] = val
+
+        return statusDict
+
+
+    def __get_snapshot(self):
+        """Returns (generation, dict) of the current status snapshot.  A
+        writer in the middle of __store sees the values it has stored so
+        far.  The dict must not be modified.
+        """
+        (thread, values) = self._working
+        if (thread is not None) and (thread == threading.currentThread()):
+            return (self.generation, values)
+
+        return self._snapshot
+
 
-            return statusDict
+    def __publish(self, values):
+        """Make (values) the current status snapshot.  Must be called with
+        the lock held.
+        """
+        self.generation += 1
+        self.g2status = values
+        self._snapshot = (self.generation, values)
 
     
     def __fetchOne(self, alias, derive=False, allow_none=False):
@@ -162,9 +211,10 @@ class StatusServer(object):
         with self._lock:
 #             mon_d = {}
             
-            # Store status items
+            # Store status items into a new copy of the status
             self.logger.debug("Stored: %s" % str(statusDict))
-            self.g2status.update(statusDict)
+            values = self.g2status.copy()
+            values.update(statusDict)
 
             if self.mon_transmit:
                 self.monxmit_nextDict.update(statusDict)
@@ -174,13 +224,20 @@ class StatusServer(object):
                 d = self.derive.aliasesToDerivedAliasesDict(statusDict.keys(),
                                                             None)
                 if d:
-                    self.derive.derive(d)
+                    self._working = (threading.currentThread(), values)
+                    try:
+                        self.derive.derive(d)
+                    finally:
+                        self._working = (None, None)
+                        
                     self.logger.debug("Derived: %s" % str(d))
-                    self.g2status.update(d)
+                    values.update(d)
 
                     if self.mon_transmit:
                         self.monxmit_nextDict.update(d)
 
+            self.__publish(values)
+
 #             if self.mon_transmit:
 #                 # Update status seen through the monitor
 #                 self.monitor.update('mon.status', mon_d, ['status'])
@@ -193,6 +250,8 @@ class StatusServer(object):
             time_end = cur_time + self.monxmit_interval
 
             mon_d = {}
+            delta_d = {}
+            frame = None
 
             #self.logger.debug("nextDict= %s" % str(self.monxmit_nextDict))
             with self._lock:
@@ -209,6 +268,7 @@ class StatusServer(object):
                         pass
 
                     self.monxmit_lastDict[alias] = val
+                    delta_d[alias] = val
 
                     if isinstance(val, long) and common.ro_long_fix:
                         val = hex(val)
@@ -221,11 +281,30 @@ class StatusServer(object):
 
                 self.monxmit_nextDict = {}
 
+                if self.monxmit_format in ('delta', 'both'):
+                    # Periodically send everything so that new or
+                    # out-of-sync subscribers can resync
+                    if self.monxmit_encoder.needKeyframe():
+                        frame = self.monxmit_encoder.keyframe(
+                            self.g2status)
+                    # Nothing changed: don't send an empty frame
+                    elif len(delta_d) > 0:
+                        frame = self.monxmit_encoder.encode(delta_d)
+
             #self.monxmit(mon_d)
             try:
                 # Update status seen through the monitor
-                self.logger.debug("Sending status via monitor: %s" % str(mon_d))
-                self.monitor.update('mon.status', mon_d, ['status'])
+                if self.monxmit_format in ('dict', 'both'):
+                    self.logger.debug("Sending status via monitor: %s" % str(mon_d))
+                    self.monitor.update('mon.status', mon_d, ['status'])
+
+                if frame is not None:
+                    self.logger.debug("Sending status delta via monitor: seq=%d" % (
+                        frame['seq']))
+                    # every frame is needed to decode the next one, so
+                    # they must not be coalesced
+                    self.monitor.update('mon.statusdelta', frame,
+                                        ['statusdelta'], coalesce=False)
 
             except Exception, e:
                 self.logger.error("Error transmitting status: %s" % str(e))
@@ -250,7 +329,10 @@ class StatusServer(object):
         except IOError, e:
             # No checkpoint file, so update bare status dict with known
             # special values
-            self.g2status.update(specialValues)
+            with self._lock:
+                values = self.g2status.copy()
+                values.update(specialValues)
+                self.__publish(values)
 
         t = Task.FuncTask(self.__monxmit_loop, [], {})
         t.init_and_start(self)
@@ -289,6 +371,44 @@ class StatusServer(object):
         return d
 
 
+    def fetchGen(self, statusDict):
+        """Like fetch(), but returns a tuple of the generation number of
+        the status snapshot the values were read from and the dict.  The
+        generation number increases with each update of the status.
+        """
+        (generation, values) = self.__get_snapshot()
+
+        d = {}
+        for alias in statusDict.keys():
+            val = values.get(alias, common.STATNONE)
+            if val == None:
+                val = common.STATNONE
+            d[alias] = val
+
+        # Sanitize for return trip over remoteObjects, if necessary
+        if common.ro_long_fix:
+            d = common.ro_sanitize(d)
+
+        return (generation, d)
+
+
+    def getGeneration(self):
+        """Returns the generation number of the current status snapshot.
+        """
+        return self.__get_snapshot()[0]
+
+
+    def fetchKeyframe(self):
+        """Returns a keyframe of the delta-encoded status stream (see
+        Delta.py), holding every status value.  Subscribers to the
+        'statusdelta' channel can call this to resync without waiting for
+        the next periodic keyframe.
+        """
+        with self._lock:
+            return self.monxmit_encoder.keyframe(self.g2status,
+                                                 advance=False)
+
+
     def fetchDict(self, aliases):
         """Fetch the list of status aliases in the sequence _aliases_
         and return a dictionary of the results.
@@ -353,10 +473,10 @@ class StatusServer(object):
             filepath = self.checkptfile
 
         self.logger.info("Checkpointing status...")
-        with self._lock:
-            with open(filepath, 'w') as out_f:
-                out_f.write("#\n# Gen2 status snapshot: %s\n#\n" % (time.ctime()))
-                out_f.write(str(self.g2status))
+        (generation, values) = self.__get_snapshot()
+        with open(filepath, 'w') as out_f:
+            out_f.write("#\n# Gen2 status snapshot: %s\n#\n" % (time.ctime()))
+            out_f.write(str(values))
 
         self.logger.info("Done.")
         return ro.OK
@@ -469,13 +589,13 @@ class StatusServer(object):
                 if self.statusObj.isTableExpired(tblName):
                     self.statusObj.updateTable(tblName)
 
-                    # Get all status aliases defined by this table
-                    aliases = self.statusInfo.tableToAliases(tblName)
-
+                    # Decode all status aliases defined by this table
+                    aliases = None
                     if self.ignoreAliases:
-                        aliases = set(aliases).difference(self.ignoreAliases)
+                        aliases = set(self.statusInfo.tableToAliases(tblName))
+                        aliases = aliases.difference(self.ignoreAliases)
 
-                    statusDict = self.statusObj.fetchList(aliases)
+                    statusDict = self.statusObj.fetchTable(tblName, aliases)
                     self.logger.debug("fetched statusDict=%s" % str(statusDict))
 
                     # Store those locally
@@ -538,6 +658,21 @@ class StatusServer(object):
             for alias in aliaslist:
                 del self.monxmit_fetchDict[alias]
         
+    def update_monxmit_format(self, fmt):
+        """Set how status is sent through the monitor: one of 'dict',
+        'delta' or 'both'.
+        """
+        if not fmt in ('dict', 'delta', 'both'):
+            raise statusServerError("Bad monitor transmit format: '%s'" % (
+                fmt))
+        self.logger.info("Setting monitor transmit format (%s)" % (fmt))
+        with self._lock:
+            self.monxmit_format = fmt
+
+        self.logger.info("Done.")
+        return ro.OK
+    
+
     def update_monxmit_interval(self, interval):
         self.logger.info("Updating monitor transmit interval (%f)" % (
             interval))
@@ -560,7 +695,7 @@ def main(options, args):
     logger = ssdlog.make_logger(svcname, options)
 
     # TODO: parameterize monitor channels
-    monchannels = ['status', 'statupd', 'statint']
+    monchannels = ['status', 'statusdelta', 'statupd', 'statint']
 
     # Initialize remote objects subsystem.
     try:
@@ -639,7 +774,8 @@ def main(options, args):
                               monchannels=monchannels,
                               checkptfile=options.checkptfile,
                               ut1utcfile=ut1utc_path,
-                              ev_quit=ev_quit)
+                              ev_quit=ev_quit,
+                              monxmit_format=options.monformat)
 
         # Initialize it
         status.initialize()
@@ -658,7 +794,8 @@ def main(options, args):
                                            port=options.port,
                                            ev_quit=ev_quit,
                                            usethread=False,
-                                           threadPool=threadPool)
+                                           threadPool=threadPool,
+                                           numworkers=options.numworkers)
         try:
             print "Press ^C to terminate the server."
             status_svr.ro_start(wait=True)
@@ -717,6 +854,10 @@ if __name__ == '__main__':
     optprs.add_option("-m", "--monitor", dest="monitor", default='monitor',
                       metavar="NAME",
                       help="Subscribe to feeds from monitor service NAME")
+    optprs.add_option("--monformat", dest="monformat", default='dict',
+                      type="choice", choices=['dict', 'delta', 'both'],
+                      help="Send status through the monitor as FORMAT (dict|delta|both)",
+                      metavar="FORMAT")
     optprs.add_option("--monunit", dest="monunitnum", type="int",
                       default=3, metavar="NUM",
                       help="Target OSSL_MonitorUnit NUM on OBS")
@@ -725,6 +866,9 @@ if __name__ == '__main__':
     optprs.add_option("--numthreads", dest="numthreads", type="int",
                       default=100,
                       help="Use NUM threads in thread pool", metavar="NUM")
+    optprs.add_option("--numworkers", dest="numworkers", type="int",
+                      default=0, metavar="NUM",
+                      help="Serve requests with a pool of NUM workers")
     optprs.add_option("--port", dest="port", type="int", default=None,
                       help="Register using PORT", metavar="PORT")
     optprs.add_option("--profile", dest="profile", action="store_true",
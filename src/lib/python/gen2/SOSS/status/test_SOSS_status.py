@@ -3,7 +3,14 @@
 import unittest
 import logging
 import SOSS_status as SOSS_status
+import Convert
+import Derive
+import Delta
+import remoteObjects.Monitor as Monitor
+import remoteObjects.PubSub as PubSub
+import common
 import struct
+from Bunch import Bunch
 
 logger = logging.getLogger('SOSS_statusTest')
 
@@ -115,6 +122,248 @@ class statusConverterTestCase(unittest.TestCase):
         result = self.converter.conv_D(src, self.alias)
         self.assertEqual(-100.0, result)
         
+
+class statusTableDecoderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.converter = Convert.statusConverter()
+
+        # offset, length, type, mask, multiplier
+        fields = [('T.B1',  0, 2, 'B', 0x8000, None),
+                  ('T.B2',  2, 6, 'B', 0xf00000000000, None),
+                  ('T.B3',  8, 10, 'B', None, None),
+                  ('T.D1', 18, 6, 'D', None, None),
+                  ('T.D2', 24, 3, 'D', 0xffff00, None),
+                  ('T.L1', 27, 4, 'L', None, 2.0),
+                  ('T.L2', 31, 3, 'L', None, 0.01),
+                  ('T.S1', 34, 4, 'S', None, 0.01),
+                  ('T.S2', 38, 2, 'S', None, None),
+                  ('T.S3', 40, 3, 'S', None, 1.0),
+                  ('T.C1', 43, 8, 'C', None, None),
+                  ('T.F1', 51, 8, 'F', None, None),
+                  ('T.I1', 59, 4, 'I', None, None),
+                  ('T.I2', 63, 4, 'I', None, None),
+                  ]
+        self.aliasdefs = []
+        for (name, offset, length, stype, mask, multiplier) in fields:
+            self.aliasdefs.append(Bunch(aliasname=name, tablename='T',
+                                        offset=offset, length=length,
+                                        stype=stype, mask=mask,
+                                        multiplier=multiplier,
+                                        supp_data={}))
+        self.decoder = Convert.statusTableDecoder('T', self.aliasdefs)
+
+        self.buf = ('\xC0\x00' + '\x80\x00\x00\x00\x00\x01' +
+                    '\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a' +
+                    '\x80\x00\x10\x00\x00\x01' + '\x80\x00\x10' +
+                    '\x80\x00\x00\x00' + '\x01\x02\x03' +
+                    '\xff\xff\xff\x9c' + '\x80\x00' + '\x80\x00\x00' +
+                    '  abc   ' + ' 12.5   ' + '  42' + '    ')
+
+    def testDecodeMatchesConverter(self):
+        result = self.decoder.decode(self.buf)
+        for aliasdef in self.aliasdefs:
+            data = self.buf[aliasdef.offset:aliasdef.offset+aliasdef.length]
+            try:
+                val = self.converter.convert(data, aliasdef)
+            except Convert.statusConversionError:
+                val = common.STATERROR
+            self.assertEqual(val, result[aliasdef.aliasname])
+
+    def testBatchMatchesConverter(self):
+        if Convert.numpy is None:
+            return
+        batch = Convert.statusBatchConverter(self.aliasdefs)
+        self.assertEqual(set(['T.B1', 'T.B2', 'T.D1', 'T.D2', 'T.L1',
+                              'T.L2', 'T.S1', 'T.S2']), batch.aliasnames)
+        # BCD fields: valid, negative zero, all 'f's and an exponent
+        for bcd in ('\x01\x23\x45\x67\x89\x01', '\x80\x00\x00\x00\x00\x00',
+                    '\xff\xff\xff\xff\xff\xff', '\x01\x23\x4e\x23\x00\x00'):
+            buf = self.buf[:18] + bcd + self.buf[24:]
+            (result, rejects) = batch.convert(buf)
+            for name in rejects:
+                self.assertEqual('T.D1', name)
+                del result[name]
+            for aliasdef in self.aliasdefs:
+                if not result.has_key(aliasdef.aliasname):
+                    continue
+                data = buf[aliasdef.offset:aliasdef.offset+aliasdef.length]
+                val = self.converter.convert(data, aliasdef)
+                # must be bit-identical, not just equal
+                self.assertEqual(repr(val), repr(result[aliasdef.aliasname]))
+            self.assertEqual(self.decoder.decode(buf)['T.D1'],
+                             self.decoder.decode(buf, ['T.D1'])['T.D1'])
+
+    def testDecodeSubset(self):
+        result = self.decoder.decode(self.buf, aliasnames=['T.D1', 'T.I1'])
+        self.assertEqual({'T.D1': -0.10000001, 'T.I1': 42}, result)
+
+    def testDecodeNoFail(self):
+        self.assertRaises(Convert.statusConversionError,
+                          self.decoder.decode, self.buf, ['T.S3'], False)
+
+
+class fakeStatusStore(object):
+    def __init__(self, vals):
+        self.vals = vals
+        self.fetches = 0
+
+    def fetchList2Dict(self, aliases, derive=False):
+        self.fetches += 1
+        return dict([(alias, self.vals.get(alias, 1)) for alias in aliases])
+
+
+class statusDeriverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = fakeStatusStore({})
+        self.deriver = Derive.statusDeriver(self.store, logger)
+
+    def testVolatileFromTable(self):
+        self.assert_(self.deriver.volatileKeys.issuperset(
+            ['FITS.SBR.EPOCH', 'FITS.SBR.UT1-UTC', 'FITS.SBR.UT1_UTC']))
+
+    def addDerivation(self, alias, needed_keys, derive_fn):
+        # registers a derivation that only needs primary aliases
+        self.deriver.deriveMap[alias] = (needed_keys, derive_fn)
+        self.deriver.allDerived.add(alias)
+        self.deriver.deriveDeps[alias] = (set([alias]), set(needed_keys))
+        self.deriver.deriveRank[alias] = len(self.deriver.deriveOrder)
+        self.deriver.deriveOrder.append(alias)
+
+    def testMemoized(self):
+        calls = []
+        def fn(valDict):
+            calls.append(1)
+            return 2*valDict['T.X']
+        self.addDerivation('T.DOUBLE', ['T.X'], fn)
+        self.store.vals['T.X'] = 3
+        self.assertEqual(6, self.deriver.deriveOne('T.DOUBLE'))
+        self.assertEqual(6, self.deriver.deriveOne('T.DOUBLE'))
+        self.assertEqual(1, len(calls))
+        self.store.vals['T.X'] = 4
+        self.assertEqual(8, self.deriver.deriveOne('T.DOUBLE'))
+
+    def testUndeclaredReadNotMemoized(self):
+        # reads an alias it does not declare: must not be memoized on T.X
+        calls = []
+        def fn(valDict):
+            calls.append(1)
+            return valDict['T.X'] + valDict.get('T.Y', 0)
+        self.addDerivation('T.SUM', ['T.X'], fn)
+        self.deriver.deriveOne('T.SUM')
+        self.assert_('T.SUM' in self.deriver.volatileKeys)
+        self.deriver.deriveOne('T.SUM')
+        self.assertEqual(2, len(calls))
+
+
+class statusDeltaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = Delta.statusDeltaEncoder()
+        self.decoder = Delta.statusDeltaDecoder()
+        self.status = {'T.INT': 1, 'T.FLOAT': 2.5, 'T.STR': 'abc',
+                       'T.NONE': None, 'T.BOOL': True,
+                       'T.BIG': 2 ** 70}
+
+    def decode(self, frame):
+        return self.decoder.decode(frame)
+
+    def testKeyframe(self):
+        frame = self.encoder.keyframe(self.status)
+        self.assertEqual(self.status, self.decode(frame))
+        self.assert_(self.decoder.synced)
+
+    def testDeltas(self):
+        self.decode(self.encoder.keyframe(self.status))
+        d = {'T.INT': -5, 'T.STR': ''}
+        self.assertEqual(d, self.decode(self.encoder.encode(d)))
+        d = {'T.FLOAT': None, 'T.NONE': 'x\x00y'}
+        self.assertEqual(d, self.decode(self.encoder.encode(d)))
+
+    def testNewAliases(self):
+        self.decode(self.encoder.keyframe(self.status))
+        d = {'T.NEW1': 3, 'T.INT': 4}
+        self.assertEqual(d, self.decode(self.encoder.encode(d)))
+        d = {'T.NEW2': 'new', 'T.NEW1': 5.0}
+        self.assertEqual(d, self.decode(self.encoder.encode(d)))
+        self.assertEqual(self.encoder.aliases, self.decoder.aliases)
+
+    def testSeqGap(self):
+        self.decode(self.encoder.keyframe(self.status))
+        # the frame defining T.NEW is missed
+        self.encoder.encode({'T.NEW': 1})
+        self.assertEqual({}, self.decode(self.encoder.encode({'T.NEW': 2})))
+        self.failIf(self.decoder.synced)
+        # stays out of sync until the next keyframe
+        self.assertEqual({}, self.decode(self.encoder.encode({'T.INT': 7})))
+
+        self.status.update({'T.NEW': 2, 'T.INT': 7})
+        self.assertEqual(self.status,
+                         self.decode(self.encoder.keyframe(self.status)))
+        d = {'T.NEW': 3}
+        self.assertEqual(d, self.decode(self.encoder.encode(d)))
+
+    def testResyncKeyframe(self):
+        # a keyframe fetched by a late subscriber does not advance the
+        # stream, and the deltas that follow it decode
+        self.decode(self.encoder.keyframe(self.status))
+        self.encoder.encode({'T.NEW': 1})
+
+        decoder = Delta.statusDeltaDecoder()
+        self.status['T.NEW'] = 1
+        frame = self.encoder.keyframe(self.status, advance=False)
+        self.assertEqual(self.status, decoder.decode(frame))
+        d = {'T.NEW': 2, 'T.NEW2': 'z'}
+        self.assertEqual(d, decoder.decode(self.encoder.encode(d)))
+
+        # a stale keyframe is ignored once in sync
+        self.assertEqual({}, decoder.decode(frame))
+        self.assert_(decoder.synced)
+
+    def testNewTable(self):
+        # a restarted encoder has a new alias table
+        self.decode(self.encoder.keyframe(self.status))
+        encoder = Delta.statusDeltaEncoder()
+        encoder.tbl = self.encoder.tbl + 1
+        self.assertEqual({}, self.decode(encoder.encode({'T.INT': 1})))
+        self.assertEqual(self.status,
+                         self.decode(encoder.keyframe(self.status)))
+
+    def testCoalescingQueue(self):
+        # delta frames published through a Monitor reach a slow
+        # subscriber intact and in order, instead of being merged like
+        # dict updates
+        monitor = Monitor.Monitor('test', logging.getLogger())
+        queue = PubSub.SubscriberQueue('sub')
+        channels = ['statusdelta']
+
+        def put(path, value, coalesce=True):
+            payload = dict(msg='update', path=path, value=value)
+            if not coalesce:
+                payload['coalesce'] = False
+            key = monitor._coalesce_key(payload, channels)
+            queue.put(payload, ['test'], channels, key, monitor._coalesce)
+
+        expected = dict(self.status)
+        put('mon.statusdelta', self.encoder.keyframe(self.status), False)
+        for i in xrange(5):
+            d = {'T.INT': i, 'T.NEW%d' % i: float(i)}
+            expected.update(d)
+            put('mon.status', d)
+            put('mon.statusdelta', self.encoder.encode(d), False)
+
+        items = queue.get_batch(100)
+        frames = [item.value['value'] for item in items
+                  if item.value['path'] == 'mon.statusdelta']
+        self.assertEqual(6, len(frames))
+        self.assertEqual(range(1, 7), [frame['seq'] for frame in frames])
+
+        res = {}
+        for frame in frames:
+            res.update(self.decode(frame))
+        self.assert_(self.decoder.synced)
+        self.assertEqual(expected, res)
+
+
 if __name__ == '__main__':
     rootLogger = logging.getLogger()
     rootLogger.addHandler(logging.StreamHandler())
@@ -192,7 +192,51 @@ class Monitor(ps.PubSub):
         return super(Monitor, self).remote_update(payload, names, channels)
 
 
-    def update(self, path, value, channels):
+    def _filter_value(self, payload, keyfilter):
+        """Returns _payload_ with only the items of its value (if it is a
+        dict, e.g. status aliases and their values) that are passed by
+        _keyfilter_, or None if there is nothing to send.
+        """
+        if (payload.get('msg', None) != 'update') or \
+               (not isinstance(payload.get('value', None), dict)) or \
+               (not payload.get('coalesce', True)):
+            return payload
+
+        value = keyfilter.filter(payload['value'])
+        if len(value) == 0:
+            return None
+
+        res = payload.copy()
+        res['value'] = value
+        return res
+
+
+    def _coalesce_key(self, payload, channels):
+        # Updates to the same path on the same channels can be coalesced,
+        # unless the publisher says that each one must be delivered (e.g.
+        # status delta frames, which each depend on the previous one)
+        if (payload.get('msg', None) != 'update') or \
+               (not payload.get('coalesce', True)):
+            return None
+        return (payload['path'], tuple(channels))
+
+
+    def _coalesce(self, old_payload, new_payload):
+        # If the values are dicts (e.g. status aliases and their values)
+        # the newer items are merged into the older ones, otherwise the
+        # newer value replaces the older one
+        if not (isinstance(old_payload['value'], dict) and
+                isinstance(new_payload['value'], dict)):
+            return new_payload
+
+        value = old_payload['value'].copy()
+        value.update(new_payload['value'])
+        res = new_payload.copy()
+        res['value'] = value
+        return res
+
+
+    def update(self, path, value, channels, coalesce=True):
         """
         Method called by local users of this Monitor to update it
         with new and changed items.
@@ -200,12 +244,17 @@ class Monitor(ps.PubSub):
             value
             channels    one (a string) or more (a list) of channel names to
                         which to send the specified update
+            coalesce    if False, every update is delivered as is and in
+                        order: not merged with other unsent updates for a
+                        slow subscriber, nor filtered by key
         """
         # TODO: should this all be in a critical section?
         self.do_update(path, value)
         
         payload = dict(msg='update', path=path, value=value,
                        time_pack=time.time())
+        if not coalesce:
+            payload['coalesce'] = False
         
         return self.notify(payload, channels)
 
@@ -737,6 +786,7 @@ def main(options, args):
     try:
         try:
             monitor.start_server(port=options.port, wait=True, 
+                                 numworkers=options.numworkers,
                                  usethread=usethread)
         
         except KeyboardInterrupt:
@@ -764,6 +814,9 @@ if __name__ == '__main__':
     optprs.add_option("--numthreads", dest="numthreads", type="int",
                       default=20,
                       help="Use NUM threads", metavar="NUM")
+    optprs.add_option("--numworkers", dest="numworkers", type="int",
+                      default=0, metavar="NUM",
+                      help="Serve requests with a pool of NUM workers")
     optprs.add_option("--port", dest="port", type="int", default=None,
                       help="Register using PORT", metavar="PORT")
     optprs.add_option("--profile", dest="profile", action="store_true",
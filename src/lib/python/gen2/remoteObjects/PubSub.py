@@ -21,7 +21,9 @@ Main issues to think about/resolve:
 """
 
 import sys, time
+import re, fnmatch
 import threading, Queue
+from collections import deque
 # API at Python v2.4
 if sys.hexversion < 0x02040000:
     from sets import Set as set
@@ -44,6 +46,182 @@ class PubSubError(Exception):
     """
     pass
 
+
+class KeyFilter(object):
+    """Matches the keys of dict values against a set of patterns, so
+    that a subscriber can receive only the items it is interested in.
+    Patterns are either exact keys (e.g. 'FITS.SBR.RA') or shell-style
+    wildcards (e.g. 'TSCS.*').
+    """
+
+    def __init__(self, patterns):
+        self.patterns = frozenset(patterns)
+
+        self.exact = set([])
+        wildcards = []
+        for pattern in self.patterns:
+            if ('*' in pattern) or ('?' in pattern) or ('[' in pattern):
+                wildcards.append(fnmatch.translate(pattern))
+            else:
+                self.exact.add(pattern)
+
+        # All the wildcard patterns are matched by a single regex
+        if len(wildcards) > 0:
+            self.regex = re.compile('|'.join(wildcards))
+        else:
+            self.regex = None
+
+        # Cache of match results for keys that are not exact matches;
+        # keys are usually drawn from a fixed set (e.g. status aliases)
+        self.cache = {}
+        self.cache_limit = 100000
+
+    def match(self, key):
+        if key in self.exact:
+            return True
+        if self.regex == None:
+            return False
+        try:
+            return self.cache[key]
+
+        except KeyError:
+            res = (self.regex.match(key) != None)
+            if len(self.cache) >= self.cache_limit:
+                self.cache.clear()
+            self.cache[key] = res
+            return res
+
+    def filter(self, valDict):
+        """Returns a dict of the items of _valDict_ whose keys match.
+        """
+        # Fast path for small sets of exact keys
+        if (self.regex == None) and (len(self.exact) < len(valDict)):
+            res = {}
+            for key in self.exact:
+                if valDict.has_key(key):
+                    res[key] = valDict[key]
+            return res
+
+        res = {}
+        for key, val in valDict.iteritems():
+            if self.match(key):
+                res[key] = val
+        return res
+
+def _no_such_method(e, methodName):
+    """Returns True if exception _e_, from a call to a remote object,
+    definitely says that it has no method _methodName_ (the call was not
+    made), as opposed to an error that may have happened during the call.
+    """
+    return ('method "%s" is not supported' % methodName) in str(e)
+
+
+class SubscriberQueue(object):
+    """Outbound queue of updates for one subscriber.
+
+    Updates that have the same coalescing key (see
+    PubSubBase._coalesce_key) replace (or are merged into) an older unsent
+    update, so a slow subscriber gets the latest values instead of a
+    growing backlog.  If the queue reaches its limit the oldest updates
+    are dropped.  At most one sender drains the queue at a time.
+    """
+
+    def __init__(self, subscriber, limit=1000):
+        self.subscriber = subscriber
+        self.limit = limit
+
+        self.lock = threading.Lock()
+        self.items = deque()
+        # coalescing key -> queued item
+        self.index = {}
+        # True while a sender task is draining this queue
+        self.sending = False
+        # False if the subscriber does not support remote_update_batch()
+        # (checked again when it resubscribes or after a failure)
+        self.batch_ok = True
+
+        self.stats = Bunch.Bunch(queued=0, coalesced=0, dropped=0,
+                                 sent=0, batches=0, max_depth=0,
+                                 latency=0.0)
+
+    def put(self, value, names, channels, key, merge):
+        """Queue an update.  _merge_ is called with the old and new
+        values if an unsent update with the same _key_ is queued.  Returns
+        True if the caller should start a sender for this queue.
+        """
+        self.lock.acquire()
+        try:
+            self.stats.queued += 1
+
+            if key != None:
+                try:
+                    item = self.index[key]
+                    item.value = merge(item.value, value)
+                    item.names = names
+                    self.stats.coalesced += 1
+                    return False
+
+                except KeyError:
+                    pass
+            else:
+                # Don't coalesce across an update that can't be, e.g. a
+                # delete, to preserve ordering
+                self.index.clear()
+
+            item = Bunch.Bunch(value=value, names=names, channels=channels,
+                               key=key, time_queued=time.time())
+            self.items.append(item)
+            if key != None:
+                self.index[key] = item
+
+            # Drop the oldest updates if we are over our limit
+            while len(self.items) > self.limit:
+                old = self.items.popleft()
+                if (old.key != None) and (self.index.get(old.key) is old):
+                    del self.index[old.key]
+                self.stats.dropped += 1
+
+            self.stats.max_depth = max(self.stats.max_depth, len(self.items))
+
+            if self.sending:
+                return False
+            self.sending = True
+            return True
+
+        finally:
+            self.lock.release()
+
+    def get_batch(self, count):
+        """Remove and return up to _count_ of the oldest updates.  If there
+        are none the sender is done and should exit.
+        """
+        self.lock.acquire()
+        try:
+            res = []
+            while (len(res) < count) and (len(self.items) > 0):
+                item = self.items.popleft()
+                if (item.key != None) and (self.index.get(item.key) is item):
+                    del self.index[item.key]
+                res.append(item)
+
+            if len(res) == 0:
+                self.sending = False
+            return res
+
+        finally:
+            self.lock.release()
+
+    def get_stats(self):
+        self.lock.acquire()
+        try:
+            res = dict(self.stats)
+            res['depth'] = len(self.items)
+            return res
+
+        finally:
+            self.lock.release()
+
+
 class PubSubBase(object):
     """Base class for publish/subscribe entities.
     """
@@ -96,6 +274,14 @@ class PubSubBase(object):
         # For handling subscriber info 
         self._lock = threading.RLock()
         self._sub_info = {}
+        # Compiled key filters, indexed by pattern set
+        self._filters = {}
+        # Outbound queues, indexed by subscriber
+        self._queues = {}
+        # maximum number of unsent updates queued for a subscriber
+        self.queue_limit = 1000
+        # maximum number of updates sent to a subscriber in one call
+        self.batch_limit = 100
 
         # number of seconds to wait before unsubscribing a subscriber
         # who is unresponsive
@@ -167,8 +353,10 @@ class PubSubBase(object):
             # Need to create subscriber bunch for this channel.
             bunch = Bunch.Bunch(channel=channelName,
                                 subscribers=set([]),
+                                patterns={},
                                 computed_channels=set([channelName]),
-                                computed_subscribers=set([]))
+                                computed_subscribers=set([]),
+                                computed_filters={})
             self._sub_info[channelName] = bunch
             return bunch
 
@@ -187,12 +375,18 @@ class PubSubBase(object):
         channels = set(channels)
 
         can_unsubscribe = True
+        patterns = None
         if isinstance(options, dict):
             # Does subscriber allow us to unsubscribe them if they are
             # unreachable?  Default=True
             if options.has_key('unsub'):
                 can_unsubscribe = options['unsub']
 
+            # Does subscriber only want certain keys of dict values on
+            # these channels?  Default=all of them
+            if options.get('keys', None):
+                patterns = frozenset(options['keys'])
+
         self._lock.acquire()
         try:
             # Record proxy in _partner table
@@ -203,10 +397,20 @@ class PubSubBase(object):
             for channel in channels:
                 bunch = self._get_channelInfo(channel, create=True)
                 bunch.subscribers.add(subscriber)
+                if patterns:
+                    bunch.patterns[subscriber] = patterns
+                elif bunch.patterns.has_key(subscriber):
+                    del bunch.patterns[subscriber]
                 
             # Compute subscriber relationships
             self.compute_subscribers()
 
+            # The subscriber may have been restarted with a version that
+            # takes batched updates
+            queue = self._queues.get(subscriber, None)
+            if queue != None:
+                queue.batch_ok = True
+
         finally:
             self._lock.release()
 
@@ -228,6 +432,7 @@ class PubSubBase(object):
 
                 try:
                     bunch.subscribers.remove(subscriber)
+                    bunch.patterns.pop(subscriber, None)
 
                 except KeyError:
                     #raise PubSubError("No subscriber '%s' to channel '%s'" % (
@@ -254,6 +459,13 @@ class PubSubBase(object):
         except KeyError:
             pass
 
+        # Discard any unsent updates
+        self._lock.acquire()
+        try:
+            self._queues.pop(subscriber, None)
+        finally:
+            self._lock.release()
+
 
     def _named_update(self, value, names, channels):
         """
@@ -264,28 +476,26 @@ class PubSubBase(object):
         self.logger.debug("update: names=%s, channels=%s value=%s" % (
             str(names), str(channels), str(value)))
 
-        # Start a task to do the remote update to subscribers.  Task will
-        # call _subscriber_update(value, names, channels).  Meanwhile,
-        # we are free to return immediately so as not delay the caller
-        # any further.
-        #self._subscriber_update(value, names, channels)
-        t = Task.FuncTask2(self._subscriber_update, value, names, channels)
-        t.init_and_start(self)
+        # This only queues the update for each subscriber; the remote
+        # updates are done by sender tasks, so we return immediately so
+        # as not delay the caller any further.
+        self._subscriber_update(value, names, channels)
 
 
     def _subscriber_update(self, value, names, channels):
         """
         Internal method to update all subscribers who would be affected
-        by these channels.  Triggered by a _named_update() call, which creates
-        a task to call this method via the thread pool.  The update includes
-        any local objects or remote objects by proxy.
+        by these channels.  Called by _named_update().  The update is
+        queued for each subscriber, including any local objects or remote
+        objects by proxy, and delivered by _send_queue().
         """
         self.logger.debug("subscriber update: names=%s, channels=%s value=%s" % (
             str(names), str(channels), str(value)))
         #self.logger.debug("value=%s" % (str(value)))
 
         # Get a list of partners that we should update for this value
-        subscribers, all_channels = self._get_subscribers(channels)
+        subscribers, all_channels, filters = self._get_subscribers(
+            channels, filters=True)
         # sets don't go across remoteObjects (yet)
         all_channels = list(all_channels)
 
@@ -298,6 +508,12 @@ class PubSubBase(object):
         else:
             updnames = names[:]
             updnames.append(self.name)
+
+        # Filtered values, computed once for each distinct filter
+        filtered = {}
+
+        # Coalescing key for this update
+        key = self._coalesce_key(value, all_channels)
         
         # Update them.  Silently log errors.
         for subscriber in subscribers:
@@ -306,42 +522,172 @@ class PubSubBase(object):
                 continue
 
             try:
-                # self._individual_update(subscriber, value, updnames,
-                #                         all_channels)
-                # Start a new task to concurrently do the individual update
-                task = Task.FuncTask(self._individual_update,
-                                     (subscriber, value, updnames,
-                                         all_channels), {},
-                                     logger=self.logger)
-                task.init_and_start(self)
+                sub_value = value
+                keyfilter = filters.get(subscriber, None)
+                if keyfilter != None:
+                    try:
+                        sub_value = filtered[keyfilter]
+                    except KeyError:
+                        sub_value = self._filter_value(value, keyfilter)
+                        filtered[keyfilter] = sub_value
+
+                    # Nothing this subscriber is interested in
+                    if sub_value == None:
+                        continue
+
+                # Queue the update, and start a task to concurrently
+                # send it if there isn't one running for this subscriber
+                queue = self._get_queue(subscriber)
+                if queue.put(sub_value, updnames, all_channels, key,
+                             self._coalesce):
+                    task = Task.FuncTask(self._send_queue, (queue,), {},
+                                         logger=self.logger)
+                    task.init_and_start(self)
 
             except Exception, e:
                 self.logger.error("cannot update subscriber '%s': %s" % (
                     subscriber, str(e)))
 
 
-    def _individual_update(self, subscriber, value, names, channels):
-        self.logger.debug("attempting to update subscriber '%s' on channels(%s)  with value: %s" % (
-            subscriber, str(channels), str(value)))
+    def _filter_value(self, value, keyfilter):
+        """Returns the part of _value_ passed by _keyfilter_ (a KeyFilter),
+        or None if there is nothing to send.  Values that are not dicts
+        are passed unchanged.  Subclasses with structured values should
+        override this.
+        """
+        if not isinstance(value, dict):
+            return value
+
+        res = keyfilter.filter(value)
+        if len(res) == 0:
+            return None
+        return res
+
+
+    def _coalesce_key(self, value, channels):
+        """Returns a key identifying updates where a newer _value_ can
+        replace an older unsent one (see _coalesce()), or None if it can't.
+        Subclasses that know the structure of their values should override
+        this.
+        """
+        return None
+
+
+    def _coalesce(self, old_value, new_value):
+        """Returns the value to send in place of unsent _old_value_ and
+        _new_value_, which have the same coalescing key.
+        """
+        return new_value
+
+
+    def _get_queue(self, subscriber):
+        self._lock.acquire()
+        try:
+            try:
+                return self._queues[subscriber]
+
+            except KeyError:
+                queue = SubscriberQueue(subscriber, limit=self.queue_limit)
+                self._queues[subscriber] = queue
+                return queue
+
+        finally:
+            self._lock.release()
+
+
+    def _send_queue(self, queue):
+        """Send queued updates to a subscriber in batches until its queue
+        is empty.
+        """
+        while True:
+            items = queue.get_batch(self.batch_limit)
+            if len(items) == 0:
+                return
+
+            time_start = time.time()
+            if self._batch_update(queue, items):
+                queue.lock.acquire()
+                try:
+                    queue.stats.sent += len(items)
+                    queue.stats.batches += 1
+                    queue.stats.latency = time.time() - items[0].time_queued
+                finally:
+                    queue.lock.release()
+
+            self.logger.debug("sent %d updates to '%s' in %.4f sec" % (
+                len(items), queue.subscriber, time.time() - time_start))
+
+
+    def _batch_update(self, queue, items):
+        subscriber = queue.subscriber
+        self.logger.debug("attempting to update subscriber '%s' with %d updates" % (
+            subscriber, len(items)))
         
         try:
             bnch = self._partner[subscriber]
+        except KeyError:
+            # unsubscribed while updates were queued
+            return False
+
+        try:
             proxy_obj = bnch.proxy
 
-            proxy_obj.remote_update(value, names, channels)
+            sent = False
+            if (len(items) > 1) and queue.batch_ok:
+                sent = self._update_batch(queue, proxy_obj, items)
+
+            if not sent:
+                for item in items:
+                    proxy_obj.remote_update(item.value, item.names,
+                                            item.channels)
 
             bnch.time_failure = None
+            return True
 
         except Exception, e:
             # TODO: capture and log traceback
             self.logger.error("cannot update subscriber '%s': %s" % (
                 subscriber, str(e)))
+            # Check again for batch support once it is reachable
+            queue.batch_ok = True
             if not bnch.time_failure:
                 bnch.time_failure = time.time()
             else:
                 if (time.time() - bnch.time_failure) > self.failure_limit:
                     if bnch.can_unsubscribe:
                         self.remove_subscriber(subscriber)
+            return False
+
+
+    def _update_batch(self, queue, proxy_obj, items):
+        """Send _items_ to a subscriber in one remote_update_batch() call.
+        Returns False, having sent nothing, if the subscriber does not
+        have that method; any other error is raised, and the items are not
+        sent again since the subscriber may have received some of them.
+        """
+        updates = map(lambda item: (item.value, item.names,
+                                    item.channels), items)
+        try:
+            # local subscribers are plain objects, that may not have it
+            method = proxy_obj.remote_update_batch
+
+        except AttributeError, e:
+            method = None
+
+        if method != None:
+            try:
+                method(updates)
+                return True
+
+            except Exception, e:
+                if not _no_such_method(e, 'remote_update_batch'):
+                    raise
+
+        self.logger.warn("subscriber '%s' does not take batched updates: %s" % (
+            queue.subscriber, str(e)))
+        queue.batch_ok = False
+        return False
+
 
     ######## PUBLIC METHODS ########
     
@@ -456,6 +802,7 @@ class PubSubBase(object):
             for channel in self.get_channels():
                 bunch = self._get_channelInfo(channel)
                 bunch.computed_subscribers = bunch.subscribers.copy()
+                bunch.computed_filters = dict(bunch.patterns)
                 if self.name in bunch.computed_subscribers:
                     bunch.computed_subscribers.remove(self.name)
 
@@ -468,6 +815,7 @@ class PubSubBase(object):
                 # Get my subscribers
                 bunch = self._get_channelInfo(agg_channel)
                 my_subscribers = bunch.subscribers
+                my_patterns = bunch.patterns
                 #my_subscribers = bunch.computed_subscribers
                 #self.logger.debug("subscribers(%s) = %s" % (agg_channel,
                 #                                            list(my_subscribers)))
@@ -480,6 +828,9 @@ class PubSubBase(object):
                 for constituent in constituents:
                     # Add aggregate channel's subscribers to constituent's
                     bunch = self._get_channelInfo(constituent)
+                    for subscriber in my_subscribers:
+                        self._merge_patterns(bunch, subscriber,
+                                             my_patterns.get(subscriber, None))
                     bunch.computed_subscribers.update(my_subscribers)
                     # Add aggregate channel name to consituent's
                     bunch.computed_channels.add(agg_channel)
@@ -488,7 +839,18 @@ class PubSubBase(object):
                     if self.name in bunch.computed_subscribers:
                         bunch.computed_subscribers.remove(self.name)
 
-            # PASS 3 (DEBUG ONLY)
+            # PASS 3
+            # Compile the key filters.  Subscribers with the same set
+            # of patterns share a filter.
+            filters = {}
+            for channel in self.get_channels():
+                bunch = self._get_channelInfo(channel)
+                for subscriber, patterns in bunch.computed_filters.items():
+                    bunch.computed_filters[subscriber] = self._get_filter(
+                        patterns, filters)
+            self._filters = filters
+
+            # PASS 4 (DEBUG ONLY)
             #for channel in self.get_channels():
             #    bunch = self._get_channelInfo(channel)
             #    self.logger.debug("%s --> %s" % (channel,
@@ -497,10 +859,44 @@ class PubSubBase(object):
             self._lock.release()
 
         
-    def _get_subscribers(self, channels):
+    def _merge_patterns(self, bunch, subscriber, patterns):
+        """Merge _patterns_ (a set of patterns, or None for everything)
+        into the computed filter patterns of _subscriber_ on the channel
+        described by _bunch_.
+        """
+        computed = bunch.computed_filters
+        if subscriber in bunch.computed_subscribers:
+            # Already subscribed: keep the union of the two subscriptions
+            if not computed.has_key(subscriber):
+                return
+            if patterns == None:
+                del computed[subscriber]
+            else:
+                computed[subscriber] = computed[subscriber].union(patterns)
+
+        elif patterns != None:
+            computed[subscriber] = patterns
+
+
+    def _get_filter(self, patterns, filters):
+        # Reuse a filter already compiled for these patterns (so that we
+        # keep its cache) or compile a new one, and record it in _filters_
+        try:
+            keyfilter = self._filters[patterns]
+        except KeyError:
+            keyfilter = filters.get(patterns, None)
+            if keyfilter == None:
+                keyfilter = KeyFilter(patterns)
+        filters[patterns] = keyfilter
+        return keyfilter
+
+
+    def _get_subscribers(self, channels, filters=False):
         """Get the list of subscriber names that match subscriptions for
         a given channel or channels AND get the list of all channels that
-        this aggregates to.
+        this aggregates to.  If _filters_ is True, also get a dict mapping
+        subscribers to the KeyFilters for their subscriptions (subscribers
+        without filters are not included).
         """
         if isinstance(channels, basestring):
             channels = [channels]
@@ -514,9 +910,15 @@ class PubSubBase(object):
                 try:
                     bunch = self._sub_info[channel]
                 
+                    if filters:
+                        return (bunch.computed_subscribers,
+                                bunch.computed_channels,
+                                bunch.computed_filters)
                     return (bunch.computed_subscribers, bunch.computed_channels)
                 
                 except KeyError:
+                    if filters:
+                        return (set([]), set([]), {})
                     return (set([]), set([]))
             
             else:
@@ -524,12 +926,25 @@ class PubSubBase(object):
                 # computed subscribers
                 subscribers = set([])
                 all_channels = set([])
+                # A subscriber is filtered only if it is filtered on every
+                # channel; then it gets the union of its filters.
+                unfiltered = set([])
+                patterns = {}
 
                 for channel in channels:
                     try:
                         bunch = self._sub_info[channel]
                         subscribers.update(bunch.computed_subscribers)
                         all_channels.update(bunch.computed_channels)
+
+                        if filters:
+                            computed = bunch.computed_filters
+                            for subscriber in bunch.computed_subscribers:
+                                if not computed.has_key(subscriber):
+                                    unfiltered.add(subscriber)
+                                else:
+                                    patterns.setdefault(subscriber, set([])).update(
+                                        computed[subscriber].patterns)
                         
                     except KeyError:
                         continue
@@ -538,6 +953,14 @@ class PubSubBase(object):
                 # because it should have already been done in compute_subscribers)
                 if self.name in subscribers:
                     subscribers.remove(self.name)
+
+                if filters:
+                    filter_d = {}
+                    for subscriber, pset in patterns.items():
+                        if not subscriber in unfiltered:
+                            filter_d[subscriber] = self._get_filter(
+                                frozenset(pset), self._filters)
+                    return (subscribers, all_channels, filter_d)
                 
                 return (subscribers, all_channels)
 
@@ -545,6 +968,25 @@ class PubSubBase(object):
             self._lock.release()
 
 
+    def get_queue_stats(self):
+        """
+        Returns a dict of statistics about the outbound queue of each
+        subscriber: the current and maximum depth, the number of updates
+        queued, coalesced, dropped and sent, the number of batches sent and
+        the latency (queued to sent) of the last batch.
+        """
+        self._lock.acquire()
+        try:
+            queues = self._queues.values()
+        finally:
+            self._lock.release()
+
+        res = {}
+        for queue in queues:
+            res[queue.subscriber] = queue.get_stats()
+        return res
+
+
     def get_subscribers(self, channels):
         """
         remoteObjects callable version of _get_subscribers (currently sets are not
@@ -569,6 +1011,16 @@ class PubSubBase(object):
         return self._named_update(value, names, channels)
 
 
+    def remote_update_batch(self, updates):
+        """method called by another PubSub to update this one with
+        several updates, each a (value, names, channels) sequence.
+        """
+        for (value, names, channels) in updates:
+            self.remote_update(value, names, channels)
+
+        return ro.OK
+
+
     def notify(self, value, channels):
         """
         Method called by local users of this PubSub to update it
@@ -659,7 +1111,9 @@ class PubSub(PubSubBase):
         
     def subscribe(self, subscriber, channels, options):
         """Register a subscriber (named by _subscriber_) for updates on
-        channel(s) _channels_. 
+        channel(s) _channels_.  If _options_ contains 'keys', a list of
+        key names or wildcard patterns, then the subscriber is only sent
+        the matching items of dict values on these channels.
 
         This call is expected to be called via remoteObjects.
         """
@@ -824,9 +1278,10 @@ class PubSub(PubSubBase):
             self._lock.release()
                 
 
-    def subscribe_local(self, local_obj, channels):
+    def subscribe_local(self, local_obj, channels, keys=None):
         """Register a subscriber (represented by _local_obj_)
-        for updates on channel(s) _channels_.
+        for updates on channel(s) _channels_, optionally only for the
+        items matching _keys_ (see subscribe()).
 
         This call is expected to be a local call.
         """
@@ -841,7 +1296,7 @@ class PubSub(PubSubBase):
             raise PubSubError('object needs both remote_update and remote_delete methods')
 
         super(PubSub, self)._subscribe(subscriber, local_obj,
-                                        channels, {})
+                                        channels, { 'keys': keys })
         self.logger.debug("local registration of '%s' successful." % (
             subscriber))
 
@@ -862,9 +1317,10 @@ class PubSub(PubSubBase):
             subscriber))
 
 
-    def subscribe_cb(self, fn_update, channels):
+    def subscribe_cb(self, fn_update, channels, keys=None):
         """Register local subscriber callback (_fn_update_)
-        for updates on channel(s) _channels_.
+        for updates on channel(s) _channels_, optionally only for the
+        items matching _keys_ (see subscribe()).
 
         This call is expected to be a local call.
         """
@@ -887,7 +1343,7 @@ class PubSub(PubSubBase):
         local_obj = anonClass(fn_update)
 
         super(PubSub, self)._subscribe(subscriber, local_obj,
-                                        channels, {})
+                                        channels, { 'keys': keys })
         self.logger.debug("local registration of '%s' successful." % (
             subscriber))
 
@@ -915,7 +1371,8 @@ class PubSub(PubSubBase):
                      threaded_server=default_threaded_server,
                      authDict=None, default_auth=use_default_auth,
                      secure=default_secure, cert_file=default_cert,
-                     ns=None, 
+                     ns=None, numworkers=0, queue_limit=100,
+                     method_limits=None,
                      usethread=True, wait=True, timeout=None):
 
         if not svcname:
@@ -928,7 +1385,10 @@ class PubSub(PubSubBase):
                                             threadPool=self.threadPool,
                                             threaded_server=threaded_server,
                                             authDict=authDict, default_auth=default_auth,
-                                            secure=secure, cert_file=cert_file)
+                                            secure=secure, cert_file=cert_file,
+                                            numworkers=numworkers,
+                                            queue_limit=queue_limit,
+                                            method_limits=method_limits)
 
         self.logger.info("Starting remote subscriptions update loop...")
         t = Task.FuncTask(self.update_remote_subscriptions_loop, [], {})
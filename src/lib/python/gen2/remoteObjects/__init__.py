@@ -14,7 +14,7 @@ from remoteObjects import managerServicePort, nameServicePort, OK, ERROR, \
     remoteObjectServer, remoteObjectClient, remoteObjectProxy, remoteObjectSP, \
     remoteObjectSPAll, nullLogger, \
     servicePack, make_robunch, init, get_myhost, get_hosts, get_ro_hosts, \
-    getms, getns, binary_encode, binary_decode, compress, uncompress, \
+    getms, getns, Binary, binary_encode, binary_decode, compress, uncompress, \
     split_host, populate_host, unique_hosts, unique_host_ports, addlogopts
 
 __all__ = ['managerServicePort', 'nameServicePort', 'OK', 'ERROR',
@@ -22,8 +22,8 @@ __all__ = ['managerServicePort', 'nameServicePort', 'OK', 'ERROR',
            'remoteObjectServer', 'remoteObjectClient', 'remoteObjectProxy',
            'remoteObjectSP', 'remoteObjectSPAll', 'nullLogger',
            'servicePack', 'make_robunch', 'init',
-           'get_myhost', 'get_hosts', 'get_ro_hosts', 'getms', 'binary_encode',
-           'binary_decode', 'compress', 'uncompress',
+           'get_myhost', 'get_hosts', 'get_ro_hosts', 'getms', 'Binary',
+           'binary_encode', 'binary_decode', 'compress', 'uncompress',
            'split_host', 'populate_host',
            'unique_hosts', 'unique_host_ports', 'addlogopts',
            'PubSub', 'Monitor'
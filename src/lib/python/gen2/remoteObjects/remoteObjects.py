@@ -32,6 +32,7 @@ import socket
 import threading, Queue
 import xmlrpclib
 import ro_XMLRPC
+from ro_marshal import Binary
 # binascii encoding/decoding is much faster than xmlrpclib's
 # built-in Binary class
 import binascii
@@ -96,7 +97,8 @@ class remoteObjectServer(object):
                  threadPool=None,
                  authDict=None, default_auth=use_default_auth,
                  secure=default_secure, cert_file=default_cert,
-                 ns=None, method_list=None, method_prefix=None):
+                 ns=None, method_list=None, method_prefix=None,
+                 numworkers=0, queue_limit=100, method_limits=None):
 
         self.svcname = svcname
         self.name = name
@@ -170,6 +172,13 @@ class remoteObjectServer(object):
         self.pinginterval = ping_interval
         self.strict_registration = strict_registration
         self.threaded_server = threaded_server
+        # If numworkers > 0 requests are served by a fixed pool of that
+        # many workers instead, with up to queue_limit requests waiting.
+        # method_limits is a dict of limits on the number of concurrent
+        # calls to particular methods.
+        self.numworkers = numworkers
+        self.queue_limit = queue_limit
+        self.method_limits = method_limits
         if not ns:
             # if no specific name server supplied, use the module default
             ns = default_ns
@@ -191,7 +200,10 @@ class remoteObjectServer(object):
                                         authDict=self.authDict,
                                         cert_file=self.cert_file,
                                         threaded=self.threaded_server,
-                                        threadPool=self.threadPool)
+                                        threadPool=self.threadPool,
+                                        numworkers=self.numworkers,
+                                        queue_limit=self.queue_limit,
+                                        method_limits=self.method_limits)
                     return (server, port)
 
                 except socket.error:
@@ -210,7 +222,10 @@ class remoteObjectServer(object):
                                      authDict=self.authDict,
                                      cert_file=self.cert_file,
                                      threaded=self.threaded_server,
-                                     threadPool=self.threadPool)
+                                     threadPool=self.threadPool,
+                                     numworkers=self.numworkers,
+                                     queue_limit=self.queue_limit,
+                                     method_limits=self.method_limits)
 
         else:
             (self.server, self.port) = find_free_port()
@@ -274,12 +289,27 @@ class remoteObjectServer(object):
         return self.method_list
 
 
-    def ro_workerStatus(self):
-        res = []
-        if self.threadPool:
-            return self.threadPool.workerStatus()
-        else:
+    def ro_workerStatus(self, stats=False):
+        """Returns a list of (status, start time) for each worker thread.
+        If _stats_ is True, returns a dict with the worker list ('workers'),
+        request latency histograms by method ('latency') and, for a server
+        with a worker pool, the state of its request queue ('queue').
+        """
+        if self.numworkers > 0:
+            workers = self.server.workerStatus()
+        elif self.threadPool:
+            workers = self.threadPool.workerStatus()
+        elif not stats:
             raise remoteObjectError("Sorry, this RO server was not created with a threadPool.")
+        else:
+            workers = []
+
+        if not stats:
+            return workers
+
+        res = self.server.get_stats()
+        res['workers'] = workers
+        return res
 
 
     ## def ro_workerReset(self):
@@ -1038,11 +1068,17 @@ class nullLogger(object):
 
 # Use these to abstract transporting binary buffers.  binascii is much
 # faster than the one used by xmlrpclib or base64 modules.
+# Wrapping a buffer in Binary instead avoids the encoding altogether when
+# the call goes over a binary connection, where it is received as an
+# xmlrpclib.Binary; over XML-RPC it is sent as binary_encode() would.
+# binary_decode() accepts both.
 
 def binary_encode(buffer):
     return binascii.b2a_base64(buffer)
 
 def binary_decode(data):
+    if isinstance(data, (Binary, xmlrpclib.Binary)):
+        return data.data
     return binascii.a2b_base64(data)
 
 def compress(data):
@@ -8,12 +8,14 @@
 """
 """
 import sys, os, time
-import threading
+import threading, Queue
+import bisect, re
 import base64, urllib
 import httplib
 import string
 import types
 import socket, SocketServer, select
+import errno
 import xmlrpclib
 import SimpleXMLRPCServer
 import traceback
@@ -28,12 +30,40 @@ except ImportError:
     SSL = None
 
 import Task
+from Bunch import Bunch
+import ro_marshal
 
 version = '20101208.0'
 
 # Timeout value for XML-RPC sockets
 socket_timeout = 0.25
 
+# Should clients keep connections open between calls (HTTP/1.1 keep-alive)?
+# A connection is only reused with servers that say how long they keep it
+# open (see ConnectionPool): servers with a worker pool (numworkers > 0)
+use_keepalive = True
+# Should clients send calls in the compact binary encoding (ro_marshal)
+# to servers that accept it?
+use_binary = True
+# Maximum number of concurrent calls through one client proxy
+max_connections = 16
+# Maximum number of idle connections kept open to one server
+max_idle = 8
+# Maximum seconds after which a client closes an idle connection
+idle_timeout = 4.0
+# Seconds after which a server with a worker pool closes an idle
+# connection; it tells clients in a Keep-Alive header
+keepalive_timeout = 5.0
+# Clients close an idle connection this many seconds before the server
+# would
+keepalive_margin = 1.0
+# Seconds a server with a worker pool waits for room in its request queue
+# before rejecting a request
+queue_timeout = 1.0
+
+# Header by which clients and servers agree to use the binary encoding
+binary_header = 'X-RO-Binary'
+
 
 class Error(Exception):
     """Class of errors raised in this module."""
@@ -48,24 +78,36 @@ class socketTimeout(Error):
 # ------------------ CONVENIENCE FUNCTIONS ------------------
 #
 
-def make_serviceProxy(host, port, auth=False, secure=False, timeout=None):
+def make_serviceProxy(host, port, auth=False, secure=False, timeout=None,
+                      keepalive=None, binary=None):
     """
     Convenience function to make a XML-RPC service proxy.
     'auth' is None for no authentication, otherwise (user, passwd)
     'secure' should be True if you want to use SSL, otherwise vanilla http.
+    'keepalive' should be True to reuse connections between calls, False to
+    open a new one for each call, or None for the module default.
+    'binary' should be True to use the binary encoding with servers that
+    accept it, False to always use XML, or None for the module default
+    (not used with SSL).
     """
+    if keepalive == None:
+        keepalive = use_keepalive
+    if binary == None:
+        binary = use_binary
     try:
         if secure:
             transport = SecureAuthTransport(auth, use_datetime=0,
-                                            timeout=timeout)
+                                            timeout=timeout,
+                                            keepalive=keepalive)
             url = 'https://%s:%d/' % (host, port)
             proxy = SSLServerProxy(url, transport=transport, allow_none=True)
         else:
             transport = BasicAuthTransport(auth, use_datetime=0,
-                                           timeout=timeout)
+                                           timeout=timeout,
+                                           keepalive=keepalive,
+                                           binary=binary)
             url = 'http://%s:%d/' % (host, port)
-            proxy = xmlrpclib.ServerProxy(url, transport=transport,
-                                          allow_none=True)
+            proxy = ROServerProxy(url, transport=transport, allow_none=True)
 
         return proxy
     
@@ -85,6 +127,130 @@ def make_serviceProxy(host, port, auth=False, secure=False, timeout=None):
 ssl_padding = '0'*2048
 
 
+class ConnectionPool(object):
+    """
+    Pool of idle HTTP connections, shared by the client transports so that
+    calls to the same server can reuse a connection instead of setting up
+    a new one.  A connection is closed once it has been idle for the time
+    the server said it keeps it open (less keepalive_margin), or for
+    _idle_timeout_ seconds, whichever is shorter.
+    """
+
+    def __init__(self, max_idle=max_idle, idle_timeout=idle_timeout):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+
+        self.lock = threading.Lock()
+        # key -> list of (time_expire, connection), most recent last
+        self.idle = {}
+        self.time_sweep = time.time()
+
+    def get(self, key):
+        """Returns an idle connection for _key_, or None if there is none.
+        """
+        expired = []
+        self.lock.acquire()
+        try:
+            conns = self.idle.get(key, [])
+            cur_time = time.time()
+            res = None
+            while len(conns) > 0:
+                (time_expire, conn) = conns.pop()
+                if time_expire > cur_time:
+                    res = conn
+                    break
+                expired.append(conn)
+        finally:
+            self.lock.release()
+
+        self._close(expired)
+        return res
+
+    def put(self, key, conn, timeout):
+        """Return _conn_, which is idle, to the pool.  _timeout_ is the
+        time (sec) the server keeps it open while idle.
+        """
+        timeout = min(timeout - keepalive_margin, self.idle_timeout)
+        if timeout <= 0:
+            conn.close()
+            return
+
+        expired = []
+        self.lock.acquire()
+        try:
+            cur_time = time.time()
+            conns = self.idle.setdefault(key, [])
+            conns.append((cur_time + timeout, conn))
+            while len(conns) > self.max_idle:
+                expired.append(conns.pop(0)[1])
+
+            # Periodically close expired connections to all servers
+            if cur_time - self.time_sweep > self.idle_timeout:
+                self.time_sweep = cur_time
+                expired.extend(self._sweep(cur_time))
+        finally:
+            self.lock.release()
+
+        self._close(expired)
+
+    def clear(self):
+        """Close all idle connections.
+        """
+        self.lock.acquire()
+        try:
+            expired = self._sweep(None)
+        finally:
+            self.lock.release()
+
+        self._close(expired)
+
+    def _sweep(self, cur_time):
+        # Should only get called from within a lock!  Removes and returns
+        # the connections expired at _cur_time_ (all of them if None).
+        expired = []
+        for key in self.idle.keys():
+            conns = self.idle[key]
+            keep = []
+            for (time_expire, conn) in conns:
+                if (cur_time != None) and (time_expire > cur_time):
+                    keep.append((time_expire, conn))
+                else:
+                    expired.append(conn)
+            if len(keep) > 0:
+                self.idle[key] = keep
+            else:
+                del self.idle[key]
+        return expired
+
+    def _close(self, conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+# Connections shared by all client proxies
+connectionPool = ConnectionPool()
+
+
+def get_keepalive_timeout(response):
+    """Returns the time (sec) for which the server that sent _response_
+    keeps the connection open while idle, from its Keep-Alive header, or
+    None if it does not say.
+    """
+    header = response.getheader('keep-alive')
+    if not header:
+        return None
+    for param in header.split(','):
+        try:
+            (name, value) = param.split('=', 1)
+            if name.strip().lower() == 'timeout':
+                return float(value)
+        except ValueError:
+            pass
+    return None
+
+
 class BaseAuthTransport(object):
     """
     Handles an HTTP transaction to an XML-RPC server.  We augment the
@@ -102,7 +268,8 @@ class BaseAuthTransport(object):
     # client identifier (may be overridden)
     user_agent = "remoteObjects/%s" % version
 
-    def __init__(self, auth, timeout=None):
+    def __init__(self, auth, timeout=None, keepalive=False,
+                 pool=None, binary=False):
         if not auth:
             self.extra_headers = None
         else:
@@ -116,6 +283,165 @@ class BaseAuthTransport(object):
 
         self.timeout = timeout
 
+        # For keep-alive connections
+        self.keepalive = keepalive
+        if pool == None:
+            pool = connectionPool
+        self.pool = pool
+        # limits the number of concurrent calls (and so connections)
+        self.sem = threading.BoundedSemaphore(max_connections)
+
+        # For the binary encoding: maps host -> True if the server there
+        # has told us it accepts binary calls
+        self.binary = binary
+        self.binary_hosts = {}
+
+    def call(self, host, handler, methodName, params, verbose=0,
+             encoding=None, allow_none=0):
+        """Calls (methodName) with (params) on the server at (host), in
+        the binary encoding if the server accepts it, otherwise in XML-RPC.
+        Returns the result as a singleton tuple, as request() does.
+        """
+        if self.binary and self.binary_hosts.get(host, False):
+            try:
+                request_body = ro_marshal.dumps_request(methodName, params)
+
+            except TypeError:
+                # something the binary encoding does not handle;
+                # let the XML-RPC marshaller decide
+                request_body = None
+
+            if request_body != None:
+                try:
+                    return self.request(host, handler, request_body,
+                                        verbose=verbose)
+
+                except xmlrpclib.ProtocolError, e:
+                    # e.g. the server was replaced by an older one
+                    # that does not understand the request
+                    if e.errcode != 500:
+                        raise
+                    self.binary_hosts[host] = False
+
+        request_body = xmlrpclib.dumps(params, methodName,
+                                       encoding=encoding,
+                                       allow_none=allow_none)
+        return self.request(host, handler, request_body, verbose=verbose)
+
+    # We override request() in order to reuse connections from the pool,
+    # which unlike xmlrpclib.Transport's single cached connection is safe
+    # for concurrent calls through the same proxy
+    def request(self, host, handler, request_body, verbose=0):
+        if not self.keepalive:
+            if not self.binary:
+                return xmlrpclib.Transport.request(self, host, handler,
+                                                   request_body,
+                                                   verbose=verbose)
+            # we need to see the response headers
+            conn = self.make_connection(host)
+            return self.keepalive_request(None, conn, host, handler,
+                                          request_body, verbose)
+
+        key = (self.__class__, host, self.timeout)
+        self.sem.acquire()
+        try:
+            conn = self.pool.get(key)
+            if conn != None:
+                try:
+                    return self.keepalive_request(key, conn, host, handler,
+                                                  request_body, verbose)
+
+                except socket.timeout:
+                    raise
+
+                except socket.error, e:
+                    if not e.errno in (errno.ECONNRESET, errno.ECONNABORTED,
+                                       errno.EPIPE):
+                        raise
+
+                except (httplib.BadStatusLine, httplib.CannotSendRequest):
+                    pass
+
+            # no pooled connection, or it had gone cold (e.g. closed by
+            # the server): retry once, with a new connection
+            conn = self.make_connection(host)
+            return self.keepalive_request(key, conn, host, handler,
+                                          request_body, verbose)
+        finally:
+            self.sem.release()
+
+    def keepalive_request(self, key, conn, host, handler, request_body,
+                          verbose):
+        if verbose:
+            conn.set_debuglevel(1)
+
+        keep = False
+        timeout = None
+        try:
+            self.send_request(conn, handler, request_body)
+            self.send_host(conn, host)
+            self.send_user_agent(conn)
+            self.send_content(conn, request_body)
+
+            response = conn.getresponse(buffering=True)
+            # Only keep connections the server says it keeps open
+            timeout = get_keepalive_timeout(response)
+            if self.binary:
+                self.binary_hosts[host] = (response.getheader(binary_header)
+                                           == ro_marshal.version)
+            if response.status != 200:
+                if response.getheader("content-length", 0):
+                    response.read()
+                keep = not response.will_close
+                raise xmlrpclib.ProtocolError(host + handler,
+                                              response.status,
+                                              response.reason,
+                                              response.msg)
+
+            self.verbose = verbose
+            try:
+                if response.getheader("content-type") == \
+                       ro_marshal.content_type:
+                    res = (ro_marshal.loads_response(response.read()),)
+                else:
+                    res = self.parse_response(response)
+
+            except xmlrpclib.Fault:
+                # response was read completely
+                keep = not response.will_close
+                raise
+
+            keep = not response.will_close
+            return res
+
+        finally:
+            if keep and (key != None) and (timeout != None):
+                self.pool.put(key, conn, timeout)
+            else:
+                conn.close()
+
+    # We override send_content() in order to send binary request bodies,
+    # which are lists of chunks (see ro_marshal)
+    def send_content(self, connection, request_body):
+        if self.binary:
+            connection.putheader(binary_header, ro_marshal.version)
+
+        if not isinstance(request_body, list):
+            return xmlrpclib.Transport.send_content(self, connection,
+                                                    request_body)
+
+        connection.putheader("Content-Type", ro_marshal.content_type)
+        connection.putheader("Content-Length",
+                             str(sum(map(len, request_body))))
+        # The body goes out in several sends, so don't let Nagle's
+        # algorithm hold them back
+        if connection.sock == None:
+            connection.connect()
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.endheaders(request_body[0])
+        for chunk in request_body[1:]:
+            connection.send(chunk)
+
     # We override make_connection() in order to set a timeout on the
     # socket connection if possible
     def make_connection(self, host):
@@ -129,13 +455,21 @@ class BaseAuthTransport(object):
         #store the host argument along with the connection object
         self._connection = host, httplib.HTTPConnection(chost,
                                                         timeout=self.timeout)
+        if self.keepalive:
+            # the httplib bundled with remoteObjects (httplib.py here) is
+            # set to speak HTTP/1.0, which closes the connection after each
+            # request
+            self._connection[1]._http_vsn = 11
+            self._connection[1]._http_vsn_str = 'HTTP/1.1'
         return self._connection[1]
 
        
 class BasicAuthTransport(BaseAuthTransport, xmlrpclib.Transport):
 
-    def __init__(self, auth, use_datetime=0, timeout=None):
-        BaseAuthTransport.__init__(self, auth, timeout=timeout)
+    def __init__(self, auth, use_datetime=0, timeout=None, keepalive=False,
+                 binary=False):
+        BaseAuthTransport.__init__(self, auth, timeout=timeout,
+                                   keepalive=keepalive, binary=binary)
         xmlrpclib.Transport.__init__(self, use_datetime=use_datetime)
         self._use_datetime = use_datetime
 
@@ -146,8 +480,9 @@ class BasicAuthTransport(BaseAuthTransport, xmlrpclib.Transport):
 
 class SecureAuthTransport(BaseAuthTransport, xmlrpclib.SafeTransport):
 
-    def __init__(self, auth, use_datetime=0, timeout=None):
-        BaseAuthTransport.__init__(self, auth, timeout=timeout)
+    def __init__(self, auth, use_datetime=0, timeout=None, keepalive=False):
+        BaseAuthTransport.__init__(self, auth, timeout=timeout,
+                                   keepalive=keepalive)
 
         if self.extra_headers == None:
             self.extra_headers = []
@@ -162,6 +497,63 @@ class SecureAuthTransport(BaseAuthTransport, xmlrpclib.SafeTransport):
         return (host, self.extra_headers, x509)
 
 
+class ROServerProxy:
+    """
+    Copy of xmlrpclib.ServerProxy that lets its transport (a
+    BaseAuthTransport) choose how to encode each call.
+    """
+    def __init__(self, uri, transport=None, encoding=None, verbose=0,
+                 allow_none=0, use_datetime=0):
+        # establish a "logical" server connection
+
+        # get the url
+        type, uri = urllib.splittype(uri)
+        if type != "http":
+            raise IOError, "unsupported XML-RPC protocol"
+        self.__host, self.__handler = urllib.splithost(uri)
+        if not self.__handler:
+            self.__handler = "/RPC2"
+
+        if transport is None:
+            transport = BasicAuthTransport(None, use_datetime=use_datetime)
+        self.__transport = transport
+
+        self.__encoding = encoding
+        self.__verbose = verbose
+        self.__allow_none = allow_none
+
+
+    def __request(self, methodname, params):
+
+        # call a method on the remote server
+        response = self.__transport.call(
+            self.__host,
+            self.__handler,
+            methodname,
+            params,
+            verbose=self.__verbose,
+            encoding=self.__encoding,
+            allow_none=self.__allow_none
+            )
+
+        if len(response) == 1:
+            response = response[0]
+
+        return response
+        
+    def __repr__(self):
+        return (
+            "<ServerProxy for %s%s>" %
+            (self.__host, self.__handler)
+            )
+
+    __str__ = __repr__
+
+    def __getattr__(self, name):
+        # magic method dispatcher
+        return xmlrpclib._Method(self.__request, name)
+
+
 class SSLServerProxy:
     """
     Copy of xmlrpclib.ServerProxy used for SSL connections.  Provides a hack for a
@@ -236,6 +628,176 @@ class XMLRPCRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
     #def __init__(self, *args, **kwdargs):
     #    SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.__init__(*args, **kwdargs)
 
+    def setup(self):
+        # Speaking HTTP/1.1 lets clients keep the connection open between
+        # calls.  This is only done by servers with a worker pool, which
+        # watch idle connections in the server loop so that they do not
+        # hold a worker (see ProcessingMixIn.park_request()).
+        if getattr(self.server, 'keepalive', False):
+            self.protocol_version = 'HTTP/1.1'
+            self.timeout = keepalive_timeout
+            # Buffer the response so that it goes out in one send when we
+            # flush; otherwise the small header writes interact badly with
+            # Nagle's algorithm and delayed ACKs on a connection that stays
+            # open
+            self.wbufsize = -1
+
+        SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.setup(self)
+
+    def handle(self):
+        # With a worker pool we handle one request at a time; a kept-alive
+        # connection is handed back to the server to wait for the next one
+        # (see finish()), so it does not tie up a worker while idle
+        if getattr(self.server, 'requestQueue', None) != None:
+            self.close_connection = 1
+            self.handle_one_request()
+        else:
+            SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.handle(self)
+
+    def finish(self):
+        SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.finish(self)
+
+        self.parked = False
+        if (getattr(self.server, 'requestQueue', None) != None) and \
+               (not self.close_connection):
+            self.server.park_request(self.request, self.client_address)
+            self.parked = True
+
+    def log_message(self, format, *args):
+        # e.g. idle keep-alive connections timing out
+        self.server.logger.debug("%s: %s" % (self.client_address[0],
+                                             format % args))
+
+    # XML responses longer than this are gzipped for clients that accept
+    # it, as in the Python 2.7 SimpleXMLRPCServer
+    encode_threshold = 1400 #a common MTU
+
+    # a re to match a gzip Accept-Encoding
+    aepattern = re.compile(r"""
+                            \s* ([^\s;]+) \s*            #content-coding
+                            (;\s* q \s*=\s* ([0-9\.]+))? #q
+                            """, re.VERBOSE | re.IGNORECASE)
+
+    def accept_encodings(self):
+        r = {}
+        ae = self.headers.get("Accept-Encoding", "")
+        for e in ae.split(","):
+            match = self.aepattern.match(e)
+            if match:
+                v = match.group(3)
+                if v:
+                    v = float(v)
+                else:
+                    v = 1.0
+                r[match.group(1)] = v
+        return r
+
+    def decode_request_content(self, data):
+        #support gzip encoding of request
+        encoding = self.headers.get("content-encoding", "identity").lower()
+        if encoding == "identity":
+            return data
+        if encoding == "gzip":
+            try:
+                return xmlrpclib.gzip_decode(data)
+            except NotImplementedError:
+                self.send_response(501, "encoding %r not supported" % encoding)
+            except ValueError:
+                self.send_response(400, "error decoding gzip content")
+        else:
+            self.send_response(501, "encoding %r not supported" % encoding)
+        self.close_connection = 1
+        self.send_header("Content-length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        """
+        Called to handle a POST request on the HTTP protocol (all XML-RPC
+        is supposed to be done via POST).  Same as the Python 2.7
+        superclass method, but also takes calls in the binary encoding
+        and only shuts down the connection if it is not being kept alive.
+        """
+        # Check that the path is legal
+        if not self.is_rpc_path_valid():
+            # (report_404() shuts down the connection)
+            self.close_connection = 1
+            self.report_404()
+            return
+
+        try:
+            # Get arguments by reading body of request.
+            # We read this in chunks to avoid straining
+            # socket.read(); around the 10 or 15Mb mark, some platforms
+            # begin to have problems (bug #792570).
+            max_chunk_size = 10*1024*1024
+            size_remaining = int(self.headers["content-length"])
+            L = []
+            while size_remaining:
+                chunk_size = min(size_remaining, max_chunk_size)
+                chunk = self.rfile.read(chunk_size)
+                if not chunk:
+                    break
+                L.append(chunk)
+                size_remaining -= len(L[-1])
+            data = ''.join(L)
+
+            data = self.decode_request_content(data)
+            if data is None:
+                return #response has been sent
+
+            if self.headers.get("content-type") == ro_marshal.content_type:
+                (ctype, response) = self.server._binary_dispatch(
+                    data, getattr(self, '_dispatch', None)
+                    )
+            else:
+                ctype = "text/xml"
+                response = [self.server._marshaled_dispatch(
+                    data, getattr(self, '_dispatch', None)
+                    )]
+        except Exception, e:
+            # internal error, report as HTTP server error
+            self.server.logger.error("Internal exception raised: %s" % str(e))
+            self.close_connection = 1
+            self.send_response(500)
+
+            # Send information about the exception if requested
+            if getattr(self.server, '_send_traceback_header', False):
+                self.send_header("X-exception", str(e))
+                self.send_header("X-traceback", traceback.format_exc())
+
+            self.send_header("Content-length", "0")
+            self.end_headers()
+        else:
+            # got a valid XML RPC response
+            self.send_response(200)
+            self.send_header("Content-type", ctype)
+            if (ctype == "text/xml") and (self.encode_threshold != None) \
+                   and (len(response[0]) > self.encode_threshold) and \
+                   self.accept_encodings().get("gzip", 0):
+                try:
+                    response = [xmlrpclib.gzip_encode(response[0])]
+                    self.send_header("Content-Encoding", "gzip")
+                except NotImplementedError:
+                    pass
+            self.send_header("Content-length",
+                             str(sum(map(len, response))))
+            # tell a client that asks that we accept binary calls
+            if self.headers.has_key(binary_header):
+                self.send_header(binary_header, ro_marshal.version)
+            # and how long we keep the connection open for the next one
+            if not self.close_connection:
+                self.send_header("Keep-Alive", "timeout=%d" % (
+                    int(keepalive_timeout)))
+            self.end_headers()
+            for chunk in response:
+                self.wfile.write(chunk)
+            self.wfile.flush()
+
+        # shut down the connection, unless the client may reuse it
+        if self.close_connection:
+            self.wfile.flush()
+            self.connection.shutdown(1)
+
     def get_authorization_creds(self):
         auth = self.headers.get("authorization", None)
         logger = self.server.logger
@@ -350,6 +912,35 @@ class XMLRPCRequestHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
 ##             self.wfile.flush()
 ##             self.connection.shutdown(1)
 
+
+class LatencyHistogram(object):
+    """
+    Histogram of request latencies in roughly logarithmic buckets.
+    """
+    # Upper bounds of the buckets (sec); the last bucket holds the rest
+    bounds = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+              1.0, 2.0, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.counts[bisect.bisect_left(self.bounds, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def get(self):
+        if self.count > 0:
+            avg = self.total / self.count
+        else:
+            avg = 0.0
+        return { 'count': self.count, 'avg': avg, 'max': self.max,
+                 'bounds': list(self.bounds), 'counts': list(self.counts) }
+
     
 #class BaseXMLRPCServer(SocketServer.TCPServer, SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
 class BaseXMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
@@ -366,11 +957,21 @@ class BaseXMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
                  logger=None,
                  requestHandler=XMLRPCRequestHandler,
                  logRequests=False, allow_none=True, encoding=None,
-                 authDict=None):
+                 authDict=None, method_limits=None):
         
         self.logRequests = logRequests
         self.authDict = authDict
 
+        # Per-method limits on the number of concurrent calls
+        self.method_sems = {}
+        if method_limits:
+            for (methodName, limit) in method_limits.items():
+                self.method_sems[methodName] = threading.BoundedSemaphore(limit)
+
+        # Latency histograms, by method
+        self.stats_lock = threading.Lock()
+        self.latency = {}
+
         # Poorly documented hack to allow port to be released immediately after
         # application terminates...see SocketServer.py
         self.allow_reuse_address = True
@@ -401,12 +1002,14 @@ class BaseXMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
 
 
     # Hacked version of the Python 2.3 _marshaled_dispatch function to allow
-    # None as a type (it's not in the XML-RPC standard)
+    # None as a type (it's not in the XML-RPC standard).  Also used on later
+    # versions since, unlike the stock one, it returns the traceback of an
+    # exception (as _binary_dispatch() does).
     def _hacked_marshaled_dispatch(self, data, dispatch_method = None):
-        params, method = xmlrpclib.loads(data)
-
-        # generate response
         try:
+            params, method = xmlrpclib.loads(data)
+
+            # generate response
             if dispatch_method is not None:
                 response = dispatch_method(method, params)
             else:
@@ -417,7 +1020,7 @@ class BaseXMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
             response = xmlrpclib.dumps(response, methodresponse=1,
                                        allow_none=self.allow_none,
                                        encoding=self.encoding)
-        except Fault, fault:
+        except xmlrpclib.Fault, fault:
             # TODO: log Faults ?
             response = xmlrpclib.dumps(fault, allow_none=self.allow_none,
                                        encoding=self.encoding)
@@ -440,6 +1043,43 @@ class BaseXMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
         return response
 
 
+    def _binary_dispatch(self, data, dispatch_method=None):
+        """Dispatches a call in the binary encoding (see ro_marshal).
+        Returns a tuple of the content type and list of chunks of the
+        response, which is in XML-RPC if the result cannot be encoded.
+        """
+        (method, params) = ro_marshal.loads_request(data)
+
+        try:
+            if dispatch_method is not None:
+                response = dispatch_method(method, params)
+            else:
+                response = self._dispatch(method, params)
+
+        except xmlrpclib.Fault, fault:
+            return (ro_marshal.content_type, ro_marshal.dumps_fault(fault))
+
+        except:
+            # report exception back to client, with the traceback
+            (type, value, tb) = sys.exc_info()
+            try:
+                tb_str = ("Traceback:\n%s" % '\n'.join(traceback.format_tb(tb)))
+                fault = xmlrpclib.Fault(1, "%s:%s--%s" % (type, value, tb_str))
+            except:
+                fault = xmlrpclib.Fault(1, "%s:%s" % (type, value))
+            return (ro_marshal.content_type, ro_marshal.dumps_fault(fault))
+
+        try:
+            return (ro_marshal.content_type,
+                    ro_marshal.dumps_response(response))
+
+        except TypeError:
+            response = xmlrpclib.dumps((response,), methodresponse=1,
+                                       allow_none=self.allow_none,
+                                       encoding=self.encoding)
+            return ("text/xml", [response])
+
+
     def verify_request(self, request, client_address):
         """Verify the request.  May be overridden.
 
@@ -538,8 +1178,54 @@ class BaseXMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
             raise Error('method "%s" is not supported' % methodName)
 
 
+    def record_latency(self, name, elapsed):
+        self.stats_lock.acquire()
+        try:
+            try:
+                hist = self.latency[name]
+            except KeyError:
+                hist = LatencyHistogram()
+                self.latency[name] = hist
+            hist.add(elapsed)
+        finally:
+            self.stats_lock.release()
+
+
+    def get_stats(self):
+        """Returns a dict of the latency histograms, by method.
+        """
+        self.stats_lock.acquire()
+        try:
+            res = {}
+            for (name, hist) in self.latency.items():
+                res[name] = hist.get()
+            return { 'latency': res }
+        finally:
+            self.stats_lock.release()
+
+
     def do_dispatch(self, methodName, params, auth, client_addr):
 
+        time_start = time.time()
+        # Wait our turn if this method has a concurrency limit
+        sem = self.method_sems.get(methodName, None)
+        if sem:
+            sem.acquire()
+        try:
+            return self._do_dispatch(methodName, params, auth, client_addr)
+
+        finally:
+            if sem:
+                sem.release()
+
+            # Don't let clients grow the table with bogus method names
+            if not self.funcs.has_key(methodName):
+                methodName = '(other)'
+            self.record_latency(methodName, time.time() - time_start)
+
+
+    def _do_dispatch(self, methodName, params, auth, client_addr):
+
         # TODO: combine with my_dispatch ?
         try:
             if self.authDict:
@@ -566,11 +1252,7 @@ class BaseXMLRPCServer(SimpleXMLRPCServer.SimpleXMLRPCDispatcher):
             raise e
 
 
-    # If we are running on Python < 2.5 then add this method to the otherwise
-    # class use the stock version
-    if sys.hexversion < 0x02040000:
-        _marshaled_dispatch = _hacked_marshaled_dispatch
-    #_marshaled_dispatch = _hacked_marshaled_dispatch
+    _marshaled_dispatch = _hacked_marshaled_dispatch
 
     # We override this method so we don't have to block indefinitely on the
     # socket.accept() method.  See SocketServer.py
@@ -817,10 +1499,16 @@ class SSLSocketServer(SocketServer.BaseServer):
 # ------------------ THREADING EXTENSIONS ------------------
 #
 class ProcessingMixIn(object):
-    """Mix-in class to handle each request in a new thread."""
+    """Mix-in class to handle each request in a new thread.
+
+    If _numworkers_ > 0, requests are instead handled by a fixed pool of
+    worker threads fed through a queue of at most _queue_limit_ requests.
+    The server loop then also watches kept-alive connections between
+    requests (see park_request()).
+    """
 
     def __init__(self, fn=None, threaded=False, daemon=False,
-                 threadPool=None):
+                 threadPool=None, numworkers=0, queue_limit=100):
         if fn:
             self.fn = fn
         else:
@@ -829,6 +1517,157 @@ class ProcessingMixIn(object):
         self.useThread = threaded
         self.daemon_threads = daemon
         self.threadPool = threadPool
+
+        self.requestQueue = None
+        self.workers = []
+        if numworkers > 0:
+            self.requestQueue = Queue.Queue(queue_limit)
+            self.queue_limit = queue_limit
+            self.rejected = 0
+
+            # Kept-alive connections waiting for their next request,
+            # and ones that have a request ready
+            self.parked = {}
+            self.ready = []
+            self.park_lock = threading.Lock()
+            # Lets workers wake up the server loop to watch a connection
+            (self.wake_r, self.wake_w) = os.pipe()
+
+            for i in xrange(numworkers):
+                worker = Bunch(status='idle', time_start=0.0)
+                self.workers.append(worker)
+                t = threading.Thread(target=self.worker_loop, args=[worker])
+                t.setDaemon(1)
+                t.start()
+
+    def worker_loop(self, worker):
+        while True:
+            item = self.requestQueue.get()
+            # None is our signal to quit (see server_close())
+            if item == None:
+                return
+
+            (request, client_address, time_queued) = item
+            worker.time_start = time.time()
+            self.record_latency('(queue)', worker.time_start - time_queued)
+            worker.status = 'executing request from %s:%d' % client_address
+            try:
+                self.do_process_request(request, client_address)
+
+            except Exception, e:
+                # already logged in do_process_request()
+                pass
+
+            worker.status = 'idle'
+            worker.time_start = 0.0
+
+    def workerStatus(self):
+        return map(lambda w: (w.status, w.time_start), self.workers)
+
+    def get_stats(self):
+        res = super(ProcessingMixIn, self).get_stats()
+        if self.requestQueue != None:
+            self.park_lock.acquire()
+            try:
+                numparked = len(self.parked)
+            finally:
+                self.park_lock.release()
+            res['queue'] = { 'depth': self.requestQueue.qsize(),
+                             'limit': self.queue_limit,
+                             'rejected': self.rejected,
+                             'parked': numparked }
+            res['workers'] = self.workerStatus()
+        return res
+
+    def park_request(self, request, client_address):
+        """Called by a request handler to hand back a kept-alive
+        connection, which we watch until its next request arrives.
+        """
+        self.park_lock.acquire()
+        try:
+            self.parked[request] = (client_address, time.time())
+        finally:
+            self.park_lock.release()
+        os.write(self.wake_w, 'x')
+
+    def get_request(self):
+        if self.requestQueue == None:
+            return super(ProcessingMixIn, self).get_request()
+
+        while not self.ev_quit.isSet():
+            if len(self.ready) > 0:
+                return self.ready.pop(0)
+
+            self.park_lock.acquire()
+            try:
+                inputs = [ self.socket, self.wake_r ] + self.parked.keys()
+            finally:
+                self.park_lock.release()
+
+            try:
+                (sin, sout, sexp) = select.select(inputs, [], [], self.timeout)
+
+            except select.error, e:
+                self.logger.error("select.error: %s" % str(e))
+                (code, msg) = e
+                # code==4 is interrupted system call.  This typically happens
+                # when the process receives a signal.
+                if code == 4:
+                    raise socketTimeout('select() timed out, system call interrupted')
+                raise e
+
+            cur_time = time.time()
+            self.park_lock.acquire()
+            try:
+                for i in sin:
+                    if i == self.wake_r:
+                        os.read(self.wake_r, 1024)
+
+                    elif i == self.socket:
+                        conn = self.socket.accept()
+                        # wierd hack dues to Solaris 10 handling of sockets
+                        conn[0].setblocking(1)
+                        self.ready.append(conn)
+
+                    elif self.parked.has_key(i):
+                        # next request (or close) on a kept-alive connection
+                        (client_address, time_parked) = self.parked[i]
+                        del self.parked[i]
+                        self.ready.append((i, client_address))
+
+                # Close connections that have been idle too long
+                for (request, tup) in self.parked.items():
+                    if cur_time - tup[1] > keepalive_timeout:
+                        del self.parked[request]
+                        self.close_request(request)
+            finally:
+                self.park_lock.release()
+
+            if len(self.ready) == 0:
+                # Normal timeout, nothing to do.  This will be caught by
+                # __cmd_loop in remoteObjectServer
+                raise socketTimeout('select() timed out')
+
+        raise socketTimeout('server terminating')
+
+    def finish_request(self, request, client_address):
+        # Same as in SocketServer.BaseServer, but returns the handler
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def server_close(self):
+        if self.requestQueue != None:
+            for worker in self.workers:
+                self.requestQueue.put(None)
+
+            self.park_lock.acquire()
+            try:
+                for request in self.parked.keys():
+                    self.close_request(request)
+                self.parked = {}
+            finally:
+                self.park_lock.release()
+
+        super(ProcessingMixIn, self).server_close()
         
     def do_process_request(self, request, client_address):
         """Same as in SocketServer.BaseServer but as a thread.
@@ -837,8 +1676,10 @@ class ProcessingMixIn(object):
 
         """
         try:
-            self.finish_request(request, client_address)
-            self.close_request(request)
+            handler = self.finish_request(request, client_address)
+            # A kept-alive connection handed back to us stays open
+            if not getattr(handler, 'parked', False):
+                self.close_request(request)
 
         except Exception, e:
             self.logger.error("Error handling request: %s" % (
@@ -854,7 +1695,19 @@ class ProcessingMixIn(object):
     def process_request(self, request, client_address):
         """Start a new thread to process the request."""
 
-        if self.useThread:
+        if self.requestQueue != None:
+            # Hand off to our worker pool if there is room in the queue
+            try:
+                self.requestQueue.put((request, client_address, time.time()),
+                                      True, queue_timeout)
+
+            except Queue.Full:
+                self.rejected += 1
+                self.logger.warn("Request queue full; rejecting request from %s:%d" % (
+                    client_address))
+                self.close_request(request)
+
+        elif self.useThread:
             if self.threadPool:
                 self.logger.debug("Handing off request %s to threadpool." % (
                         str(client_address)))
@@ -900,17 +1753,24 @@ class XMLRPCServer(ProcessingMixIn, BaseXMLRPCServer,
                  requestHandler=XMLRPCRequestHandler,
                  logRequests=False, allow_none=True, encoding=None,
                  threaded=False, threadPool=None,
-                 authDict=None, cert_file=None):
+                 authDict=None, cert_file=None,
+                 numworkers=0, queue_limit=100, method_limits=None):
         
         BaseXMLRPCServer.__init__(self, host, port, ev_quit=ev_quit,
                                   timeout=timeout, logger=logger,
                                   requestHandler=requestHandler,
                                   logRequests=logRequests,
                                   allow_none=allow_none, encoding=encoding,
-                                  authDict=authDict)
+                                  authDict=authDict,
+                                  method_limits=method_limits)
                                   
         self.ssl_pad = False
-        ProcessingMixIn.__init__(self, threaded=threaded, threadPool=threadPool)
+        # Allow HTTP/1.1 keep-alive connections (see XMLRPCRequestHandler)
+        # if idle ones don't tie up a thread
+        self.keepalive = (numworkers > 0)
+        ProcessingMixIn.__init__(self, threaded=threaded, threadPool=threadPool,
+                                 numworkers=numworkers,
+                                 queue_limit=queue_limit)
         SocketServer.TCPServer.__init__(self, (host, port), requestHandler)
 
         # Make XML-RPC sockets not block indefinitely
@@ -935,7 +1795,8 @@ class SecureXMLRPCServer(ProcessingMixIn, BaseXMLRPCServer,
                  requestHandler=XMLRPCRequestHandler,
                  logRequests=False, allow_none=True, encoding=None,
                  threaded=False, threadPool=None,
-                 authDict=None, cert_file=None):
+                 authDict=None, cert_file=None,
+                 numworkers=0, queue_limit=100, method_limits=None):
 
         if not SSL:
             raise Error("SSL support or Python wrapper not installed")
@@ -945,10 +1806,14 @@ class SecureXMLRPCServer(ProcessingMixIn, BaseXMLRPCServer,
                                   requestHandler=requestHandler,
                                   logRequests=logRequests,
                                   allow_none=allow_none, encoding=encoding,
-                                  authDict=authDict)
+                                  authDict=authDict,
+                                  method_limits=method_limits)
 
         self.ssl_pad = True
-        ProcessingMixIn.__init__(self, threaded=threaded, threadPool=threadPool)
+        self.keepalive = False
+        ProcessingMixIn.__init__(self, threaded=threaded, threadPool=threadPool,
+                                 numworkers=numworkers,
+                                 queue_limit=queue_limit)
         SSLSocketServer.__init__(self, (host, port), requestHandler,
                                  cert_file=cert_file)
 
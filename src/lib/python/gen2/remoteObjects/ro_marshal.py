@@ -0,0 +1,362 @@
+#
+# ro_marshal.py -- compact binary marshalling for remoteObjects calls
+#
+"""
+Binary alternative to the XML encoding of remoteObjects calls.
+
+A message is the magic string followed by one typed value.  Each value
+starts with a one-byte tag; sizes and numbers are in network byte order:
+
+    N               None
+    T, F            True, False
+    i <q>           integer that fits in 64 bits
+    l <I> digits    any other integer, as decimal digits
+    d <d>           float
+    s <I> bytes     string
+    u <I> bytes     unicode, as UTF-8
+    b <I> bytes     Binary buffer (see below)
+    x <I> bytes     xmlrpclib.Binary
+                    (both are received as an xmlrpclib.Binary)
+    t <I> bytes     xmlrpclib.DateTime, as its ISO 8601 string
+    L <I> values    list or tuple
+    D <I> k v ...   dictionary, as keys and values
+
+A request is the list [method, [param, ...]]; a reply is the list
+['r', result] or, for a fault, ['f', faultCode, faultString].
+
+Clients and servers agree to use this encoding per connection (see
+ro_XMLRPC.py); otherwise calls are plain XML-RPC, so older peers keep
+working.
+"""
+import struct
+import binascii
+import xmlrpclib
+
+# Content type of binary bodies
+content_type = 'application/x-ro-binary'
+# Version of the encoding; sent as the value of the negotiation header
+version = '1'
+
+magic = 'ROB' + version
+
+# Strings at least this long are kept out of the joined chunks of an
+# encoded message, so that they are sent as is without being copied
+big_size = 32 * 1024
+
+min_int64 = -(2 ** 63)
+max_int64 = (2 ** 63) - 1
+
+_len = struct.Struct('!I')
+_int = struct.Struct('!q')
+_double = struct.Struct('!d')
+
+
+class Error(Exception):
+    """Class of errors raised in this module."""
+    pass
+
+
+class Binary(object):
+    """Wraps a buffer of raw bytes for transport.  On a binary connection
+    the bytes are sent as they are, and received as an xmlrpclib.Binary.
+    Over XML-RPC they are sent as the base64 string that
+    remoteObjects.binary_encode() makes, so that receivers that
+    a2b_base64() it themselves keep working.  Either way
+    remoteObjects.binary_decode() of what is received is the bytes.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return "<Binary, %d bytes>" % len(self.data)
+
+
+def _dump_xml_binary(marshaller, value, write):
+    # as the string binary_encode() makes (base64 needs no escaping)
+    write("<value><string>")
+    write(binascii.b2a_base64(value.data))
+    write("</string></value>\n")
+
+xmlrpclib.Marshaller.dispatch[Binary] = _dump_xml_binary
+
+
+class Marshaller(object):
+    """Encodes a value as a list of chunks.  Small items are joined into
+    chunks; big strings and buffers are chunks of their own.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.parts = []
+        self.memo = {}
+
+    def dumps(self, value):
+        self.parts.append(magic)
+        self.dump(value)
+        self.flush()
+        return self.chunks
+
+    def flush(self):
+        if self.parts:
+            self.chunks.append(''.join(self.parts))
+            self.parts = []
+
+    def dump_buffer(self, tag, buf):
+        parts = self.parts
+        parts.append(tag)
+        parts.append(_len.pack(len(buf)))
+        if len(buf) < big_size:
+            parts.append(buf)
+        else:
+            self.flush()
+            self.chunks.append(buf)
+
+    def dump(self, value):
+        try:
+            f = self.dispatch[type(value)]
+
+        except KeyError:
+            # old-style instances (e.g. xmlrpclib.Binary) and subclasses
+            # of basic types (e.g. Bunch)
+            klass = getattr(value, '__class__', None)
+            if self.dispatch.has_key(klass):
+                f = self.dispatch[klass]
+            else:
+                for klass in type(value).__mro__:
+                    if self.dispatch.has_key(klass):
+                        f = self.dispatch[klass]
+                        break
+                else:
+                    raise TypeError("cannot marshal %s objects" % (
+                        type(value)))
+        f(self, value)
+
+    dispatch = {}
+
+    def dump_nil(self, value):
+        self.parts.append('N')
+    dispatch[type(None)] = dump_nil
+
+    def dump_bool(self, value):
+        if value:
+            self.parts.append('T')
+        else:
+            self.parts.append('F')
+    dispatch[bool] = dump_bool
+
+    def dump_int(self, value):
+        if min_int64 <= value <= max_int64:
+            self.parts.append('i')
+            self.parts.append(_int.pack(value))
+        else:
+            self.dump_buffer('l', str(value))
+    dispatch[int] = dump_int
+    dispatch[long] = dump_int
+
+    def dump_double(self, value):
+        self.parts.append('d')
+        self.parts.append(_double.pack(value))
+    dispatch[float] = dump_double
+
+    def dump_string(self, value):
+        self.dump_buffer('s', value)
+    dispatch[str] = dump_string
+
+    def dump_unicode(self, value):
+        self.dump_buffer('u', value.encode('utf-8'))
+    dispatch[unicode] = dump_unicode
+
+    def dump_binary(self, value):
+        self.dump_buffer('b', value.data)
+    dispatch[Binary] = dump_binary
+
+    def dump_xmlrpc_binary(self, value):
+        self.dump_buffer('x', value.data)
+    dispatch[xmlrpclib.Binary] = dump_xmlrpc_binary
+
+    def dump_datetime(self, value):
+        self.dump_buffer('t', value.value)
+    dispatch[xmlrpclib.DateTime] = dump_datetime
+
+    def dump_array(self, value):
+        i = id(value)
+        if self.memo.has_key(i):
+            raise TypeError("cannot marshal recursive sequences")
+        self.memo[i] = None
+        self.parts.append('L')
+        self.parts.append(_len.pack(len(value)))
+        dump = self.dump
+        for v in value:
+            dump(v)
+        del self.memo[i]
+    dispatch[tuple] = dump_array
+    dispatch[list] = dump_array
+
+    def dump_struct(self, value):
+        i = id(value)
+        if self.memo.has_key(i):
+            raise TypeError("cannot marshal recursive dictionaries")
+        self.memo[i] = None
+        self.parts.append('D')
+        self.parts.append(_len.pack(len(value)))
+        dump = self.dump
+        for (k, v) in value.iteritems():
+            dump(k)
+            dump(v)
+        del self.memo[i]
+    dispatch[dict] = dump_struct
+
+
+class Unmarshaller(object):
+    """Decodes a value from a string made by joining the chunks of a
+    Marshaller.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def loads(self):
+        data = self.data
+        n = len(magic)
+        if data[:n] != magic:
+            raise Error("Not a remoteObjects binary message")
+        self.offset = n
+        try:
+            res = self.load()
+
+        except (IndexError, KeyError, struct.error), e:
+            raise Error("Malformed remoteObjects binary message: %s" % (
+                str(e)))
+
+        if self.offset != len(data):
+            raise Error("Trailing data in remoteObjects binary message")
+        return res
+
+    def load(self):
+        tag = self.data[self.offset]
+        self.offset += 1
+        return self.dispatch[tag](self)
+
+    def load_buffer(self):
+        offset = self.offset
+        (n,) = _len.unpack_from(self.data, offset)
+        offset += 4
+        end = offset + n
+        if end > len(self.data):
+            raise IndexError("buffer overruns message")
+        self.offset = end
+        return self.data[offset:end]
+
+    dispatch = {}
+
+    def load_nil(self):
+        return None
+    dispatch['N'] = load_nil
+
+    def load_true(self):
+        return True
+    dispatch['T'] = load_true
+
+    def load_false(self):
+        return False
+    dispatch['F'] = load_false
+
+    def load_int(self):
+        (value,) = _int.unpack_from(self.data, self.offset)
+        self.offset += 8
+        return value
+    dispatch['i'] = load_int
+
+    def load_long(self):
+        return long(self.load_buffer())
+    dispatch['l'] = load_long
+
+    def load_double(self):
+        (value,) = _double.unpack_from(self.data, self.offset)
+        self.offset += 8
+        return value
+    dispatch['d'] = load_double
+
+    def load_string(self):
+        return self.load_buffer()
+    dispatch['s'] = load_string
+
+    def load_unicode(self):
+        return self.load_buffer().decode('utf-8')
+    dispatch['u'] = load_unicode
+
+    # Binary buffers are received as xmlrpclib.Binary, as over XML-RPC
+    def load_binary(self):
+        return xmlrpclib.Binary(self.load_buffer())
+    dispatch['b'] = load_binary
+    dispatch['x'] = load_binary
+
+    def load_datetime(self):
+        return xmlrpclib.DateTime(self.load_buffer())
+    dispatch['t'] = load_datetime
+
+    def load_array(self):
+        (n,) = _len.unpack_from(self.data, self.offset)
+        self.offset += 4
+        load = self.load
+        return [load() for i in xrange(n)]
+    dispatch['L'] = load_array
+
+    def load_struct(self):
+        (n,) = _len.unpack_from(self.data, self.offset)
+        self.offset += 4
+        load = self.load
+        res = {}
+        for i in xrange(n):
+            k = load()
+            res[k] = load()
+        return res
+    dispatch['D'] = load_struct
+
+
+# EXPORTED MODULE-LEVEL FUNCTIONS
+
+def dumps(value):
+    """Returns the encoding of (value) as a list of string chunks.
+    Raises TypeError if (value) contains something that cannot be encoded.
+    """
+    return Marshaller().dumps(value)
+
+def loads(data):
+    """Returns the value encoded in string (data)."""
+    return Unmarshaller(data).loads()
+
+def dumps_request(methodName, params):
+    return dumps([methodName, params])
+
+def loads_request(data):
+    """Returns (methodName, params) from an encoded request."""
+    try:
+        (methodName, params) = loads(data)
+
+    except (TypeError, ValueError):
+        raise Error("Malformed remoteObjects binary request")
+    return (methodName, params)
+
+def dumps_response(result):
+    return dumps(['r', result])
+
+def dumps_fault(fault):
+    return dumps(['f', fault.faultCode, fault.faultString])
+
+def loads_response(data):
+    """Returns the result from an encoded reply, or raises the
+    xmlrpclib.Fault it holds.
+    """
+    res = loads(data)
+    if res[0] == 'r':
+        return res[1]
+    elif res[0] == 'f':
+        raise xmlrpclib.Fault(res[1], res[2])
+    raise Error("Malformed remoteObjects binary reply")
+
+#END
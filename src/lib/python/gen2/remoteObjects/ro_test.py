@@ -9,11 +9,12 @@
 
 import sys, time
 import remoteObjects as ro
+import ro_XMLRPC
 
 
 class TestRO(ro.remoteObjectServer):
 
-    def __init__(self, options, usethread=False):
+    def __init__(self, options, usethread=False, numworkers=0):
 
         authDict = {}
         if options.auth:
@@ -26,7 +27,8 @@ class TestRO(ro.remoteObjectServer):
                                        usethread=usethread,
                                        authDict=authDict,
                                        secure=options.secure,
-                                       cert_file=options.cert)
+                                       cert_file=options.cert,
+                                       numworkers=numworkers)
 
     def recv(self, data, is_binary):
         if is_binary:
@@ -132,6 +134,56 @@ def client2(options):
             amount/tottime))
         datafile.close()
 
+
+def callbench(options):
+    """Compare the rate of small calls with and without keep-alive
+    connections, to a TestRO server started here.  The server only keeps
+    connections open with a pool of workers (numworkers > 0).
+    """
+    auth = None
+    if options.auth:
+        auth = options.auth.split(':')
+
+    numworkers = options.numworkers
+    if numworkers is None:
+        numworkers = 4
+    testsrv = TestRO(options, usethread=True, numworkers=numworkers)
+    print "Starting TestRO service (numworkers=%d)..." % numworkers
+    testsrv.ro_start(wait=True, timeout=5.0)
+    try:
+        results = _callbench(options, auth)
+    finally:
+        testsrv.ro_stop(wait=True, timeout=5.0)
+
+    print "Speedup: %.2fx" % (results[1] / results[0])
+
+
+def _callbench(options, auth):
+    results = []
+    for keepalive in (False, True):
+        ro_XMLRPC.use_keepalive = keepalive
+        ro_XMLRPC.connectionPool.clear()
+
+        # Get handle to server
+        testro = ro.remoteObjectProxy(options.svcname, auth=auth,
+                                      secure=options.secure, timeout=2.0)
+        # Make sure we have a proxy before starting the clock
+        testro.ro_echo(0)
+
+        time1 = time.time()
+
+        for i in xrange(options.count):
+            res = testro.ro_echo(i)
+
+        tottime = time.time() - time1
+        calls_per_sec = options.count / tottime
+        results.append(calls_per_sec)
+
+        print "keepalive=%-5s  %f secs total  %f sec per call  %d calls/sec" % (
+            keepalive, tottime, tottime / options.count, int(calls_per_sec))
+
+    return results
+
     
 def main(options, args):
 
@@ -140,7 +192,10 @@ def main(options, args):
     select = options.action
 
     if select == 'server':
-        testro = TestRO(options, usethread=False)
+        numworkers = options.numworkers
+        if numworkers is None:
+            numworkers = 0
+        testro = TestRO(options, usethread=False, numworkers=numworkers)
 
         print "Starting TestRO service..."
         try:
@@ -180,6 +235,9 @@ def main(options, args):
     elif select == 'calls':
         client2(options)
 
+    elif select == 'callbench':
+        callbench(options)
+
     else:
         print "I don't know how to do '%s'" % select
         sys.exit(1)
@@ -195,7 +253,7 @@ if __name__ == '__main__':
     parser = OptionParser(usage=usage, version=('%%prog'))
     
     parser.add_option("--action", dest="action",
-                      help="Action is server|file|status")
+                      help="Action is server|file|status|calls|callbench")
     parser.add_option("--auth", dest="auth",
                       help="Use authorization; arg should be user:passwd")
     parser.add_option("--cert", dest="cert",
@@ -211,6 +269,9 @@ if __name__ == '__main__':
     parser.add_option("--interval", dest="interval", type="float",
                       help="Wait NUM seconds between client calls",
                       metavar="NUM")
+    parser.add_option("--numworkers", dest="numworkers", type="int",
+                      help="Serve calls with NUM worker threads (default 0 for server, 4 for callbench)",
+                      metavar="NUM")
     parser.add_option("--port", dest="port", type="int",
                       help="Register using PORT", metavar="PORT")
     parser.add_option("--profile", dest="profile", action="store_true",
@@ -1,95 +1,333 @@
 #!/usr/bin/env python
 
+import os, time, glob, errno
 import numpy as np
 from scipy.ndimage import median_filter
-import copy
+import frame_wait
+
+# masks of outlier pixels kept by find_outlier_mask(), by cache key
+# (e.g. camera name)
+mask_cache = {}
+
+# versioned bad pixel maps are kept in badpix_dir % camid, by default
+# <home>/conf/<camid>_aux/badpixmaps/ (see get_badpix_dir())
+badpix_dir = None
+# maps loaded by load_badpix_map(), by path: ((file, mtime), map, confidence)
+badpix_cache = {}
 
 # ========= HOT PIXELS ==================================
 #========================================================
-def find_outlier_pixels(data,tolerance=3,worry_about_edges=True):
-    #This function finds the hot or dead pixels in a 2D dataset. 
+def _median_stack(arrays):
+    # median of a list of same-shape arrays, element by element
+    return np.median(np.array(arrays), axis=0)
+
+def _edge_medians(data, med):
+    # Fill the edges of (med) with the median of the pixels around each
+    # edge pixel, itself included (3x2 on the sides, 2x2 in the corners)
+    #left and right sides
+    for col, cols in ((0, (0, 1)), (-1, (-2, -1))):
+        med[1:-1, col] = _median_stack([data[r0:r1, c] for c in cols
+                                        for (r0, r1) in ((0, -2), (1, -1),
+                                                         (2, None))])
+    #top and bottom
+    for row, rows in ((0, (0, 1)), (-1, (-2, -1))):
+        med[row, 1:-1] = _median_stack([data[r, c0:c1] for r in rows
+                                        for (c0, c1) in ((0, -2), (1, -1),
+                                                         (2, None))])
+    #corners
+    for row, rows in ((0, slice(0, 2)), (-1, slice(-2, None))):
+        for col, cols in ((0, slice(0, 2)), (-1, slice(-2, None))):
+            med[row, col] = np.median(data[rows, cols])
+
+def _interior_medians(data, ys, xs):
+    # Same value as median_filter(data, size=2) at the interior pixels
+    # (ys, xs): the upper median of the 2x2 box ending at each pixel
+    box = np.array([data[ys - 1, xs - 1], data[ys - 1, xs],
+                    data[ys, xs - 1], data[ys, xs]])
+    box.sort(axis=0)
+    return box[2]
+
+def find_outlier_mask(data, tolerance=3, worry_about_edges=True,
+                      cache_key=None, refresh=False):
+    #This function finds the hot or dead pixels in a 2D dataset and
+    #replaces them with the median of their neighbours.
     #tolerance is the number of standard deviations used to cutoff the hot pixels
-    #If you want to ignore the edges and greatly speed up the code, then set
-    #worry_about_edges to False.
+    #If worry_about_edges is False, pixels on the edges are never flagged.
+    #
+    #If cache_key is given (e.g. the camera name), the mask is kept and
+    #reused for later frames with the same key and shape, which then only
+    #need their flagged pixels corrected.  Set refresh to True to compute
+    #a new mask for the key.
+    #
+    #The function returns a boolean mask of the hot pixels and an image
+    #with the hot pixels removed
+    fdata = np.asarray(data, dtype=float)
+    fixed_image = np.array(data, copy=True)
+
+    mask = None
+    if (cache_key is not None) and (not refresh):
+        mask = mask_cache.get(cache_key)
+        if (mask is not None) and (mask.shape != fdata.shape):
+            mask = None
+
+    if mask is not None:
+        # correct only the pixels we already know about
+        med = np.empty_like(fdata)
+        _edge_medians(fdata, med)
+        inner = np.zeros_like(mask)
+        inner[1:-1, 1:-1] = mask[1:-1, 1:-1]
+        ys, xs = np.nonzero(inner)
+        fixed_image[ys, xs] = _interior_medians(fdata, ys, xs)
+        edges = mask & ~inner
+        fixed_image[edges] = med[edges]
+        return mask, fixed_image
+
+    med = median_filter(fdata, size=2)
+    threshold = tolerance * np.std(fdata - med)
+
+    if worry_about_edges:
+        _edge_medians(fdata, med)
+
+    mask = np.abs(fdata - med) > threshold
+    if not worry_about_edges:
+        mask[0, :] = mask[-1, :] = False
+        mask[:, 0] = mask[:, -1] = False
+
+    fixed_image[mask] = med[mask]
+
+    if cache_key is not None:
+        mask_cache[cache_key] = mask
+
+    return mask, fixed_image
+
+
+def find_outlier_pixels(data, tolerance=3, worry_about_edges=True):
+    #This function finds the hot or dead pixels in a 2D dataset.
+    #tolerance is the number of standard deviations used to cutoff the hot pixels
+    #If you want to ignore the edges, then set worry_about_edges to False.
     #
     #The function returns a list of hot pixels and also an image with with hot pixels removed
-    blurred = median_filter(data, size=2)
-    difference = data - blurred
-    threshold = tolerance*np.std(difference)
-
-    #find the hot pixels, but ignore the edges
-    hot_pixels = np.nonzero((np.abs(difference[1:-1,1:-1])>threshold) )
-    hot_pixels = np.array(hot_pixels) + 1 #because we ignored the first row and first column
-
-    fixed_image = copy.deepcopy(data) #This is the image with the hot pixels removed
-    for y,x in zip(hot_pixels[0],hot_pixels[1]):
-        fixed_image[y,x]=blurred[y,x]
-
-    if worry_about_edges == True:
-        height,width = np.shape(data)
-
-        ###Now get the pixels on the edges (but not the corners)###
-
-        #left and right sides
-        for index in range(1,height-1):
-            #left side:
-            med  = np.median(data[index-1:index+2,0:2])
-            diff = np.abs(data[index,0] - med)
-            if diff>threshold: 
-                hot_pixels = np.hstack(( hot_pixels, [[index],[0]]  ))
-                fixed_image[index,0] = med
-
-            #right side:
-            med  = np.median(data[index-1:index+2,-2:])
-            diff = np.abs(data[index,-1] - med)
-            if diff>threshold: 
-                hot_pixels = np.hstack(( hot_pixels, [[index],[width-1]]  ))
-                fixed_image[index,-1] = med
-
-        #Then the top and bottom
-        for index in range(1,width-1):
-            #bottom:
-            med  = np.median(data[0:2,index-1:index+2])
-            diff = np.abs(data[0,index] - med)
-            if diff>threshold: 
-                hot_pixels = np.hstack(( hot_pixels, [[0],[index]]  ))
-                fixed_image[0,index] = med
-
-            #top:
-            med  = np.median(data[-2:,index-1:index+2])
-            diff = np.abs(data[-1,index] - med)
-            if diff>threshold: 
-                hot_pixels = np.hstack(( hot_pixels, [[height-1],[index]]  ))
-                fixed_image[-1,index] = med
-
-        ###Then the corners###
-
-        #bottom left
-        med  = np.median(data[0:2,0:2])
-        diff = np.abs(data[0,0] - med)
-        if diff>threshold: 
-            hot_pixels = np.hstack(( hot_pixels, [[0],[0]]  ))
-            fixed_image[0,0] = med
-
-        #bottom right
-        med  = np.median(data[0:2,-2:])
-        diff = np.abs(data[0,-1] - med)
-        if diff>threshold: 
-            hot_pixels = np.hstack(( hot_pixels, [[0],[width-1]]  ))
-            fixed_image[0,-1] = med
-
-        #top left
-        med  = np.median(data[-2:,0:2])
-        diff = np.abs(data[-1,0] - med)
-        if diff>threshold: 
-            hot_pixels = np.hstack(( hot_pixels, [[height-1],[0]]  ))
-            fixed_image[-1,0] = med
-
-        #top right
-        med  = np.median(data[-2:,-2:])
-        diff = np.abs(data[-1,-1] - med)
-        if diff>threshold: 
-            hot_pixels = np.hstack(( hot_pixels, [[height-1],[width-1]]  ))
-            fixed_image[-1,-1] = med
-
-    return hot_pixels,fixed_image
+    mask, fixed_image = find_outlier_mask(data, tolerance=tolerance,
+                                          worry_about_edges=worry_about_edges)
+    hot_pixels = np.array(np.nonzero(mask))
+
+    return hot_pixels, fixed_image
+
+
+# ========= BAD PIXEL MAPS ==============================
+#========================================================
+class BadPixelAccumulator(object):
+    #Builds a bad pixel map from a stream of (dark) frames, one frame at
+    #a time, so that a whole cube never has to be held in memory.
+    #
+    #For every pixel it keeps the running mean and variance of its values
+    #(Welford's algorithm) and the number of frames in which it was an
+    #outlier of the frame, i.e. more than tolerance robust standard
+    #deviations (1.4826 * MAD) away from the frame's median.
+    #
+    #The map flags the pixels whose mean (hot/dead pixels) or standard
+    #deviation (noisy pixels) is an outlier of the map of all pixels, as
+    #well as those that were outliers in at least min_fraction of the
+    #frames.  The confidence of each pixel is the fraction of the frames
+    #in which it was an outlier.
+
+    def __init__(self, tolerance=5, min_fraction=0.5):
+        self.tolerance = tolerance
+        self.min_fraction = min_fraction
+        self.nframes = 0
+        self.mean = None
+        self.m2 = None
+        self.hits = None
+        self.delta = None
+
+    def add(self, frame):
+        frame = np.asarray(frame, dtype=float)
+        if self.nframes == 0:
+            self.mean = np.zeros_like(frame)
+            self.m2 = np.zeros_like(frame)
+            self.hits = np.zeros(frame.shape, dtype=np.int32)
+            self.delta = np.empty_like(frame)
+        elif frame.shape != self.mean.shape:
+            raise ValueError("frame shape %s does not match %s" % (
+                str(frame.shape), str(self.mean.shape)))
+
+        self.nframes += 1
+        delta = self.delta
+        np.subtract(frame, self.mean, out=delta)
+        self.mean += delta / self.nframes
+        # m2 += delta * (frame - new mean)
+        self.m2 += delta * (frame - self.mean)
+
+        med = np.median(frame)
+        np.subtract(frame, med, out=delta)
+        np.abs(delta, out=delta)
+        sigma = 1.4826 * np.median(delta)
+        self.hits += delta > self.tolerance * sigma
+
+    def add_cube(self, cube):
+        for frame in cube:
+            self.add(frame)
+
+    def std(self, ddof=1):
+        #ddof=0 gives np.std(cube, axis=0)
+        return np.sqrt(self.m2 / max(self.nframes - ddof, 1))
+
+    def confidence(self):
+        #fraction of the frames in which each pixel was an outlier
+        return self.hits / float(self.nframes)
+
+    def _outliers(self, im):
+        med = np.median(im)
+        sigma = 1.4826 * np.median(np.abs(im - med))
+        return np.abs(im - med) > self.tolerance * sigma
+
+    def result(self):
+        #Returns the boolean bad pixel map and the confidence map
+        if self.nframes == 0:
+            raise ValueError("no frames accumulated")
+        confidence = self.confidence()
+        badmap = self._outliers(self.mean) | self._outliers(self.std())
+        badmap |= confidence >= self.min_fraction
+        return badmap, confidence
+
+
+def accumulate_fits_cube(acc, path):
+    #Adds the frames of the FITS cube at path to the BadPixelAccumulator
+    #acc, reading one frame at a time.  Returns the header of the cube.
+    from astropy.io import fits as pf
+    hdul = pf.open(path, memmap=True, do_not_scale_image_data=True)
+    try:
+        hdr = hdul[0].header
+        cube = hdul[0].data
+        bscale = hdr.get('BSCALE', 1.0)
+        bzero = hdr.get('BZERO', 0.0)
+        if cube.ndim == 2:
+            cube = cube[np.newaxis]
+        for frame in cube:
+            acc.add(np.asarray(frame, dtype=float) * bscale + bzero)
+        return hdr.copy()
+    finally:
+        hdul.close()
+
+
+def accumulate_shm(acc, stream, nframes, timeout=None, poll=0.001):
+    #Adds the next nframes frames from the shared memory stream (a
+    #scexao_shm.shm) to the BadPixelAccumulator acc, waiting for each one
+    #with frame_wait.  Gives up after timeout seconds without a new frame.
+    #Returns the number of frames added.
+    waiter = frame_wait.frame_waiter(stream, poll=poll)
+    count = 0
+    try:
+        while count < nframes:
+            if waiter.wait_new_frame(timeout) is None:
+                break
+            acc.add(stream.get_data(False, True))
+            count += 1
+    finally:
+        waiter.close()
+    return count
+
+
+def get_badpix_dir():
+    #Directory template of the versioned bad pixel maps (see badpix_dir)
+    if badpix_dir is not None:
+        return badpix_dir
+    return os.path.join(os.path.expanduser('~'), 'conf/%s_aux/badpixmaps/')
+
+
+def badpix_map_path(camid, exptime, version=None):
+    #Path of the bad pixel map of camera camid for exposure time exptime
+    #(in seconds): the current map, or the given version (a timestamp)
+    name = "badpixmap_%dus" % (int(round(exptime * 1e6)),)
+    if version is not None:
+        name += "_" + version
+    return get_badpix_dir() % (camid,) + name + ".fits"
+
+
+def _new_version(camid, exptime):
+    #Creates the (empty) file of a new version of the bad pixel map and
+    #returns the version and path.  The version is the time, with a
+    #counter if there already is a version of that second.
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    path = badpix_map_path(camid, exptime, stamp)
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    count = 0
+    while True:
+        version = stamp
+        if count > 0:
+            version += "-%02d" % (count,)
+        path = badpix_map_path(camid, exptime, version)
+        try:
+            # only one saver gets to create the file
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return version, path
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        count += 1
+
+
+def save_badpix_map(camid, exptime, badmap, confidence=None, nframes=0,
+                    tolerance=None):
+    #Saves a new version of the bad pixel map of camera camid for exposure
+    #time exptime, and makes it the current map.  Returns its path.
+    from astropy.io import fits as pf
+    version, path = _new_version(camid, exptime)
+
+    hdr = pf.Header()
+    hdr['CAMERA'] = camid
+    hdr['EXPTIME'] = exptime
+    hdr['VERSION'] = version
+    hdr['NFRAMES'] = nframes
+    if tolerance is not None:
+        hdr['TOLERANC'] = tolerance
+    hdul = pf.HDUList([pf.PrimaryHDU(badmap.astype(float), header=hdr)])
+    if confidence is not None:
+        hdul.append(pf.ImageHDU(confidence.astype(np.float32),
+                                name='CONFIDENCE'))
+    hdul.writeto(path, overwrite=True)
+
+    # switch the current map over to the new version in one step, through
+    # a link named after the version (only this saver has it)
+    current = badpix_map_path(camid, exptime)
+    tmp = '%s.%s.tmp' % (current, version)
+    os.symlink(os.path.basename(path), tmp)
+    os.rename(tmp, current)
+    return path
+
+
+def load_badpix_map(camid, exptime, version=None):
+    #Returns the (current, unless version is given) bad pixel map of camera
+    #camid for exposure time exptime as a boolean array, and its confidence
+    #map (None if it has none).  Maps are cached until their file changes,
+    #so this is cheap to call for every frame.
+    path = badpix_map_path(camid, exptime, version)
+    # the current map is a link to the latest version
+    real = os.path.realpath(path)
+    stamp = (real, os.stat(real).st_mtime)
+    cached = badpix_cache.get(path)
+    if (cached is not None) and (cached[0] == stamp):
+        return cached[1], cached[2]
+
+    from astropy.io import fits as pf
+    hdul = pf.open(path)
+    try:
+        badmap = hdul[0].data > 0.5
+        confidence = None
+        if 'CONFIDENCE' in [hdu.name for hdu in hdul]:
+            confidence = np.array(hdul['CONFIDENCE'].data)
+    finally:
+        hdul.close()
+
+    badpix_cache[path] = (stamp, badmap, confidence)
+    return badmap, confidence
+
+
+def list_badpix_maps(camid, exptime):
+    #Returns the versions of the bad pixel maps of camera camid for
+    #exposure time exptime, oldest first
+    pattern = badpix_map_path(camid, exptime, '*')
+    prefix, suffix = pattern.split('*')
+    return sorted([p[len(prefix):-len(suffix)] for p in glob.glob(pattern)])
@@ -2,7 +2,7 @@
 
 import math as m
 import numpy as np
-import copy, os, sys
+import copy, os, sys, time
 
 import matplotlib.pyplot as plt
 
@@ -15,6 +15,9 @@ from astropy.io import fits as pf
 home = os.getenv('HOME')  # Expected /home/scexao
 sys.path.append(home + '/src/lib/python/')
 
+from hot_pixels import find_outlier_pixels, find_outlier_mask, \
+    BadPixelAccumulator, load_badpix_map
+
 fitter = fitting.LevMarLSQFitter()
 
 # ========= MODEL PSF FOR FITTING =======================
@@ -101,95 +104,17 @@ def make_ramp(*args):
 
 # ========= HOT PIXELS ==================================
 #========================================================
-def find_outlier_pixels(data, tolerance=3, worry_about_edges=True):
-    #This function finds the hot or dead pixels in a 2D dataset.
-    #tolerance is the number of standard deviations used to cutoff the hot pixels
-    #If you want to ignore the edges and greatly speed up the code, then set
-    #worry_about_edges to False.
-    #
-    #The function returns a list of hot pixels and also an image with with hot pixels removed
-    blurred = median_filter(data, size=2)
-    difference = data - blurred
-    threshold = tolerance * np.std(difference)
-
-    #find the hot pixels, but ignore the edges
-    hot_pixels = np.nonzero((np.abs(difference[1:-1, 1:-1]) > threshold))
-    hot_pixels = np.array(
-        hot_pixels) + 1  #because we ignored the first row and first column
-
-    fixed_image = copy.deepcopy(
-        data)  #This is the image with the hot pixels removed
-    for y, x in zip(hot_pixels[0], hot_pixels[1]):
-        fixed_image[y, x] = blurred[y, x]
-
-    if worry_about_edges == True:
-        height, width = np.shape(data)
-
-        ###Now get the pixels on the edges (but not the corners)###
-
-        #left and right sides
-        for index in range(1, height - 1):
-            #left side:
-            med = np.median(data[index - 1:index + 2, 0:2])
-            diff = np.abs(data[index, 0] - med)
-            if diff > threshold:
-                hot_pixels = np.hstack((hot_pixels, [[index], [0]]))
-                fixed_image[index, 0] = med
-
-            #right side:
-            med = np.median(data[index - 1:index + 2, -2:])
-            diff = np.abs(data[index, -1] - med)
-            if diff > threshold:
-                hot_pixels = np.hstack((hot_pixels, [[index], [width - 1]]))
-                fixed_image[index, -1] = med
-
-        #Then the top and bottom
-        for index in range(1, width - 1):
-            #bottom:
-            med = np.median(data[0:2, index - 1:index + 2])
-            diff = np.abs(data[0, index] - med)
-            if diff > threshold:
-                hot_pixels = np.hstack((hot_pixels, [[0], [index]]))
-                fixed_image[0, index] = med
-
-            #top:
-            med = np.median(data[-2:, index - 1:index + 2])
-            diff = np.abs(data[-1, index] - med)
-            if diff > threshold:
-                hot_pixels = np.hstack((hot_pixels, [[height - 1], [index]]))
-                fixed_image[-1, index] = med
-
-        ###Then the corners###
-
-        #bottom left
-        med = np.median(data[0:2, 0:2])
-        diff = np.abs(data[0, 0] - med)
-        if diff > threshold:
-            hot_pixels = np.hstack((hot_pixels, [[0], [0]]))
-            fixed_image[0, 0] = med
-
-        #bottom right
-        med = np.median(data[0:2, -2:])
-        diff = np.abs(data[0, -1] - med)
-        if diff > threshold:
-            hot_pixels = np.hstack((hot_pixels, [[0], [width - 1]]))
-            fixed_image[0, -1] = med
-
-        #top left
-        med = np.median(data[-2:, 0:2])
-        diff = np.abs(data[-1, 0] - med)
-        if diff > threshold:
-            hot_pixels = np.hstack((hot_pixels, [[height - 1], [0]]))
-            fixed_image[-1, 0] = med
-
-        #top right
-        med = np.median(data[-2:, -2:])
-        diff = np.abs(data[-1, -1] - med)
-        if diff > threshold:
-            hot_pixels = np.hstack((hot_pixels, [[height - 1], [width - 1]]))
-            fixed_image[-1, -1] = med
-
-    return hot_pixels, fixed_image
+# find_outlier_pixels(data, tolerance=3, worry_about_edges=True)
+#     returns the hot pixel coordinates and the corrected image
+# find_outlier_mask(data, tolerance=3, worry_about_edges=True,
+#                   cache_key=None, refresh=False)
+#     returns a boolean mask of the hot pixels and the corrected image,
+#     optionally reusing the mask for later frames of the same camera
+# BadPixelAccumulator(tolerance=5, min_fraction=0.5)
+#     builds a bad pixel map with per-pixel confidence frame by frame
+# load_badpix_map(camid, exptime)
+#     returns the current saved map of a camera for an exposure time
+# (see hot_pixels.py)
 
 
 def outlier_pixels_as_map(data, tolerance=3):
@@ -211,30 +136,157 @@ def outlier_pixels_as_map(data, tolerance=3):
 # ========= CENTROID ====================================
 # =======================================================
 
+# coordinate grids by shape, shared by the centroid functions
+_grids = {}
+
+
+def coord_grids(shape):
+    # Returns (and caches) the np.mgrid row and column index arrays for an
+    # image of the given shape
+    shape = tuple(shape)
+    if shape not in _grids:
+        _grids[shape] = np.mgrid[:shape[0], :shape[1]].astype(float)
+    return _grids[shape]
+
+
+def coord_ramps(shape):
+    # Returns the row and column indices of an image of the given shape
+    grid = coord_grids(shape)
+    return grid[0][:, 0], grid[1][0, :]
+
+
+class CentroidEngine:
+    # Computes the centroids of one frame, or of a stack of frames at
+    # once, working in a buffer that is allocated once per stack shape.
+    #
+    # methods:
+    #   "default": center of gravity of the frame above fact * max (as
+    #              centroid())
+    #   "wcog"   : windowed center of gravity, the same in a box of
+    #              2 * window + 1 pixels around the brightest pixel
+    #   "quad"   : quadratic interpolation of the peak around the brightest
+    #              pixel, from its 4 neighbours
+    #
+    # centroids(frames, bias=None) returns [cx, cy] for a 2D frame, or an
+    # (N, 2) array of [cx, cy] for a (N, ny, nx) stack.
+
+    def __init__(self, method="default", fact=0.2, window=5):
+        if method not in self.methods:
+            raise ValueError("unknown centroid method '%s'" % method)
+        self.method = method
+        self.fact = fact
+        self.window = window
+        self.buf = None
+
+    def centroids(self, frames, bias=None):
+        frames = np.asarray(frames)
+        single = (frames.ndim == 2)
+        if single:
+            frames = frames[np.newaxis]
+
+        if (self.buf is None) or (self.buf.shape != frames.shape):
+            self.buf = np.empty(frames.shape)
+        buf = self.buf
+        if bias is None:
+            buf[...] = frames
+        else:
+            np.subtract(frames, bias, out=buf)
+
+        res = self.methods[self.method](self, buf)
+        if single:
+            return list(res[0])
+        return res
+
+    __call__ = centroids
+
+    def _threshold(self, buf):
+        # subtract fact * max from each frame and clip at 0, in place
+        n = buf.shape[0]
+        imax = np.nanmax(buf.reshape(n, -1), axis=1)
+        buf -= self.fact * imax[:, np.newaxis, np.newaxis]
+        np.maximum(buf, 0, out=buf)
+
+    def _peaks(self, buf, margin):
+        # (row, col) of the brightest pixel of each frame, kept at least
+        # margin pixels away from the edges
+        n, ny, nx = buf.shape
+        idx = np.nanargmax(buf.reshape(n, -1), axis=1)
+        iy, ix = np.divmod(idx, nx)
+        iy = np.clip(iy, margin, ny - 1 - margin)
+        ix = np.clip(ix, margin, nx - 1 - margin)
+        return iy, ix
+
+    def _cog(self, buf):
+        self._threshold(buf)
+        rows, cols = coord_ramps(buf.shape[1:])
+        prow = np.nansum(buf, axis=2)
+        pcol = np.nansum(buf, axis=1)
+        total = prow.sum(axis=1)
+        return np.column_stack((pcol.dot(cols) / total,
+                                prow.dot(rows) / total))
+
+    def _wcog(self, buf):
+        n, ny, nx = buf.shape
+        w = min(self.window, (min(ny, nx) - 1) // 2)
+        iy, ix = self._peaks(buf, w)
+        off = np.arange(-w, w + 1)
+        k = np.arange(n)[:, np.newaxis, np.newaxis]
+        box = buf[k, (iy[:, np.newaxis] + off)[:, :, np.newaxis],
+                  (ix[:, np.newaxis] + off)[:, np.newaxis, :]]
+        self._threshold(box)
+        prow = np.nansum(box, axis=2)
+        pcol = np.nansum(box, axis=1)
+        total = prow.sum(axis=1)
+        return np.column_stack((ix + pcol.dot(off) / total,
+                                iy + prow.dot(off) / total))
+
+    def _quad(self, buf):
+        n = buf.shape[0]
+        iy, ix = self._peaks(buf, 1)
+        k = np.arange(n)
+        c = buf[k, iy, ix]
+
+        def vertex(lo, hi):
+            den = lo - 2 * c + hi
+            safe = np.where(den != 0, den, 1.)
+            return np.where(den != 0, np.clip(0.5 * (lo - hi) / safe, -1, 1),
+                            0.)
+
+        dx = vertex(buf[k, iy, ix - 1], buf[k, iy, ix + 1])
+        dy = vertex(buf[k, iy - 1, ix], buf[k, iy + 1, ix])
+        return np.column_stack((ix + dx, iy + dy))
+
+    methods = {"default": _cog, "wcog": _wcog, "quad": _quad}
+
+
+# engines used by centroid(), by method
+_engines = {}
+
 
 def centroid(image,
              bias=[],
              subt_bias=True,
              fact=0.2,
              method="default",
-             fixrad=False):
+             fixrad=False,
+             window=5):
+    # NOTE: the bias is subtracted when subt_bias is False
     if not subt_bias:
         image2 = image - bias
     else:
-        image2 = copy.deepcopy(image)
+        image2 = np.asarray(image)
+
+    if method in CentroidEngine.methods:
+        eng = _engines.get(method)
+        if eng is None:
+            eng = _engines[method] = CentroidEngine(method)
+        eng.fact = fact
+        eng.window = window
+        return eng.centroids(image2)
+
+    [cx, cy] = centroid(image2, fact=fact)
     imax = np.max(image2)
-    imin = fact * imax
-    image3 = copy.deepcopy(image2) - imin
-    mask = image3 > 0
-    image3 *= mask
-    total = np.nansum(image3)
-    X, Y = np.indices(np.shape(image3))
-    cy = (np.nansum(X * image3) / total)
-    cx = (np.nansum(Y * image3) / total)
-    if method == "default":
-        cx2 = cx  #+0.5
-        cy2 = cy  #+0.5
-    elif method == "gaussian":
+    if method == "gaussian":
         image4 = image2[int(cy) - 64:int(cy) + 64, int(cx) - 64:int(cx) + 64]
         radc = m.sqrt(np.sum(image4 > (imax / 4.)) / m.pi)
         se_param = fit_TwoD_Gaussian(image4, 64, 64, radc, fixrad=fixrad)
@@ -243,9 +295,7 @@ def centroid(image,
     elif method == "airy":
         image4 = image2[int(cy) - 64:int(cy) + 64, int(cx) - 64:int(cx) + 64]
         model_init1 = SubaruPSF(amplitude=imax, x_0=64, y_0=64)
-        nx = image4.shape[0]
-        ny = image4.shape[1]
-        xx, yy = np.mgrid[:nx, :ny]
+        xx, yy = coord_grids(image4.shape)
         psf_fit = fitter(model_init1, xx, yy, image4, maxiter=2000)
         #print("default:",imax,cx,cy)
         cy2 = psf_fit.y_0.value - 64 + int(cy)
@@ -256,10 +306,220 @@ def centroid(image,
     return [cx2, cy2]
 
 
+def centroid_benchmark(methods=("default", "wcog", "quad", "gaussian"),
+                       nframes=200,
+                       size=160,
+                       sigma=2.5,
+                       noise=0.01,
+                       nfit=10):
+    # Compares the accuracy and speed of the centroid methods on simulated
+    # Gaussian spots at random sub-pixel positions, with Gaussian noise
+    # (relative to the peak).  The engine methods are run on the whole
+    # stack at once, the fitting methods ("gaussian", "airy") frame by
+    # frame on the first nfit frames.
+    # Returns a dict of (rms error in pixels, time per frame in sec).
+    rng = np.random.RandomState(0)
+    true = size / 2. + rng.uniform(-5, 5, (nframes, 2))
+    rows, cols = coord_ramps((size, size))
+    frames = np.exp(-((cols[np.newaxis, np.newaxis, :] -
+                       true[:, 0, np.newaxis, np.newaxis])**2 +
+                      (rows[np.newaxis, :, np.newaxis] -
+                       true[:, 1, np.newaxis, np.newaxis])**2) /
+                    (2 * sigma**2))
+    frames += noise * rng.standard_normal(frames.shape)
+
+    res = {}
+    txt = "%-10s %12s %14s\n" % ("METHOD", "RMS ERR (px)", "TIME/FRAME (s)")
+    for method in methods:
+        if method in CentroidEngine.methods:
+            eng = CentroidEngine(method)
+            eng.centroids(frames)
+            t0 = time.time()
+            cen = eng.centroids(frames)
+            dt = (time.time() - t0) / nframes
+            err = cen - true
+        else:
+            t0 = time.time()
+            cen = np.array([centroid(frames[i], method=method)
+                            for i in range(nfit)])
+            dt = (time.time() - t0) / nfit
+            err = cen - true[:nfit]
+        rms = m.sqrt(np.mean(np.sum(err**2, axis=1)))
+        res[method] = (rms, dt)
+        txt += "%-10s %12.4f %14.2e\n" % (method, rms, dt)
+    print(txt)
+    return res
+
+
 # ========= RADIAL PROFILE ==============================
 # =======================================================
 
 
+class radialDat:
+    """Empty object container.
+    """
+    def __init__(self):
+        self.mean = None
+        self.std = None
+        self.median = None
+        self.numel = None
+        self.max = None
+        self.min = None
+        self.r = None
+
+
+class RadialProfile:
+    """
+    p = RadialProfile(shape, annulus_width, working_mask, x, y, rmax, center)
+
+    A reusable operator reducing images of a given shape to radial
+    cross-sections, with the same annuli and statistics as radial_data().
+    The annulus of every pixel is found once, when the operator is built;
+    each frame is then reduced with np.bincount and sorted-index segment
+    reductions instead of one pass over the image per annulus.
+
+    INPUT:
+    ------
+    shape  - shape of the images
+    annulus_width, working_mask, x, y, rmax - as for radial_data()
+    center - (cx, cy) pixel (column, row) at the origin of the default
+             coordinate system.  Default is the middle of the image.
+
+    USE:
+    ----
+    p.profile(data)   - radialDat of the statistics of a 2D image
+    p.profile(cube)   - the same for a (N, nx, ny) cube, with each
+                        statistic an (N, nrad) array
+    stats             - optional list of the statistics to compute
+                        (default is all of p.all_stats); skipping
+                        'median' saves a sort of the data
+    """
+
+    all_stats = ('mean', 'std', 'median', 'numel', 'max', 'min')
+
+    def __init__(self,
+                 shape,
+                 annulus_width=1,
+                 working_mask=None,
+                 x=None,
+                 y=None,
+                 rmax=None,
+                 center=None):
+
+        npix, npiy = shape
+        if working_mask is None:
+            working_mask = np.ones(shape, bool)
+        else:
+            working_mask = np.asarray(working_mask, bool)
+
+        if x is None or y is None:
+            if center is None:
+                center = (npiy / 2., npix / 2.)
+            rows, cols = coord_ramps(shape)
+            x, y = np.meshgrid(cols - center[0], rows - center[1])
+
+        r = abs(x + 1j * y)
+
+        if rmax is None:
+            rmax = r[working_mask].max()
+
+        dr = np.abs(x[0, 0] - x[0, 1]) * annulus_width
+        self.r = np.arange(rmax / dr) * dr + dr / 2.
+        self.nrad = nrad = len(self.r)
+
+        # annulus of each pixel; pixels outside all annuli are dropped
+        ann = np.floor(r / dr).astype(int)
+        valid = working_mask & (r >= 0) & (ann < nrad)
+        pix = np.flatnonzero(valid)
+        ann = ann.ravel()[pix]
+
+        # pixels sorted by annulus, and where each annulus starts
+        order = np.argsort(ann, kind='mergesort')
+        self.shape = tuple(shape)
+        self.pix = pix[order]
+        self.ann = ann[order]
+        self.numel = np.bincount(self.ann, minlength=nrad)
+        self.starts = np.concatenate(([0], np.cumsum(self.numel)[:-1]))
+        self.filled = self.numel > 0
+
+    def profile(self, data, stats=None):
+        if stats is None:
+            stats = self.all_stats
+        data = np.asarray(data, dtype=float)
+        single = (data.ndim == 2)
+        if single:
+            data = data[np.newaxis]
+        n = data.shape[0]
+        nrad = self.nrad
+
+        # (n, npix) values, sorted by annulus
+        vals = data.reshape(n, -1)[:, self.pix]
+        # one set of bins per frame
+        bins = (self.ann + nrad * np.arange(n)[:, np.newaxis]).ravel()
+        numel = np.tile(self.numel, (n, 1)).astype(float)
+        empty = np.tile(~self.filled, (n, 1))
+
+        def bincount(weights):
+            return np.bincount(bins, weights=weights.ravel(),
+                               minlength=n * nrad).reshape(n, nrad)
+
+        def finish(res):
+            res[empty] = np.nan
+            if single:
+                return res[0]
+            return res
+
+        res = radialDat()
+        res.r = self.r
+
+        if ('mean' in stats) or ('std' in stats):
+            isnan = np.isnan(vals)
+            if isnan.any():
+                # nanmean, but std and the others see the NaN
+                res_mean = bincount(np.where(isnan, 0., vals)) / \
+                    bincount(~isnan * 1.)
+            else:
+                res_mean = bincount(vals) / numel
+            if 'mean' in stats:
+                res.mean = finish(res_mean.copy())
+            if 'std' in stats:
+                mean = bincount(vals) / numel
+                dev = vals - mean.ravel()[bins].reshape(vals.shape)
+                res.std = finish(np.sqrt(bincount(dev * dev) / numel))
+
+        if 'numel' in stats:
+            res.numel = finish(numel.copy())
+
+        if ('max' in stats) or ('min' in stats):
+            starts = self.starts[self.filled]
+            for stat, ufunc in (('max', np.maximum), ('min', np.minimum)):
+                if stat in stats:
+                    out = np.empty((n, nrad))
+                    out[:, self.filled] = ufunc.reduceat(vals, starts,
+                                                         axis=1)
+                    setattr(res, stat, finish(out))
+
+        if 'median' in stats:
+            # sort the values within each annulus (NaN sort last)
+            svals = np.empty_like(vals)
+            for k in range(n):
+                svals[k] = vals[k, np.lexsort((vals[k], self.ann))]
+            last = max(vals.shape[1] - 1, 0)
+            lo = np.minimum(self.starts + (self.numel - 1) // 2, last)
+            hi = np.minimum(self.starts + self.numel // 2, last)
+            med = 0.5 * (svals[:, lo] + svals[:, hi])
+            # like np.median, any NaN in the annulus gives NaN
+            hasnan = bincount(np.isnan(vals) * 1.) > 0
+            med[hasnan] = np.nan
+            res.median = finish(med)
+
+        return res
+
+
+# operators used by radial_data(), by their parameters
+_radial_profiles = {}
+
+
 def radial_data(data,
                 annulus_width=1,
                 working_mask=None,
@@ -304,86 +564,32 @@ def radial_data(data,
     # 2005/12/12 IJC: Removed decifact, changed name, wrote comments.
     # 2005/11/04 by Ian Crossfield at the Jet Propulsion Laboratory
 
-    import numpy as np
-
-    class radialDat:
-        """Empty object container.
-        """
-        def __init__(self):
-            self.mean = None
-            self.std = None
-            self.median = None
-            self.numel = None
-            self.max = None
-            self.min = None
-            self.r = None
-
-    #---------------------
-    # Set up input parameters
-    #---------------------
     data = np.array(data)
 
-    if working_mask == None:
-        working_mask = np.ones(data.shape, bool)
-
-    npix, npiy = data.shape
-    #print(npix, npiy)
-    try:
-        if x == None or y == None:
-            x1 = np.arange(-npix / 2., npix / 2.)
-            y1 = np.arange(-npiy / 2., npiy / 2.)
-            x, y = np.meshgrid(y1, x1)
-    except:
-        print("x and y provided")
-
-    r = abs(x + 1j * y)
-
-    if rmax == None:
-        rmax = r[working_mask].max()
-
-    #---------------------
-    # Prepare the data container
-    #---------------------
-    dr = np.abs([x[0, 0] - x[0, 1]]) * annulus_width
-    #print("test",annulus_width,dr, x[0,:])
-    radial = np.arange(rmax / dr) * dr + dr / 2.
-    nrad = len(radial)
-    radialdata = radialDat()
-    radialdata.mean = np.zeros(nrad)
-    radialdata.std = np.zeros(nrad)
-    radialdata.median = np.zeros(nrad)
-    radialdata.numel = np.zeros(nrad)
-    radialdata.max = np.zeros(nrad)
-    radialdata.min = np.zeros(nrad)
-    radialdata.r = radial
-
-    #---------------------
-    # Loop through the bins
-    #---------------------
-    for irad in range(nrad):  #= 1:numel(radial)
-        minrad = irad * dr
-        maxrad = minrad + dr
-        thisindex = (r >= minrad) * (r < maxrad) * working_mask
-        if not thisindex.ravel().any():
-            radialdata.mean[irad] = np.nan
-            radialdata.std[irad] = np.nan
-            radialdata.median[irad] = np.nan
-            radialdata.numel[irad] = np.nan
-            radialdata.max[irad] = np.nan
-            radialdata.min[irad] = np.nan
+    # the operator only depends on the coordinates, so it can be reused
+    # for other data when we made them
+    prof = key = None
+    if x is None or y is None:
+        if working_mask is not None:
+            working_mask = np.asarray(working_mask, bool)
+            key = (data.shape, annulus_width, rmax, working_mask.tobytes())
         else:
-            radialdata.mean[irad] = np.nanmean(data[thisindex])
-            radialdata.std[irad] = data[thisindex].std()
-            radialdata.median[irad] = np.median(data[thisindex])
-            radialdata.numel[irad] = data[thisindex].size
-            radialdata.max[irad] = data[thisindex].max()
-            radialdata.min[irad] = data[thisindex].min()
+            key = (data.shape, annulus_width, rmax, None)
+        prof = _radial_profiles.get(key)
 
-    #---------------------
-    # Return with data
-    #---------------------
+    if prof is None:
+        prof = RadialProfile(data.shape,
+                             annulus_width=annulus_width,
+                             working_mask=working_mask,
+                             x=x,
+                             y=y,
+                             rmax=rmax)
+        if key is not None:
+            if len(_radial_profiles) >= 32:
+                _radial_profiles.clear()
+            _radial_profiles[key] = prof
 
-    return radialdata
+    return prof.profile(data)
 
 
 # ========= FFT SHIFT ===================================
@@ -445,10 +651,7 @@ def fit_TwoD_Gaussian(img, xc, yc, rad, circ=False, fixrad=False):
                                        x_stddev=rad,
                                        y_stddev=rad,
                                        theta=0)
-    nx = img.shape[0]
-    ny = img.shape[1]
-
-    x, y = np.mgrid[:nx, :ny]
+    x, y = coord_grids(img.shape)
 
     gauss2_fit = fitter(model_init, x, y, img)
 
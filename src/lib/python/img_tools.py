@@ -17,6 +17,28 @@ should be included by all programs requiring them.
 Frantz.
 --------------------------------------------------------------------- '''
 
+# masks made by mkdisk() and mkbox(), by arguments (emptied when full)
+mask_cache = {}
+mask_cache_size = 256
+
+def _cached_mask(key, make):
+    ''' ------------------------------------------------------
+    Copy of the mask of the given key, made by make() the
+    first time.
+    ------------------------------------------------------ '''
+    try:
+        mask = mask_cache.get(key)
+    except TypeError:
+        # unhashable coordinates (arrays): not cached
+        return make()
+    if mask is None:
+        if len(mask_cache) >= mask_cache_size:
+            mask_cache.clear()
+        mask = make()
+        mask_cache[key] = mask
+    # callers are free to modify the mask they get
+    return mask.copy()
+
 def mkdisk(cs, c0, r0):
     ''' ------------------------------------------------------
     Create a circular mask centered on (x0,y0) in an array of
@@ -25,10 +47,11 @@ def mkdisk(cs, c0, r0):
     ------------------------------------------------------ '''
     (xs, ys) = cs
     (x0, y0) = c0
-    x,y = np.meshgrid(np.arange(xs)-x0, np.arange(ys)-y0)
-    dist = np.hypot(y,x)
-    mask = dist <= r0
-    return mask
+    def make():
+        x,y = np.meshgrid(np.arange(xs)-x0, np.arange(ys)-y0)
+        dist = np.hypot(y,x)
+        return dist <= r0
+    return _cached_mask(('disk', xs, ys, x0, y0, r0), make)
 
 def mkbox(cs, c0, cd):
     ''' ------------------------------------------------------
@@ -38,9 +61,10 @@ def mkbox(cs, c0, cd):
     (xs, ys) = cs
     (x0, y0) = c0
     (dx, dy) = cd
-    x,y = np.meshgrid(np.arange(xs), np.arange(ys))
-    mask = (x >= x0) * (x < x0+dx) * (y >= y0) * (y < y0+dy)
-    return mask
+    def make():
+        x,y = np.meshgrid(np.arange(xs), np.arange(ys))
+        return (x >= x0) * (x < x0+dx) * (y >= y0) * (y < y0+dy)
+    return _cached_mask(('box', xs, ys, x0, y0, dx, dy), make)
 
 def find_disk_center(img, diam=100):
     ''' ------------------------------------------------------
@@ -126,40 +150,141 @@ def find_psf_center(img, verbose=True, nbit=10):
 
     return (xc, yc)
 
-def locate_speckles(img, nspk=1, xr=5.0, nbit=20):
-    ''' --------------------------------
-    Returns two lists of x,y coordinates 
-    of speckles in the image.
-    parameters:
-    - img  : the image to be searched
-    - nspk : # of speckles to profile
-    - xr   : exclusion radius
-    -------------------------------- '''
-    temp = img.copy()        # to make sure we don't damage image
+def _disk_pixels(img, cx, cy, xr):
+    ''' --------------------------------------------------
+    Pixels within xr of each of the centers (cx, cy):
+    returns their x, y coordinates and values (0 outside
+    the disks and the image), as (ncenter, n, n) arrays.
+    -------------------------------------------------- '''
+    (ys, xs) = img.shape
+    r = int(np.ceil(xr))
+    dy, dx = np.mgrid[-r:r+1, -r:r+1]
+    gx = np.round(cx).astype(int)[:,None,None] + dx
+    gy = np.round(cy).astype(int)[:,None,None] + dy
+    inside = (gx >= 0) & (gx < xs) & (gy >= 0) & (gy < ys) & \
+        (np.hypot(gx - cx[:,None,None], gy - cy[:,None,None]) <= xr)
+    vals = img[np.clip(gy, 0, ys-1), np.clip(gx, 0, xs-1)] * inside
+    return (gx, gy, vals, inside)
+
+def _zero_disk(img, cx, cy, r0):
+    ''' --------------------------------------------------
+    img *= (1.0 - mkdisk(.., (cx, cy), r0)), in place, on
+    the pixels around the disk only.
+    -------------------------------------------------- '''
+    if not (np.isfinite(cx) and np.isfinite(cy)):
+        return # an empty disk
+    (ys, xs) = img.shape
+    x0, x1 = max(int(np.floor(cx - r0)), 0), min(int(np.ceil(cx + r0)) + 1, xs)
+    y0, y1 = max(int(np.floor(cy - r0)), 0), min(int(np.ceil(cy + r0)) + 1, ys)
+    if x1 <= x0 or y1 <= y0:
+        return
+    x,y = np.meshgrid(np.arange(x0, x1)-cx, np.arange(y0, y1)-cy)
+    sub = img[y0:y1, x0:x1]
+    sub[np.hypot(y,x) <= r0] *= 0.0
+
+def _disk_center(img, px, py, xr, nbit, size, finite=True):
+    ''' --------------------------------------------------
+    find_psf_center(mkdisk(.., (px, py), xr) * img, False,
+    nbit), with size the image size used for its centroid
+    windows.  Everything outside the disk is 0, so this is
+    computed on the pixels around the disk only, unless the
+    disk covers half of the image or img is not finite
+    (then the background is not 0).
+    -------------------------------------------------- '''
+    (sy, sx) = img.shape
+    r = int(np.ceil(xr)) + 2 # the 3x3 median filter sees 1 pixel further
+    (x0c, y0c) = (max(px - r, 0), max(py - r, 0))
+    (x1c, y1c) = (min(px + r + 1, sx), min(py + r + 1, sy))
+    disk = mkdisk((x1c-x0c, y1c-y0c), (px-x0c, py-y0c), xr)
+    if finite and 2 * (sx * sy - disk.sum()) > sx * sy:
+        temp = disk * img[y0c:y1c, x0c:x1c]
+    else:
+        (x0c, y0c, x1c, y1c) = (0, 0, sx, sy)
+        temp = mkdisk((sx, sy), (px, py), xr) * img
+        temp -= np.median(temp)  # background level
     mfilt = medfilt(temp, 3) # median filtered, kernel size = 3
-    (ys, xs) = mfilt.shape   # size of "image"
-    spkx, spky = [], []      # speckle coordinates
-    ni = 0                   # number of identified speckles
-    
-    while (ni < nspk):
+    wgt = mfilt * (mfilt > 0)
+    (gx, gy) = (np.arange(x0c, x1c), np.arange(y0c, y1c))
+
+    xc, yc = sx/2, sy/2      # first estimate for psf center
+
+    for it in xrange(nbit):
+        sz = size/2/(1.0+(0.1*size/2*it/(4*nbit)))
+        x0 = np.max([int(0.5 + xc - sz), 0])
+        y0 = np.max([int(0.5 + yc - sz), 0])
+        x1 = np.min([int(0.5 + xc + sz), sx])
+        y1 = np.min([int(0.5 + yc + sz), sy])
+        # the part of the window in the cropped image
+        (x0, y0) = (max(x0 - x0c, 0), max(y0 - y0c, 0))
+        (x1, y1) = (max(x1 - x0c, 0), max(y1 - y0c, 0))
+
+        profx = wgt[y0:y1, x0:x1].sum(axis=0)
+        profy = wgt[y0:y1, x0:x1].sum(axis=1)
+
+        xc = (profx*gx[x0:x1]).sum() / profx.sum()
+        yc = (profy*gy[y0:y1]).sum() / profy.sum()
+
+    return (xc, yc)
+
+def find_peaks(img, nspk=1, xr=5.0, nbit=0, size=None):
+    ''' --------------------------------------------------
+    Returns the x,y coordinates (arrays) of nspk speckles
+    of img, brightest first, found one at a time: the
+    brightest pixel, refined if nbit > 0 to the center
+    find_psf_center finds within xr of it, after which the
+    disk of radius xr around that position is zeroed.
+
+    Only the pixels around each disk are touched, instead
+    of full-frame masks and filters: the positions are the
+    ones locate_speckles always found.  size is the image
+    size find_psf_center uses for its centroid windows
+    (the largest dimension of img by default).
+    -------------------------------------------------- '''
+    mfilt = np.array(img, dtype=float) # not to damage img
+    (ys, xs) = mfilt.shape
+    if size is None:
+        size = np.max([xs, ys])
+    finite = np.isfinite(mfilt).all()
+
+    spkx, spky = [], []
+    for ni in xrange(nspk):
         # locate maximum in image
-        x1 = mfilt.argmax() %  xs
-        y1 = mfilt.argmax() // xs
+        i = mfilt.argmax()
+        (x1, y1) = (i % xs, i // xs)
         # fine-tune coordinates
-        m1 = mkdisk((xs, ys), (x1, y1), xr)
         if nbit == 0:
             (x11, y11) = (x1, y1)
-            mfilt *= (1.0-m1)
         else:
-            (x11, y11) = find_psf_center((m1) * mfilt, False, nbit)
-            mfilt *= (1.0 - mkdisk((xs, ys), (x11, y11), xr))
-
-        # increment counter of speckles
+            (x11, y11) = _disk_center(mfilt, x1, y1, xr, nbit, size, finite)
+        _zero_disk(mfilt, x11, y11, xr)
         spkx.append(x11)
         spky.append(y11)
-        ni += 1
+    return (np.array(spkx), np.array(spky))
 
-    return (spkx, spky)
+def disk_means(img, cx, cy, xr=5.0):
+    ''' --------------------------------------------------
+    Mean of img within xr of each of the (cx, cy) points
+    (the same as np.mean(img[mkdisk(.., (x, y), xr)]))
+    -------------------------------------------------- '''
+    cx = np.atleast_1d(np.asarray(cx, dtype=float))
+    cy = np.atleast_1d(np.asarray(cy, dtype=float))
+    (gx, gy, vals, inside) = _disk_pixels(np.asarray(img, dtype=float),
+                                          cx, cy, xr)
+    return vals.sum(axis=(1,2)) / inside.sum(axis=(1,2))
+
+def locate_speckles(img, nspk=1, xr=5.0, nbit=20):
+    ''' --------------------------------
+    Returns two lists of x,y coordinates 
+    of speckles in the image.
+    parameters:
+    - img  : the image to be searched
+    - nspk : # of speckles to profile
+    - xr   : exclusion radius
+    - nbit : # of centroid refinements
+    -------------------------------- '''
+    mfilt = medfilt(img.copy(), 3) # median filtered, kernel size = 3
+    (spkx, spky) = find_peaks(mfilt, nspk, xr, nbit)
+    return (spkx.tolist(), spky.tolist())
 
 def locate_speckles0(img, nspk=1, xr=5.0, nbit=20):
     mfilt = medfilt(img, 3)
@@ -1,13 +1,36 @@
 # scexao logging function
 #!/usr/bin/env python
 
+import os
+import sys
+import time
+import fcntl
+import atexit
+import threading
+from datetime import datetime
+
+try:
+    import Queue as _queue
+except ImportError:
+    import queue as _queue
 
 from subprocess import Popen as _subprocessPopen
 
+logroot = "/media/data"
+
+# lines waiting to be written by the logging thread:
+# (date folder, system_keyword, line, checkfolder)
+_lines = _queue.Queue()
+# log files kept open by the logging thread, by (date folder, system_keyword)
+_files = {}
+_thread = None
+_thread_lock = threading.Lock()
+_pid = None
+
 def logit(system_keyword, status, checkfolder=True):
     """
     This function logs ''status'' at the end of ''/media/data/YYYYMMDD/logging/system_keyword.log'', together with a timestamp
-    
+
     inputs:
       **system_keyword** (string <= 10 char) is refering to the system you are dealing with. It is used to create/update the logging file ''system_keyword.log''
       **status** (string) is whatever you want to log about the system referred by ''system_keyword''
@@ -15,9 +38,30 @@ def logit(system_keyword, status, checkfolder=True):
     returns: nothing
 
     Important note:
-      This logging system cannot log faster than 230Hz when ''checkfolder'' is True, and 280Hz when ''checkfolder'' is False.
+      The line is timestamped when logit is called and written to the file
+      shortly after by a background thread, which keeps the log files of
+      the day open.  Lines from several processes are not mixed up.
+      Call flush() to wait until everything logged so far is written.
       Apostrophe (') will be automatically deleted from ''statuts''
     """
+    now = datetime.utcnow()
+    logtime = now.strftime('%Y/%m/%d %H:%M:%S.') + '%06d000' % (now.microsecond,)
+    line = "%s %-10s %s\n" % (logtime, str(system_keyword), str(status).replace("'",""))
+    _start()
+    _lines.put((now.strftime('%Y%m%d'), str(system_keyword), line, checkfolder))
+
+def flush():
+    """
+    Waits until all the lines logged so far are written to their files
+    """
+    if _thread is not None and _thread.is_alive():
+        _lines.join()
+
+def logit_dolog(system_keyword, status, checkfolder=True):
+    """
+    Same as logit, through the ''dolog'' script, in a separate process for every line
+    (this cannot log faster than 230Hz when ''checkfolder'' is True, and 280Hz when it is False)
+    """
     if checkfolder:
         # max frequency of 230Hz
         dummy = _subprocessPopen("/home/scexao/bin/dolog "+str(system_keyword)+" '"+str(status).replace("'","")+"'", shell=True)
@@ -25,3 +69,94 @@ def logit(system_keyword, status, checkfolder=True):
         # max frequency of 280Hz, will return an error if date-folder doesn't exist
         dummy = _subprocessPopen("/home/scexao/bin/dolog -s "+str(system_keyword)+" '"+str(status).replace("'","")+"'", shell=True)
 
+# ----------------------------------------------------------------------
+#                          logging thread
+# ----------------------------------------------------------------------
+
+def _start():
+    # starts the logging thread, once per process (again after a fork)
+    global _thread, _pid
+    if _thread is not None and _pid == os.getpid():
+        return
+    with _thread_lock:
+        if _thread is not None and _pid == os.getpid():
+            return
+        if _pid is not None:
+            # forked: the parent's thread and files are not ours
+            _files.clear()
+        _pid = os.getpid()
+        _thread = threading.Thread(target=_run, name="logit")
+        _thread.daemon = True
+        _thread.start()
+
+def _run():
+    while True:
+        batch = [_lines.get()]
+        # take everything that is already waiting
+        try:
+            while True:
+                batch.append(_lines.get_nowait())
+        except _queue.Empty:
+            pass
+        try:
+            _write(batch)
+        except Exception as e:
+            sys.stderr.write("logit: %s\n" % (e,))
+        for i in range(len(batch)):
+            _lines.task_done()
+
+def _write(batch):
+    # lines of the same file are written together, in order
+    groups = {}
+    order = []
+    for (day, keyword, line, checkfolder) in batch:
+        key = (day, keyword)
+        if key not in groups:
+            groups[key] = ([], checkfolder)
+            order.append(key)
+        groups[key][0].append(line)
+
+    # close the files of the previous days
+    days = set([key[0] for key in order])
+    for key in list(_files.keys()):
+        if key[0] not in days and key[0] < max(days):
+            os.close(_files.pop(key))
+
+    for key in order:
+        lines, checkfolder = groups[key]
+        try:
+            fd = _open(key, checkfolder)
+        except OSError as e:
+            sys.stderr.write("logit: cannot open log %s: %s\n" % (key[1], e))
+            continue
+        data = ''.join(lines)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        # one locked write per batch, so that other processes logging to the
+        # same file cannot interleave with it
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+def _open(key, checkfolder):
+    fd = _files.get(key)
+    if fd is not None:
+        return fd
+    (day, keyword) = key
+    logdir = "%s/%s/logging" % (logroot, day)
+    if checkfolder and not os.path.isdir(logdir):
+        try:
+            os.makedirs(logdir)
+        except OSError:
+            # created by someone else in the meantime
+            if not os.path.isdir(logdir):
+                raise
+    fd = os.open("%s/%s.log" % (logdir, keyword),
+                 os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    _files[key] = fd
+    return fd
+
+atexit.register(flush)
@@ -62,7 +62,11 @@ class micronix(object):
             for i in range(nparam):
                 exec("self.param%d.append(sparam[i])" % (i,), globals(), locals())
 
-        if args == []:
+        if args is None:
+            # used as a driver (e.g. by moveplan), no command to run
+            self.slots = slots
+
+        elif args == []:
             self.usage()
             
         else:
@@ -324,6 +328,21 @@ class micronix(object):
         except:
             print("CANNOT MOVE AXIS")
     
+    def wait(self, axisid, axisname, target, delay=0.2, timeout=0):
+        # waits until the axis reaches target, or stops moving, and returns
+        # its position (gives up with an IOError after timeout seconds, if
+        # not 0)
+        t0 = time.time()
+        pos0 = -1000.
+        pos = self.status(axisid, axisname)
+        while pos0 != pos and abs(pos - target) > 1e-3:
+            if timeout and time.time()-t0 > timeout:
+                raise IOError("%s_%s still moving after %.1f s" % (self.micname, axisname, timeout))
+            time.sleep(delay)
+            pos0 = pos
+            pos = self.status(axisid, axisname)
+        return pos
+
     def close(self):
         time.sleep(0.2)
         self.s.close()
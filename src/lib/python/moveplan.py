@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+# =====================================================================
+#  Move plans: moves several devices (conex, zaber and micronix stages)
+#  to their slots or positions at the same time.
+#
+#  The axes are grouped by serial bus (a conex, a zaber chain, a micronix
+#  controller).  Each bus gets a thread that sends the moves of all its
+#  axes, then waits for each of them to stop; the buses are independent,
+#  so the motions overlap.  For example:
+#
+#      plan = moveplan()
+#      plan.load("src_fib")
+#      plan.load("oap1")
+#      plan.slot("src_fib", "out")
+#      plan.slot("oap1", "ao")
+#      plan.run()
+#
+#  run() waits for all the axes, and raises an IOError listing the ones
+#  that failed or timed out, once the others are done.
+# =====================================================================
+
+import os
+import sys
+import ast
+import time
+import threading
+import subprocess
+
+home = os.getenv('HOME')
+sys.path.append(home+'/src/lib/python/')
+import logit #Custom logging library
+import devserver #Device server, or the drivers if it is not running
+
+scriptdir = home+"/bin/devices/"
+
+# =====================================================================
+
+def read_script(name):
+    # device definition of the bin/devices/<name> script: the values of
+    # its top-level assignments (devname, conexids, ...), the class it
+    # uses ('devices' or 'micronix') and its color_st argument.  The
+    # script is parsed, not run.
+    filename = scriptdir+name
+    tree = ast.parse(open(filename).read(), filename)
+    res = {'kind': None, 'color_st': False}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and \
+           isinstance(node.targets[0], ast.Name):
+            try:
+                res[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+        elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) \
+             and isinstance(node.value.func, ast.Name) and \
+             node.value.func.id in ('devices', 'micronix'):
+            res['kind'] = node.value.func.id
+            for kw in node.value.keywords:
+                if kw.arg == 'color_st':
+                    res['color_st'] = ast.literal_eval(kw.value)
+    if res['kind'] is None:
+        raise ValueError("%s is not a devices or micronix script" % (name,))
+    return res
+
+# =====================================================================
+
+class axis(object):
+    # one stage of a plan, and where it should go
+    def __init__(self, kind, bus, label, target, timeout, idn=None):
+        self.kind = kind        # 'conex', 'zaber' or 'micronix'
+        self.bus = bus          # conex port, zaber chain or micronix port
+        self.label = label      # status name of the stage
+        self.target = target
+        self.timeout = timeout
+        self.idn = idn          # zaber/micronix axis on the bus
+        self.pos = None
+        self.error = None
+
+class moveplan(object):
+
+    def __init__(self, timeout=60., delay=0.2):
+        self.timeout = timeout  # default timeout of each axis (sec)
+        self.delay = delay      # between two position readings (sec)
+        self.devs = {}          # devices, by name
+        self.axes = []
+        # (device, slot) of the slot moves, to update their status
+        self.slots = []
+
+    # -----------------------------------------------------------------
+    def add_device(self, devname, conexids=[], conexnames=[], zaberchain="", zaberids=[], zabernames=[], defpos=[], color_st=False):
+        # same arguments as devices.devices
+        from devices import devices
+        dev = devices(devname, conexids, conexnames, zaberchain, zaberids, zabernames, None, defpos=defpos, color_st=color_st)
+        dev.kind = 'devices'
+        self.devs[devname] = dev
+        return dev
+
+    def add_micronix(self, micname, micid, axesids, axesnames, defpos=[], color_st=False):
+        # same arguments as micronix.micronix
+        from micronix import micronix
+        dev = micronix(micname, micid, axesids, axesnames, None, defpos=defpos, color_st=color_st)
+        dev.kind = 'micronix'
+        dev.devname = micname
+        self.devs[micname] = dev
+        return dev
+
+    def load(self, name):
+        # adds the device defined by the bin/devices/<name> script
+        d = read_script(name)
+        if d['kind'] == 'micronix':
+            return self.add_micronix(d['micname'], d['micid'], d['axesids'], d['axesnames'], d.get('defpos', []), d['color_st'])
+        return self.add_device(d['devname'], d.get('conexids', []), d.get('conexnames', []), d.get('zaberchain', ""), d.get('zaberids', []), d.get('zabernames', []), d.get('defpos', []), d['color_st'])
+
+    # -----------------------------------------------------------------
+    def _axes(self, dev):
+        # (kind, bus, label, idn, name) of the axes of a device, in the
+        # order of the columns of its conf table
+        res = []
+        if dev.kind == 'micronix':
+            for i in range(len(dev.axesnames)):
+                res.append(('micronix', dev.micid, dev.micname+"_"+dev.axesnames[i], dev.axesids[i], dev.axesnames[i]))
+            return res
+        for i in range(len(dev.conexnames)):
+            label = dev.devname if dev.nbdev == 1 else dev.devname+'_'+dev.conexnames[i]
+            res.append(('conex', "/dev/serial/by-id/"+dev.conexids[i], label, None, dev.conexnames[i]))
+        for i in range(len(dev.zabernames)):
+            label = dev.devname if dev.nbdev == 1 else dev.devname+'_'+dev.zabernames[i]
+            res.append(('zaber', dev.zaberchain, label, dev.zaberids[i], dev.zabernames[i]))
+        return res
+
+    def slot(self, devname, slot, axes=None, timeout=None):
+        # moves (the given axes of) a device to a slot of its conf table:
+        # a slot number (1 to nslots) or one of its defpos names
+        dev = self.devs[devname]
+        if not isinstance(slot, int):
+            slot = dev.defpos.index(str(slot).lower())+1
+        if not (1 <= slot <= dev.nslots):
+            raise ValueError("%s only has %d positions" % (devname, dev.nslots))
+        sparam = dev.slots[slot-1].split(';')
+        for (i, (kind, bus, label, idn, name)) in enumerate(self._axes(dev)):
+            if axes is not None and name not in axes:
+                continue
+            pos = float(sparam[i+2])
+            if kind == 'zaber':
+                # zaber axes at 0 are not used in this slot
+                if int(pos) <= 0:
+                    continue
+                pos = int(pos)
+            self.axes.append(axis(kind, bus, label, pos, timeout or self.timeout, idn))
+        if axes is None:
+            self.slots.append((dev, slot))
+
+    def goto(self, devname, axisname, pos, timeout=None):
+        # moves one axis of a device to an absolute position
+        dev = self.devs[devname]
+        for (kind, bus, label, idn, name) in self._axes(dev):
+            if name == axisname or (dev.kind == 'devices' and dev.nbdev == 1):
+                if kind == 'zaber':
+                    pos = int(pos)
+                self.axes.append(axis(kind, bus, label, pos, timeout or self.timeout, idn))
+                return
+        raise ValueError("%s has no axis %s" % (devname, axisname))
+
+    # -----------------------------------------------------------------
+    def buses(self):
+        # the axes grouped by bus, in the order they were added
+        res = {}
+        order = []
+        for a in self.axes:
+            key = (a.kind, a.bus)
+            if key not in res:
+                res[key] = []
+                order.append(key)
+            res[key].append(a)
+        return [(key, res[key]) for key in order]
+
+    def _run_bus(self, key, axes):
+        (kind, bus) = key
+        try:
+            if kind == 'conex':
+                con = devserver.conex()
+                if not con.open(bus):
+                    raise IOError("Conex %s is not connected" % (bus,))
+                try:
+                    for a in axes:
+                        con.move(a.target, a.label, log=False)
+                    for a in axes:
+                        a.pos = con.wait(a.label, self.delay, a.timeout)
+                finally:
+                    con.close()
+
+            elif kind == 'zaber':
+                zab = devserver.zaber()
+                try:
+                    zab.open(bus)
+                except SystemExit:
+                    raise IOError("Zaber chain %s not connected" % (bus,))
+                try:
+                    for a in axes:
+                        zab.move(a.idn, a.target, a.label, log=False)
+                    for a in axes:
+                        a.pos = zab.wait(a.idn, a.label, self.delay, a.timeout)
+                finally:
+                    zab.close()
+
+            else:
+                mic = [d for d in self.devs.values() if d.kind == 'micronix' and d.micid == bus][0]
+                try:
+                    mic.open(mic.micid)
+                except SystemExit:
+                    raise IOError("Micronix %s is not connected" % (bus,))
+                try:
+                    for a in axes:
+                        mic.goto(a.idn, a.target)
+                    for a in axes:
+                        a.pos = mic.wait(a.idn, a.label[len(mic.micname)+1:], a.target, self.delay, a.timeout)
+                finally:
+                    mic.close()
+
+        except Exception as e:
+            for a in axes:
+                if a.pos is None:
+                    a.error = str(e)
+
+    def run(self):
+        # runs the plan, and returns the final positions by status name
+        t0 = time.time()
+        threads = []
+        for (key, axes) in self.buses():
+            t = threading.Thread(target=self._run_bus, args=(key, axes))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+        failed = [a for a in self.axes if a.error is not None]
+        bad = set([a.label for a in failed])
+        for (dev, slot) in self.slots:
+            labels = [ax[2] for ax in self._axes(dev)]
+            if bad.intersection(labels):
+                subprocess.call([home+'/bin/scexaostatus', 'set', dev.devname+'_st', 'UNKNOWN', '3'])
+                continue
+            if dev.color_st:
+                exec("subprocess.call([home+'/bin/scexaostatus', 'set', dev.devname+'_st', dev.param1[slot-1][:16], dev.param%d[slot-1]])" % (dev.nend,), globals(), locals())
+            else:
+                subprocess.call([home+"/bin/scexaostatus", "set", dev.devname+"_st", dev.param1[slot-1][:16]])
+            logit.logit(dev.devname, 'moved_to_slot_'+str(slot))
+
+        print("%d axes on %d buses moved in %.1f s" % (len(self.axes), len(threads), time.time()-t0))
+        if failed:
+            raise IOError("; ".join(["%s: %s" % (a.label, a.error) for a in failed]))
+        return dict([(a.label, a.pos) for a in self.axes])
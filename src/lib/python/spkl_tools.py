@@ -3,6 +3,8 @@ import sys
 import numpy as np
 
 import pickle
+import Queue
+import threading
 from numpy.linalg   import solve
 from scipy.optimize import fmin
 from scipy.optimize import leastsq
@@ -275,3 +277,101 @@ def CAsolver1(Iarr, a0, verbose=False):
 
     np.save(cur_file, (Iarr, a0, phi, plsq[0]))#[a0, Iarr, phi, plsq[0]])
     return soluce
+
+# ======================================================================
+# ======================================================================
+
+def CAsolve_all(Iarrs, a0s, recorder=None):
+    ''' ---------------------------------------------
+    Quick complex amplitude solver (as CAsolver) for
+    all the speckles at once.
+
+    - Iarrs: (nspk, nphi+1) array: reference flux and
+             flux for each probe phase, per speckle
+    - a0s  : probe amplitude of each speckle
+    - recorder: optional CArecorder to save the data
+
+    Returns: (nspk, 3) array of (a1, ph1, offset)
+    --------------------------------------------- '''
+    Iarrs = np.atleast_2d(np.asarray(Iarrs, dtype=float))
+    a0s   = np.asarray(a0s, dtype=float) * np.ones(Iarrs.shape[0])
+    nphi  = Iarrs.shape[1] - 1
+
+    phi    = 2*np.pi * np.arange(nphi) / float(nphi)
+    crit   = np.dot(Iarrs[:,1:], np.exp(1j * phi)) # all speckles
+
+    ph1    = np.angle(crit)
+    AA     = 2.0 * np.abs(crit) / 30
+    offset = np.mean(Iarrs[:,1:], axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma = AA / offset
+        a11 = a0s * (1 + np.sqrt(1-gamma**2)) / gamma
+        a12 = a0s * (1 - np.sqrt(1-gamma**2)) / gamma
+        a1 = np.minimum(a11, a12)
+        a1[np.isnan(a1)] = 0.0
+        koeff = AA / (2 * a0s * a1)
+
+    soluce = np.array([a1, ph1, offset]).T
+
+    for ii in range(Iarrs.shape[0]):
+        print("c=%.3f, a0=%.3f, a1=%.3f, AA = %.3f, ph1 = %.3f, offset = %.3f" % 
+              (koeff[ii], a0s[ii], a1[ii], AA[ii], ph1[ii], offset[ii]))
+        if recorder is not None:
+            recorder.save("current_%02d" % (ii,),
+                          (Iarrs[ii], a0s[ii], phi, list(soluce[ii])))
+    return soluce
+
+# ======================================================================
+# ======================================================================
+
+def spk_masks((xs, ys), pxs, pys, irad):
+    ''' ---------------------------------------------
+    (nspk, ys, xs) stack of the disks of radius irad
+    centered on each speckle (same as mkdisk).
+    --------------------------------------------- '''
+    pxs = np.atleast_1d(np.asarray(pxs, dtype=float))[:,None,None]
+    pys = np.atleast_1d(np.asarray(pys, dtype=float))[:,None,None]
+    x, y = np.arange(xs)[None,None,:], np.arange(ys)[None,:,None]
+    return np.hypot(y - pys, x - pxs) <= irad
+
+def spk_fluxes(frames, masks):
+    ''' ---------------------------------------------
+    Mean flux of each frame inside each mask.
+    Returns a (nspk, nframes) array.
+    --------------------------------------------- '''
+    frames = np.asarray(frames, dtype=float)
+    frames = frames.reshape(frames.shape[0], -1)
+    masks  = masks.reshape(masks.shape[0], -1).astype(float)
+    return np.dot(masks, frames.T) / masks.sum(axis=1)[:,None]
+
+# ======================================================================
+# ======================================================================
+
+class CArecorder():
+    ''' ---------------------------------------------
+    Saves the speckle probe data (np.save) in a
+    background thread, so that the speckle nulling
+    loop does not wait for the disk.
+    --------------------------------------------- '''
+    def __init__(self, savedir=auxdir):
+        self.savedir = savedir
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save(self, name, data):
+        self.queue.put((name, data))
+
+    def flush(self):
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            (name, data) = self.queue.get()
+            try:
+                np.save(self.savedir+name, data)
+            except Exception as e:
+                print("CArecorder: %s" % (e,))
+            self.queue.task_done()
@@ -3,8 +3,16 @@
 import numpy as np
 import numpy as np
 import numpy.fft as nfft
+from numpy.lib.stride_tricks import as_strided
 import math as m
 import sys
+import time
+import frame_wait
+
+# frequency axes and windows used by the PSDs, by (npoints, fsamp) and
+# npoints, so they are only computed once
+_freqs = {}
+_windows = {}
 
 # ======= MAKE RAMP =====================================================
 # =======================================================================
@@ -53,6 +61,21 @@ def make_ramp(*args):
     
     return ramp
 
+def psd_freq(npoints, fsamp):
+    # Frequency axis of the PSD of npoints samples at fsamp (see calc_psd)
+    key = (npoints, fsamp)
+    if key not in _freqs:
+        _freqs[key] = make_ramp(fsamp/npoints, fsamp/2., npoints//2, [], 0)
+    return _freqs[key]
+
+def psd_window(npoints):
+    # Hanning window of npoints, normalized to a mean of 1
+    if npoints not in _windows:
+        window = np.hanning(npoints)
+        window /= np.mean(window)
+        _windows[npoints] = window
+    return _windows[npoints]
+
 # ====== CALCULATE PSD ==================================================
 # =======================================================================
 class Returnpsd(object):
@@ -71,31 +94,80 @@ def calc_psd(x, fsamp):
     #      psd: PSD of the time sequence.
     #   cumint: cumulative integral of the time sequence.
     
-    s = np.shape(x)
-    npoints = s[0]
-    if len(s) == 2:
-        ndim = s[1]
-    else:
-        x = np.reshape(x, [npoints, 1])
-        ndim = 1
-    
-    freq = make_ramp(fsamp/npoints, fsamp/2., npoints//2, [], 0)
+    npoints = np.shape(x)[0]
+    freq = psd_freq(npoints, fsamp)
     
-    psd = np.zeros([npoints//2, ndim])
-    cumint = np.zeros([npoints//2, ndim])
-    #window = np.hanning(npoints)
-    #window /= np.mean(window)
-    for i in range(ndim):
-        fftxx = nfft.fft(np.squeeze(x[:, i]))/npoints#*window)/npoints
-        psdxx = abs(fftxx)**2
-        psd[:, i] = psdxx[0:npoints//2]
-        cumint[1:npoints//2, i] = 2*np.cumsum(np.squeeze(psd[1:npoints//2, i]))
+    # all the dimensions in one FFT
+    psd = segment_psd(x, axis=0)
+    cumint = psd_cumint(psd, axis=0)
     
     psd = np.squeeze(psd)
     cumint = np.squeeze(cumint)
     
     return Returnpsd(freq, psd, cumint)
 
+def segment_psd(x, axis=-1, window=None):
+    # PSD of the time sequences along axis of x, as in calc_psd: the first
+    # npoints//2 bins of |FFT/npoints|^2, npoints being the length of the
+    # sequences.  If window is given, the sequences are multiplied by it.
+    x = np.asarray(x, dtype=float)
+    npoints = x.shape[axis]
+    if window is not None:
+        shape = [1] * x.ndim
+        shape[axis] = npoints
+        x = x * np.reshape(window, shape)
+    fftxx = nfft.rfft(x, axis=axis)
+    psd = np.take(fftxx, np.arange(npoints//2), axis=axis)
+    psd = (psd.real**2 + psd.imag**2) / float(npoints)**2
+    return psd
+
+def psd_cumint(psd, axis=-1):
+    # Cumulative integral of a PSD along axis, as in calc_psd
+    cumint = np.zeros_like(psd)
+    psd = np.moveaxis(psd, axis, 0)
+    out = np.moveaxis(cumint, axis, 0)
+    np.cumsum(psd[1:], axis=0, out=out[1:])
+    out[1:] *= 2
+    return cumint
+
+def segments(signal, npoints, nshift):
+    # View of the windows of npoints samples of signal (along its first
+    # axis), every nshift samples: (nseg, npoints, ...).  No copy is made,
+    # so the windows must not be written to.
+    signal = np.asarray(signal)
+    nseg = (signal.shape[0]-npoints)//nshift+1
+    if nseg < 1:
+        return np.empty((0, npoints) + signal.shape[1:], dtype=signal.dtype)
+    strides = (signal.strides[0]*nshift,) + signal.strides
+    return as_strided(signal, shape=(nseg, npoints) + signal.shape[1:],
+                      strides=strides)
+
+def welch_psd(signal, npoints, nshift, fsamp, average=True):
+    # welch_psd - PSD of a signal on overlapping Hanning-windowed segments.
+    # PURPOSE:
+    # This function computes the PSD and cumulative integral of the windows
+    # of npoints samples of signal, every nshift samples, in one FFT for all
+    # the windows and dimensions of signal.
+    # INPUTS:
+    #   signal: time sequence(s) to analyze, (ntot,) or (ntot, ndim)
+    #  npoints: number of points of the windows
+    #   nshift: number of points between the start of two windows
+    #    fsamp: sampling frequency
+    #  average: OPTIONAL if True (default) returns the PSD averaged over
+    #           the windows, otherwise the PSD of each window (first axis)
+    # OUTPUTS:
+    #   Returnpsd with freq, psd and cumint
+    segs = segments(signal, npoints, nshift)
+    if segs.shape[0] == 0:
+        raise ValueError("signal shorter than one window")
+    psd = segment_psd(segs, axis=1, window=psd_window(npoints))
+    if average:
+        psd = np.mean(psd, axis=0)
+        cumint = psd_cumint(psd, axis=0)
+    else:
+        cumint = psd_cumint(psd, axis=1)
+    return Returnpsd(psd_freq(npoints, fsamp), psd, cumint)
+
 # ========== PSD2D ===============================================
 # ================================================================
 class Returnpsd2d(object):
@@ -109,16 +181,9 @@ def psd2d(signal, npoints, nshift, fsamp):
     ntot = len(signal)
     npsd = (ntot-npoints)//nshift+1
     
-    window = np.hanning(npoints)
-    window /= np.mean(window)
-
-    psd_2d = np.zeros((npsd, int(npoints/2)))
-    cumint_2d = np.zeros((npsd, int(npoints/2)))
-    for i in range(npsd):
-        sig2 = signal[i*nshift:i*nshift+npoints]*window
-        res_psd = calc_psd(sig2, fsamp)
-        psd_2d[i,:] = res_psd.psd
-        cumint_2d[i,:] = res_psd.cumint
+    res_psd = welch_psd(signal, npoints, nshift, fsamp, average=False)
+    psd_2d = res_psd.psd
+    cumint_2d = res_psd.cumint
     
     freq = res_psd.freq
     time = make_ramp(0, npsd*nshift/fsamp, npsd)
@@ -149,28 +214,150 @@ def psdrad(signal, npoints, nshift, nangle, fsamp):
             sys.exit()
         ntot = s[0]
     
-    freq = make_ramp(fsamp/npoints, fsamp/2., npoints//2)
-    
-    psd_rad = np.zeros([nangle, npoints//2])
-    cumint_rad = np.zeros([nangle, npoints//2])
-    window = np.hanning(npoints)
-    window /= np.mean(window)
-    nbfft = (ntot-npoints)//nshift+1
-    ffttemp = np.zeros((npoints, nbfft, 2), dtype=np.complex64)
-    for k in range(nbfft):
-        for i in range(2):
-            ffttemp[:,k,i] = nfft.fft(np.squeeze(signal[k*nshift:k*nshift+npoints, i])*window)/npoints
-    #fftxx = np.mean(ffttemp[:,:,0], axis=1)
-    #fftyy = np.mean(ffttemp[:,:,1], axis=1)
+    freq = psd_freq(npoints, fsamp)
+    
+    # FFT of all the windows of both axes at once
+    segs = segments(signal, npoints, nshift)
+    fftxy = nfft.rfft(segs*psd_window(npoints)[:,np.newaxis], axis=1)
+    fftxy = fftxy[:,:npoints//2]/npoints
+    fftxx = fftxy[:,:,0]
+    fftyy = fftxy[:,:,1]
+    # |x cos(a) + y sin(a)|^2 averaged over the windows, for every angle a,
+    # from the averaged auto- and cross-spectra of x and y
+    sxx = np.mean(fftxx.real**2+fftxx.imag**2, axis=0)
+    syy = np.mean(fftyy.real**2+fftyy.imag**2, axis=0)
+    sxy = np.mean((fftxx*np.conj(fftyy)).real, axis=0)
     angles = make_ramp(0, 180, nangle)
-    for k in range(nangle):
-        angle = angles[k]/180.*m.pi
-        fftangle = ffttemp[:,:,0]*m.cos(angle)+ffttemp[:,:,1]*m.sin(angle)
-        psdangle = abs(fftangle)**2
-        psd_rad[k,:] = np.mean(psdangle, axis=1)[0:npoints//2]
-        cumint_rad[k,1:npoints//2] = 2*np.cumsum(np.squeeze(psd_rad[k,1:npoints//2]))
+    cosa = np.cos(angles/180.*m.pi)[:,np.newaxis]
+    sina = np.sin(angles/180.*m.pi)[:,np.newaxis]
+    psd_rad = cosa**2*sxx + sina**2*syy + 2*cosa*sina*sxy
+    cumint_rad = psd_cumint(psd_rad, axis=1)
 
     X,Y = np.meshgrid(freq, angles)
     
     return Returnpsdrad(X, Y, psd_rad, cumint_rad)
 
+
+# ========== STREAMING PSD ========================================
+# ================================================================
+class StreamingPSD(object):
+    # Averaged PSD of a signal that arrives a few samples at a time (e.g.
+    # accelerometer or tip-tilt streams), on overlapping Hanning-windowed
+    # segments as in welch_psd.  Samples are added with add(); every time
+    # a window of npoints samples is complete its PSD is added to the
+    # average.
+    #
+    #   npoints: number of points of the windows
+    #     fsamp: sampling frequency
+    #    nshift: OPTIONAL number of points between windows (npoints//2)
+    #      navg: OPTIONAL if given, the PSD is an exponential average over
+    #            about navg windows, so that it follows changes in the
+    #            signal; otherwise it is the average of all the windows.
+    #
+    # psd(), cumint() and result() (a Returnpsd) give the current average.
+
+    def __init__(self, npoints, fsamp, nshift=None, navg=None):
+        self.npoints = npoints
+        self.fsamp = fsamp
+        if nshift is None:
+            nshift = npoints//2
+        self.nshift = nshift
+        self.navg = navg
+        self.freq = psd_freq(npoints, fsamp)
+        self.reset()
+
+    def reset(self):
+        self.nseg = 0
+        self.buf = None
+        self.avg = None
+
+    def restart(self):
+        # Drops the samples of the incomplete window, keeping the average:
+        # after a gap in the signal, so that no window spans it
+        self.buf = None
+
+    def add(self, samples):
+        # Adds samples, (n,) or (n, ndim), and returns the number of
+        # windows completed
+        samples = np.asarray(samples, dtype=float)
+        if samples.ndim == 1:
+            samples = samples[:,np.newaxis]
+        if self.buf is None:
+            self.buf = samples.copy()
+        elif samples.shape[1:] != self.buf.shape[1:]:
+            raise ValueError("samples have %d dimensions instead of %d" % (
+                samples.shape[1], self.buf.shape[1]))
+        else:
+            self.buf = np.concatenate((self.buf, samples))
+
+        segs = segments(self.buf, self.npoints, self.nshift)
+        nnew = segs.shape[0]
+        if nnew == 0:
+            return 0
+        psd = segment_psd(segs, axis=1, window=psd_window(self.npoints))
+        self.buf = self.buf[nnew*self.nshift:].copy()
+
+        if (self.navg is None) or (self.nseg + nnew <= self.navg):
+            # running mean over all the windows
+            total = np.sum(psd, axis=0)
+            if self.avg is None:
+                self.avg = total/nnew
+            else:
+                self.avg += (total - nnew*self.avg)/(self.nseg + nnew)
+        else:
+            # exponential average, one window at a time
+            alpha = 1./self.navg
+            if self.avg is None:
+                self.avg = psd[0].copy()
+                psd = psd[1:]
+            for p in psd:
+                self.avg += alpha*(p - self.avg)
+        self.nseg += nnew
+        return nnew
+
+    def psd(self):
+        if self.avg is None:
+            return None
+        return np.squeeze(self.avg)
+
+    def cumint(self):
+        if self.avg is None:
+            return None
+        return np.squeeze(psd_cumint(self.avg, axis=0))
+
+    def result(self):
+        return Returnpsd(self.freq, self.psd(), self.cumint())
+
+
+def accumulate_shm(spsd, stream, nsamples, timeout=None, poll=0.0005):
+    # Adds the next nsamples samples from the shared memory stream (a
+    # scexao_shm.shm, e.g. the labjack accelerometers) to the StreamingPSD
+    # spsd, one frame (with the value of every channel) per sample, waiting
+    # for each one with frame_wait.  Gives up after timeout seconds without
+    # a new frame.  If frames are missed, the samples before the gap that
+    # do not fill a window are dropped.  Returns the number of samples
+    # added.
+    waiter = frame_wait.frame_waiter(stream, poll=poll)
+    count = 0
+    block = []
+    skipped = 0
+    try:
+        while count < nsamples:
+            if waiter.wait_new_frame(timeout) is None:
+                break
+            if waiter.skipped != skipped:
+                # the windows must be of consecutive samples
+                skipped = waiter.skipped
+                block = []
+                spsd.restart()
+            block.append(np.array(stream.get_data(False, True), dtype=float).ravel())
+            count += 1
+            # feed the PSD a window's worth at a time
+            if len(block) >= spsd.nshift:
+                spsd.add(block)
+                block = []
+    finally:
+        waiter.close()
+    if block:
+        spsd.add(block)
+    return count
@@ -1,6 +1,7 @@
 import numpy as np
 import pdb
 from scipy.signal import medfilt2d as medfilt
+from img_tools import find_peaks, disk_means
 
 # =====================================================================
 def mkdisk((xs, ys), (x0, y0), r0):
@@ -117,36 +118,11 @@ def locate_speckles(img, nspk=1, xr=5.0, nbit=20):
     - nspk : # of speckles to profile
     - xr   : exclusion radius
     -------------------------------- '''
-    temp     = img.copy()       # to make sure we don't damage image
-    mfilt    = medfilt(temp, 3) # median filtered, kernel size = 3
-    (ys, xs) = mfilt.shape      # size of "image"
-    spx, spy = [], []           # speckle coordinates
-    spi = []                    # speckle intensity (ADU)
-    ni = 0                      # number of identified speckles
-
-    while (ni < nspk):
-        # locate maximum in image
-        x1 = mfilt.argmax() %  xs
-        y1 = mfilt.argmax() // xs
-        # fine-tune coordinates
-        m1 = mkdisk((xs, ys), (x1, y1), xr)
-        if nbit == 0:
-            (x11, y11) = (x1, y1)
-            m11 = m1
-            mfilt *= (1.0-m1)
-        else:
-            (x11, y11) = find_psf_center((m1) * mfilt, False, nbit)
-            m11 = mkdisk((xs, ys), (x11, y11), xr)
-            mfilt *= (1.0 - m11)
-
-        intens = np.mean(img[m11 > 0])
-
-        # increment counter of speckles
-        spx.append(x11)
-        spy.append(y11)
-        spi.append(intens)
-        ni += 1
+    mfilt    = medfilt(img.copy(), 3) # median filtered, kernel size = 3
+    (spx, spy) = find_peaks(mfilt, nspk, xr, nbit, mfilt.shape[1])
+    spi = disk_means(img, spx, spy, xr) # speckle intensity (ADU)
 
+    spx, spy, spi = spx.tolist(), spy.tolist(), spi.tolist()
     return (spx, spy, spi)
 
 # =====================================================================
@@ -11,6 +11,10 @@ brate = 9600 # baud rate for Zaber actuators
 tout  = 0.1  # time out for serial connection (in sec)
 delay = 0.1  # safety delay between send - receive
 
+motion_cmds    = (1, 20, 21) # home, move absolute, move relative
+reply_timeout  = 1.0  # time out for the reply to a command (in sec)
+motion_timeout = 60.0 # time out for the end of a motion (in sec)
+
 # -----------------------------------------------
 #  this is for the SCExAO status monitor program
 # -----------------------------------------------
@@ -217,15 +221,39 @@ class zaber_chain:
         if not quiet:
             print(full_cmd)
         self.ser.write(zab_cmd(full_cmd))
-        dummy = []
-        while dummy == []:
-            dummy = map(ord, self.ser.readline())
-            time.sleep(0.1)
-        reply = zaberByte2step(dummy[2:])
+        # motion commands only answer once the motion is over
+        if cmd in motion_cmds:
+            timeout = motion_timeout
+        else:
+            timeout = reply_timeout
+        reply = self.read_reply(idn, cmd, timeout)
+        if reply is None:
+            print("zaber %d: no reply to command %d" % (int(idn), cmd))
+            return(None)
         if not quiet:
             print("zaber %d = %d" % (int(idn), reply))
         return(reply)
 
+    def read_reply(self, idn, cmd, timeout):
+        # reads the 6-byte replies of the chain as soon as they arrive,
+        # until the one of zaber idn to command cmd, and returns its data
+        # (None if none within timeout seconds).  Other replies are dropped.
+        t0 = time.time()
+        while True:
+            left = timeout - (time.time() - t0)
+            if left <= 0:
+                return(None)
+            self.ser.timeout = left
+            dummy = map(ord, self.ser.read(6))
+            if len(dummy) < 6:
+                return(None)
+            if dummy[1] == 255:
+                print("zaber %d error %d" % (dummy[0], zaberByte2step(dummy[2:])))
+                if dummy[0] == int(idn):
+                    return(None)
+            elif dummy[0] == int(idn) and dummy[1] == cmd:
+                return(zaberByte2step(dummy[2:]))
+
     def move(self, idn, pos, force=False, relative=False, quiet=False):
         cmd = 20
         if relative:
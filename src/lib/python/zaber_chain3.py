@@ -27,6 +27,12 @@ def zaberByte2step(zb):
         
     return nstep
 
+# Return Status (command 54) of a zaber in motion: home, manual move
+# (velocity and displacement modes), move to stored position, absolute,
+# relative and constant speed moves, stopping.  Other statuses (0 idle,
+# 65 parked, 90 disabled) are not motion: the zaber will not stop.
+moving_status = (1, 10, 11, 18, 20, 21, 22, 23)
+
 def zab_cmd(cmd):
     nl = []
     instr = list(map(int, cmd.split(' ')))
@@ -58,43 +64,91 @@ class zaber:
             print("Zaber chain %s not connected" %zaberchain)
             sys.exit()
 
+    # home, move and push return as soon as the command is sent (the zaber
+    # answers when the motion is over); see wait().  delay is not used
+    # anymore.
     def home(self, idn, devname, log=True):
-        self.command(idn, 1, 0)
+        self.command(idn, 1, 0, reply=False)
         if log:
             logit.logit(devname,'Homed')
 
     def move(self, idn, pos, devname, log=True, delay=0.1):
-        self.command(idn, 20, pos)
-        time.sleep(delay)
+        self.command(idn, 20, pos, reply=False)
         if log:
             logit.logit(devname,'moved_to_'+str(pos))
         
     def push(self, idn, step, devname, log=True, delay=0.1):
-        self.command(idn, 21, step)
-        time.sleep(delay)
+        self.command(idn, 21, step, reply=False)
         if log:
             logit.logit(devname,'moved_rel_'+str(step))
       
+    def position(self, idn):
+        # current position, without updating the status
+        return self.command(idn, 60, 0)
+
+    def busy(self, idn):
+        # True if the zaber is moving (its Return Status is one of
+        # moving_status), None if it does not answer
+        status = self.command(idn, 54, 0)
+        if status == '':
+            return None
+        return status in moving_status
+
     def status(self, idn, devname):
-        pos = self.command(idn, 60, 0)
+        pos = self.position(idn)
         subprocess.call(["/home/scexao/bin/scexaostatus", "set", devname, str(pos)])
         return pos
 
-    def command(self, idn, cmd, arg, quiet=True):
+    def wait(self, idn, devname, delay=0.2, timeout=0):
+        # waits until the zaber reports that it is idle, checking every
+        # delay seconds, and returns its position (gives up with an IOError
+        # after timeout seconds, if not 0).  If the status cannot be read,
+        # waits until two positions agree instead.
+        t0 = time.time()
+        pos0 = None
+        while True:
+            busy = self.busy(idn)
+            if not busy:
+                pos = self.status(idn, devname)
+                if busy is not None or pos == pos0:
+                    return pos
+                pos0 = pos
+            if timeout and time.time()-t0 > timeout:
+                raise IOError("%s still moving after %.1f s" % (devname, timeout))
+            time.sleep(delay)
+
+    def read_reply(self, idn, cmd, timeout=0.8):
+        # reads the 6-byte replies of the chain as soon as they arrive,
+        # until the one of zaber idn to command cmd, and returns its data
+        # ('' if none within timeout seconds).  Other replies, such as
+        # the end of an earlier move, are dropped.
+        t0 = time.time()
+        while True:
+            left = timeout - (time.time()-t0)
+            if left <= 0:
+                return ''
+            self.s.timeout = left
+            reply = bytearray(self.s.read(6))
+            if len(reply) < 6:
+                return ''
+            if reply[1] == 255:
+                print("zaber %d error %d" % (reply[0], zaberByte2step(reply[2:])))
+                if reply[0] == int(idn):
+                    return ''
+            if reply[0] == int(idn) and reply[1] == cmd:
+                return zaberByte2step(reply[2:])
+
+    def command(self, idn, cmd, arg, quiet=True, reply=True, timeout=0.8):
         args = ' '.join(map(str, step2zaberByte(int(arg))))
         full_cmd = '%s %d %s' % (idn, cmd, args)
         #if not quiet:
         self.s.write(zab_cmd(full_cmd))
-        for k in range(8):
-            dummy = self.s.readline()
-            if dummy != ''.encode():
-                break
-            time.sleep(0.1)
-        reply=''
-        if len(dummy) > 2:
-            reply = zaberByte2step(dummy[2:])
+        self.s.flush()
+        if not reply:
+            return None
+        reply = self.read_reply(idn, cmd, timeout)
         if not quiet:
-            print("zaber %d = %d" % (int(idn), reply))
+            print("zaber %d = %s" % (int(idn), str(reply)))
         return(reply)
 
     def close(self):
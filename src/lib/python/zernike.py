@@ -2,9 +2,14 @@ import numpy as np, matplotlib.pyplot as plt, pyfits as pf
 from scipy.misc import factorial as fac
 from scipy import *
 import pdb
+import os, hashlib
 
 shift = np.fft.fftshift
 
+home = os.getenv('HOME')
+# where ZernikeBasis keeps the bases it has computed
+basis_dir = home + '/conf/zernike_basis/'
+
 # ----------------------------------------
 #   equivalent of the IDL dist function
 # ----------------------------------------
@@ -129,6 +134,139 @@ def mkzer1_vector(j, xymask):
     (n,m) = noll_2_zern(j)
     return(mkzer_vector(n, m, xymask))
 
+# --------------------------------------------------------
+#          basis of Noll-ordered modes on a pupil
+# --------------------------------------------------------
+class ZernikeBasis(object):
+    '''------------------------------------------
+    The first nmodes Zernike polynomials (Noll index
+    1 to nmodes) within a disk of radius rad, at the
+    center of a (size, size) array, sampled on a pupil.
+
+    pupil: (size, size) array, non-zero in the pupil
+           (e.g. subaru_pupil.Subaru_pupil((size, size), rad))
+           default is the disk of radius rad
+    extra: optional list of (size, size) arrays, added
+           to the basis after the Zernikes
+           (e.g. sectors.sector((size, size), rad, i))
+    ortho: if True, the modes are orthonormalized on the
+           pupil (Gram-Schmidt, in Noll order), otherwise
+           they are only normalized to unit rms on it
+    cache: if True, the basis is kept in basis_dir, keyed
+           by all of the above, and loaded from there the
+           next time
+
+    attributes:
+    - modes:   (nmodes, size, size) cube, 0 outside the pupil
+    - vectors: (nmodes, npix) the modes on the pupil pixels
+    - mask:    (size, size) boolean pupil
+
+    project(frames)     -> coefficients of the modes
+    reconstruct(coeffs) -> frames
+   ------------------------------------------ '''
+
+    # bases already loaded, by key
+    loaded = {}
+
+    def __init__(self, nmodes, size, rad, pupil=None, extra=None,
+                 ortho=True, cache=True):
+        self.nmodes = nmodes
+        self.size = size
+        self.rad = rad
+        self.ortho = ortho
+
+        if pupil is None:
+            pupil = dist((size, size)) <= rad
+        self.mask = np.asarray(pupil) != 0
+        if extra is None:
+            extra = []
+        extra = [np.asarray(e, dtype=float) for e in extra]
+        self.nextra = len(extra)
+
+        self.key = self.mkkey(extra)
+        self.path = basis_dir + "zernike_basis_%s.npy" % (self.key,)
+
+        vectors = ZernikeBasis.loaded.get(self.key)
+        if (vectors is None) and cache and os.path.exists(self.path):
+            vectors = np.load(self.path)
+        if vectors is None:
+            vectors = self.mkvectors(extra)
+            if cache:
+                if not os.path.isdir(basis_dir):
+                    os.makedirs(basis_dir)
+                np.save(self.path, vectors)
+        ZernikeBasis.loaded[self.key] = vectors
+
+        self.vectors = vectors
+        self.npix = vectors.shape[1]
+
+        # least-squares projection onto the modes
+        if ortho:
+            self.proj = vectors.T / float(self.npix)
+        else:
+            self.proj = np.linalg.pinv(vectors)
+
+        self.modes = self.reconstruct(np.eye(len(vectors)))
+
+    def mkkey(self, extra):
+        h = hashlib.md5()
+        h.update(repr((self.nmodes, self.size, float(self.rad),
+                       bool(self.ortho))).encode())
+        h.update(np.packbits(self.mask).tobytes())
+        for e in extra:
+            h.update(np.ascontiguousarray(e).tobytes())
+        return h.hexdigest()
+
+    def mkvectors(self, extra):
+        ''' the modes on the pupil pixels, one per row '''
+        inp = np.nonzero(self.mask)
+        rho = dist((self.size, self.size))[inp] / float(self.rad)
+        azi = azim((self.size, self.size))[inp]
+
+        # powers of rho used by the radial polynomials
+        nmax = noll_2_zern(self.nmodes)[0]
+        rpow = np.ones((nmax + 1, rho.size))
+        for k in range(1, nmax + 1):
+            rpow[k] = rpow[k - 1] * rho
+
+        vectors = np.empty((self.nmodes + len(extra), rho.size))
+        for j in range(1, self.nmodes + 1):
+            (n, m) = noll_2_zern(j)
+            (coeffs, pows) = zer_coeff(n, np.abs(m))
+            res = np.dot(coeffs, rpow[np.array(pows, dtype=int)])
+            if m > 0:
+                res *= np.cos(m * azi)
+            if m < 0:
+                res *= np.sin(-m * azi)
+            vectors[j - 1] = res
+        for i, e in enumerate(extra):
+            vectors[self.nmodes + i] = e[inp]
+
+        if self.ortho:
+            # QR is Gram-Schmidt in Noll order; keep the signs of the
+            # original modes
+            q, r = np.linalg.qr(vectors.T)
+            q *= np.where(np.diag(r) < 0, -1.0, 1.0)
+            vectors = q.T * np.sqrt(rho.size)
+        else:
+            vectors /= np.sqrt(np.mean(vectors**2, axis=1))[:, np.newaxis]
+        return vectors
+
+    def project(self, frames):
+        ''' coefficients of the modes in a (size, size) frame,
+        or in each frame of a (N, size, size) cube -> (N, nmodes) '''
+        frames = np.asarray(frames)
+        return np.dot(frames[..., self.mask], self.proj)
+
+    def reconstruct(self, coeffs, out=None):
+        ''' frame(s) made of the modes with coefficients coeffs
+        (nmodes,) or (N, nmodes) '''
+        coeffs = np.asarray(coeffs, dtype=float)
+        if out is None:
+            out = np.zeros(coeffs.shape[:-1] + (self.size, self.size))
+        out[..., self.mask] = np.dot(coeffs, self.vectors)
+        return out
+
 # --------------------------------------------------------
 #                     main program
 # --------------------------------------------------------